@@ -0,0 +1,132 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks the XML API client against an in-process emulator.
+
+No credentials or network access are needed. The JSON report is written to
+--report, and with --baseline the throughput of every result is compared
+with an earlier report made with the same flags.
+
+Usage:
+  python benchmark.py [--report=<path or ->] [--baseline=<report.json>]
+"""
+
+import json
+import logging
+import sys
+
+import gflags
+
+import gcs.gcs_benchmark as gcs_benchmark
+
+FLAGS = gflags.FLAGS
+
+gflags.DEFINE_enum(
+    'logging_level', 'INFO', ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+    'Set the level of logging detail.')
+gflags.DEFINE_list(
+    'benchmarks', list(gcs_benchmark.BENCHMARKS),
+    'Benchmarks to run.')
+gflags.DEFINE_list(
+    'object_sizes', [str(size) for size in gcs_benchmark.DEFAULT_OBJECT_SIZES],
+    'Object sizes in bytes for the upload and download benchmarks.')
+gflags.DEFINE_list(
+    'concurrency_levels',
+    [str(level) for level in gcs_benchmark.DEFAULT_CONCURRENCY_LEVELS],
+    'Numbers of operations run at once.')
+gflags.DEFINE_float(
+    'latency_ms', gcs_benchmark.DEFAULT_LATENCY_SEC * 1000,
+    'Emulated latency of every request, in milliseconds.')
+gflags.DEFINE_float(
+    'bandwidth_mbps',
+    gcs_benchmark.DEFAULT_BANDWIDTH_BYTES_PER_SEC / gcs_benchmark.MB,
+    'Emulated bandwidth of every request, in megabytes per second. 0 for no '
+    'limit.')
+gflags.DEFINE_integer(
+    'bytes_per_run', gcs_benchmark.DEFAULT_BYTES_PER_RUN,
+    'Bytes transferred by each upload or download run.')
+gflags.DEFINE_integer(
+    'max_operations', gcs_benchmark.DEFAULT_MAX_OPERATIONS,
+    'Maximum number of operations in an upload or download run.')
+gflags.DEFINE_integer(
+    'metadata_operations', gcs_benchmark.DEFAULT_METADATA_OPERATIONS,
+    'Number of metadata requests per run.')
+gflags.DEFINE_integer(
+    'list_objects', gcs_benchmark.DEFAULT_LIST_OBJECTS,
+    'Number of objects in the listed bucket.')
+gflags.DEFINE_string(
+    'report', '-', 'File that receives the JSON report, or - for stdout.')
+gflags.DEFINE_string(
+    'baseline', '', 'Earlier JSON report to compare the throughput with.')
+gflags.DEFINE_float(
+    'regression_tolerance', 0.1,
+    'Fraction by which throughput may drop below the baseline before the '
+    'run fails.')
+
+
+def main(argv):
+  """Runs the benchmarks, writes the report and compares it.
+
+  Returns:
+    The process exit status: 1 if a result regressed against --baseline,
+    otherwise 0.
+  """
+  try:
+    argv = FLAGS(argv)
+  except gflags.FlagsError, e:
+    logging.error('%s\\nUsage: %s ARGS\\n%s', e, argv[0], FLAGS)
+    sys.exit(1)
+  logging.basicConfig(level=getattr(logging, FLAGS.logging_level))
+
+  report = gcs_benchmark.run_benchmarks(
+      FLAGS.benchmarks,
+      [int(size) for size in FLAGS.object_sizes],
+      [int(level) for level in FLAGS.concurrency_levels],
+      FLAGS.latency_ms / 1000,
+      FLAGS.bandwidth_mbps * gcs_benchmark.MB or None,
+      FLAGS.bytes_per_run, FLAGS.max_operations, FLAGS.metadata_operations,
+      FLAGS.list_objects)
+  for result in report['results']:
+    logging.info('%-40s %10.1f ops/s %8.1f MB/s', result['id'],
+                 result['ops_per_sec'], result.get('mb_per_sec', 0))
+
+  report_file = sys.stdout
+  if FLAGS.report != '-': report_file = open(FLAGS.report, 'w')
+  try:
+    json.dump(report, report_file, indent=2, sort_keys=True)
+    report_file.write('\n')
+  finally:
+    if report_file is not sys.stdout: report_file.close()
+
+  if not FLAGS.baseline:
+    return 0
+  baseline_file = open(FLAGS.baseline, 'r')
+  try:
+    baseline = json.load(baseline_file)
+  finally:
+    baseline_file.close()
+  status = 0
+  for comparison in gcs_benchmark.compare_reports(
+      baseline, report, FLAGS.regression_tolerance):
+    log = logging.info
+    if comparison['regression']:
+      log = logging.error
+      status = 1
+    log('%-40s %10.1f -> %10.1f ops/s (%+.1f%%)', comparison['id'],
+        comparison['baseline'], comparison['current'],
+        comparison['change'] * 100)
+  return status
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
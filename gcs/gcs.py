@@ -51,6 +51,14 @@ class Gcs(object):
     """
     raise NotImplementedError('You need to override this function')
 
+  def list_buckets(self):
+    """Get the Cloud Storage buckets as parsed records.
+
+    Raises:
+      NotImplementedError if the method is not implemented in the subclass.
+    """
+    raise NotImplementedError('You need to override this function')
+
   def get_bucket(self, bucket_name):
     """Get the info for a specific bucket.
 
@@ -62,6 +70,23 @@ class Gcs(object):
     """
     raise NotImplementedError('You need to override this function')
 
+  def list_objects(self, bucket_name, prefix=None, delimiter=None,
+                   marker=None, max_keys=None):
+    """Lists the objects in a bucket, following every page of the listing.
+
+    Args:
+      bucket_name: String name of the bucket.
+      prefix: Only list objects whose names start with this string.
+      delimiter: Roll up names containing this string after the prefix into
+          common prefixes.
+      marker: Only list objects whose names sort after this string.
+      max_keys: The maximum number of entries requested per page.
+
+    Raises:
+      NotImplementedError if the method is not implemented in the subclass.
+    """
+    raise NotImplementedError('You need to override this function')
+
   def get_bucket_cors(self, bucket_name):
     """Get CORS for the specified bucket.
 
@@ -73,6 +98,17 @@ class Gcs(object):
     """
     raise NotImplementedError('You need to override this function')
 
+  def get_bucket_cors_rules(self, bucket_name):
+    """Get CORS for the specified bucket as parsed records.
+
+    Args:
+      bucket_name: String name of the bucket.
+
+    Raises:
+      NotImplementedError if the method is not implemented in the subclass.
+    """
+    raise NotImplementedError('You need to override this function')
+
   def get_bucket_location(self, bucket_name):
     """Get location of the specified bucket.
 
@@ -116,23 +152,65 @@ class Gcs(object):
     """
     raise NotImplementedError('You need to override this function')
 
-  def delete_bucket(self, bucket_name):
+  def delete_bucket(self, bucket_name, recursive=False, concurrency=None):
     """Deletes the given bucket.
 
     Args:
       bucket_name: The string name of the bucket to delete.
+      recursive: If True, delete every object in the bucket first.
+      concurrency: The number of objects deleted at once when recursive.
 
     Raises:
       NotImplementedError if the method is not implemented in the subclass.
     """
     raise NotImplementedError('You need to override this function')
 
-  def get_object(self, bucket_name, object_name):
+  def get_object(self, bucket_name, object_name, decompress=False):
     """Gets an object in a Cloud Storage bucket.
 
     Args:
       bucket_name: String name of the bucket to set the cors on.
       object_name: The name of the object.
+      decompress: If True, transfer gzip-encoded objects compressed and
+          inflate them locally.
+
+    Raises:
+      NotImplementedError if the method is not implemented in the subclass.
+    """
+    raise NotImplementedError('You need to override this function')
+
+  def download_object(self, bucket_name, object_name, sink, buffer_size=None,
+                      decompress=False, range_size=None):
+    """Streams an object in a Cloud Storage bucket to a sink.
+
+    Args:
+      bucket_name: String name of the bucket.
+      object_name: The name of the object.
+      sink: A string local file path, a file-like object with a write method,
+          or a callable that accepts each chunk as a string.
+      buffer_size: The maximum number of bytes written to the sink at once.
+      decompress: If True, transfer gzip-encoded objects compressed and
+          inflate them locally.
+      range_size: The maximum number of bytes fetched by each request.
+
+    Raises:
+      NotImplementedError if the method is not implemented in the subclass.
+    """
+    raise NotImplementedError('You need to override this function')
+
+  def download_object_sliced(self, bucket_name, object_name, file_path,
+                             slice_size=None, concurrency=None,
+                             buffer_size=None):
+    """Downloads an object to a local file with concurrent Range requests.
+
+    Args:
+      bucket_name: String name of the bucket.
+      object_name: The name of the object.
+      file_path: The local file path to write to.
+      slice_size: The number of bytes in each slice.
+      concurrency: The number of slices downloaded at once.
+      buffer_size: The maximum number of bytes each slice holds in memory at
+          once.
 
     Raises:
       NotImplementedError if the method is not implemented in the subclass.
@@ -151,6 +229,18 @@ class Gcs(object):
     """
     raise NotImplementedError('You need to override this function')
 
+  def get_object_acl_entries(self, bucket_name, object_name):
+    """Gets an object's ACLs in a Cloud Storage bucket as parsed records.
+
+    Args:
+      bucket_name: String name of the bucket.
+      object_name: The name of the object.
+
+    Raises:
+      NotImplementedError if the method is not implemented in the subclass.
+    """
+    raise NotImplementedError('You need to override this function')
+
   def get_object_metadata(self, bucket_name, object_name):
     """Gets an object's ACLs in a Cloud Storage bucket.
 
@@ -164,7 +254,8 @@ class Gcs(object):
     raise NotImplementedError('You need to override this function')
 
   def insert_object(self, bucket_name, file_path=None, object_name=None,
-                    content_type=None, content_encoding=None, acl=None):
+                    content_type=None, content_encoding=None, acl=None,
+                    content_md5=None, compress=False):
     """Insert an object into a Cloud Storage bucket.
 
     Args:
@@ -179,6 +270,79 @@ class Gcs(object):
       acl: A string predefined Google ACL, as defined here:
           developers.google.com/storage/docs/reference-headers#xgoogacl.
           Defaults to private.
+      content_md5: The hex MD5 digest of the file, sent as Content-MD5.
+      compress: If True, gzip the file while it is sent.
+
+    Raises:
+      NotImplementedError if the method is not implemented in the subclass.
+    """
+    raise NotImplementedError('You need to override this function')
+
+  def insert_object_stream(self, bucket_name, stream, object_name, size=None,
+                           content_type=None, content_encoding=None, acl=None,
+                           chunk_size=None, content_md5=None, compress=False):
+    """Insert an object into a Cloud Storage bucket from a stream.
+
+    Args:
+      bucket_name: The name of the bucket to insert.
+      stream: A file-like object with a read method, or an iterable of
+          strings.
+      object_name: The string name for the object.
+      size: The number of bytes to upload.
+      content_type: An optional content type string value for the Content-Type
+          header.
+      content_encoding: An optional encoding string value for the
+          Content-Encoding header.
+      acl: A string predefined Google ACL.
+      chunk_size: The maximum number of bytes read from the stream at once.
+      content_md5: The hex MD5 digest of the data, sent as Content-MD5.
+      compress: If True, gzip the data while it is sent.
+
+    Raises:
+      NotImplementedError if the method is not implemented in the subclass.
+    """
+    raise NotImplementedError('You need to override this function')
+
+  def insert_object_resumable(self, bucket_name, file_path, object_name=None,
+                              content_type=None, content_encoding=None,
+                              acl=None, chunk_size=None, state_path=None):
+    """Insert an object into a Cloud Storage bucket with a resumable upload.
+
+    Args:
+      bucket_name: The name of the bucket to insert.
+      file_path: The local file path to the file to upload.
+      object_name: An optional string name for the object. Defaults to the file
+          name.
+      content_type: An optional content type string value for the Content-Type
+          header.
+      content_encoding: An optional encoding string value for the
+          Content-Encoding header.
+      acl: A string predefined Google ACL.
+      chunk_size: The number of bytes sent per request.
+      state_path: The local path of the checkpoint file.
+
+    Raises:
+      NotImplementedError if the method is not implemented in the subclass.
+    """
+    raise NotImplementedError('You need to override this function')
+
+  def insert_object_parallel(self, bucket_name, file_path, object_name=None,
+                             content_type=None, content_encoding=None,
+                             acl=None, part_size=None, concurrency=None):
+    """Insert an object into a Cloud Storage bucket with parallel uploads.
+
+    Args:
+      bucket_name: The name of the bucket to insert.
+      file_path: The local file path to the file to upload.
+      object_name: An optional string name for the object. Defaults to the file
+          name.
+      content_type: An optional content type string value for the Content-Type
+          header.
+      content_encoding: An optional encoding string value for the
+          Content-Encoding header.
+      acl: A string predefined Google ACL.
+      part_size: The number of bytes in each component.
+      concurrency: The number of components uploaded at once.
 
     Raises:
       NotImplementedError if the method is not implemented in the subclass.
@@ -214,3 +378,70 @@ class Gcs(object):
       NotImplementedError if the method is not implemented in the subclass.
     """
     raise NotImplementedError('You need to override this function')
+
+  def delete_objects(self, bucket_name, object_names, concurrency=None):
+    """Delete many objects from a Cloud Storage bucket concurrently.
+
+    Args:
+      bucket_name: The name of the bucket.
+      object_names: An iterable of string object names.
+      concurrency: The number of objects deleted at once.
+
+    Raises:
+      NotImplementedError if the method is not implemented in the subclass.
+    """
+    raise NotImplementedError('You need to override this function')
+
+  def copy_prefix(self, bucket_name, prefix, new_bucket_name,
+                  new_prefix=None, marker=None, acl=None, concurrency=None):
+    """Copies every object under a prefix with server-side copies.
+
+    Args:
+      bucket_name: The name of the source bucket.
+      prefix: The string prefix of the source object names.
+      new_bucket_name: The name of the destination bucket.
+      new_prefix: The string prefix that replaces prefix in the copies.
+      marker: Only copy objects whose names sort after this string.
+      acl: A string predefined Google ACL for the copies.
+      concurrency: The number of objects copied at once.
+
+    Raises:
+      NotImplementedError if the method is not implemented in the subclass.
+    """
+    raise NotImplementedError('You need to override this function')
+
+  def move_prefix(self, bucket_name, prefix, new_bucket_name,
+                  new_prefix=None, marker=None, acl=None, concurrency=None):
+    """Moves every object under a prefix with server-side copies.
+
+    Args:
+      bucket_name: The name of the source bucket.
+      prefix: The string prefix of the source object names.
+      new_bucket_name: The name of the destination bucket.
+      new_prefix: The string prefix that replaces prefix in the new names.
+      marker: Only move objects whose names sort after this string.
+      acl: A string predefined Google ACL for the copies.
+      concurrency: The number of objects moved at once.
+
+    Raises:
+      NotImplementedError if the method is not implemented in the subclass.
+    """
+    raise NotImplementedError('You need to override this function')
+
+  def sync_directory(self, bucket_name, directory, prefix=None,
+                     download=False, delete=False, concurrency=None):
+    """Makes a bucket and a local directory hold the same files.
+
+    Args:
+      bucket_name: The name of the bucket.
+      directory: The string path of the local directory.
+      prefix: An optional object name prefix that maps to the directory.
+      download: If True, copy the bucket to the directory. Otherwise copy the
+          directory to the bucket.
+      delete: If True, also delete what does not exist on the source side.
+      concurrency: The number of files transferred at once.
+
+    Raises:
+      NotImplementedError if the method is not implemented in the subclass.
+    """
+    raise NotImplementedError('You need to override this function')
@@ -0,0 +1,374 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Non-blocking Google Cloud Storage client.
+
+Wraps a gcs.Gcs client so that every call returns at once with a
+multiprocessing.pool.AsyncResult. Calls run on a shared pool of worker
+threads; give the wrapped client a gcs_transport.PooledHttpTransport so the
+workers share keep-alive connections. Methods that yield their results, such
+as list_objects and copy_prefix, run to completion on a worker, and their
+AsyncResult holds the list of everything they yielded.
+
+Example:
+  async_client = GcsAsync(gcs_client, concurrency=64)
+  results = [async_client.get_object_metadata('bucket', name)
+             for name in names]
+  metadata = [result.get() for result in results]
+"""
+
+import multiprocessing.pool
+import threading
+
+DEFAULT_CONCURRENCY = 32
+DEFAULT_MAX_PENDING = 1024
+
+
+class GcsAsync(object):
+  """Runs gcs.Gcs calls concurrently and returns their results as futures.
+
+  Attributes:
+    concurrency: The number of calls that run at once.
+    max_pending: The number of calls that may be submitted but not finished.
+        Further calls block until one completes.
+  """
+
+  def __init__(self, gcs_client, concurrency=DEFAULT_CONCURRENCY,
+               max_pending=DEFAULT_MAX_PENDING):
+    """Inits GcsAsync with a client and concurrency limits.
+
+    Args:
+      gcs_client: An instance of gcs.Gcs with a thread-safe transport.
+      concurrency: The number of calls that run at once.
+      max_pending: The number of calls that may be submitted but not finished.
+    """
+    self.concurrency = concurrency
+    self.max_pending = max(max_pending, concurrency)
+    self._gcs_client = gcs_client
+    self._pool = multiprocessing.pool.ThreadPool(concurrency)
+    self._pending = threading.BoundedSemaphore(self.max_pending)
+
+  def close(self):
+    """Waits for submitted calls to finish and stops the worker threads."""
+    self._pool.close()
+    self._pool.join()
+
+  def get_buckets(self):
+    """Get a list of Cloud Storage buckets. See gcs.Gcs.get_buckets.
+
+    Returns:
+      A multiprocessing.pool.AsyncResult.
+    """
+    return self._submit(self._gcs_client.get_buckets)
+
+  def list_buckets(self):
+    """Get the buckets as parsed records. See gcs.Gcs.list_buckets.
+
+    Returns:
+      A multiprocessing.pool.AsyncResult.
+    """
+    return self._submit(self._gcs_client.list_buckets)
+
+  def get_bucket(self, bucket_name):
+    """Get the info for a specific bucket. See gcs.Gcs.get_bucket.
+
+    Returns:
+      A multiprocessing.pool.AsyncResult.
+    """
+    return self._submit(self._gcs_client.get_bucket, bucket_name)
+
+  def list_objects(self, bucket_name, prefix=None, delimiter=None,
+                   marker=None, max_keys=None):
+    """Lists the objects in a bucket. See gcs.Gcs.list_objects.
+
+    Returns:
+      A multiprocessing.pool.AsyncResult whose value is the list of
+      gcs_types.ObjectEntry records.
+    """
+    return self._submit(_collect, self._gcs_client.list_objects, bucket_name,
+                        prefix, delimiter, marker, max_keys)
+
+  def get_bucket_cors(self, bucket_name):
+    """Get CORS for the specified bucket. See gcs.Gcs.get_bucket_cors.
+
+    Returns:
+      A multiprocessing.pool.AsyncResult.
+    """
+    return self._submit(self._gcs_client.get_bucket_cors, bucket_name)
+
+  def get_bucket_cors_rules(self, bucket_name):
+    """Get parsed CORS rules. See gcs.Gcs.get_bucket_cors_rules.
+
+    Returns:
+      A multiprocessing.pool.AsyncResult.
+    """
+    return self._submit(self._gcs_client.get_bucket_cors_rules, bucket_name)
+
+  def get_bucket_location(self, bucket_name):
+    """Get location of the specified bucket. See gcs.Gcs.get_bucket_location.
+
+    Returns:
+      A multiprocessing.pool.AsyncResult.
+    """
+    return self._submit(self._gcs_client.get_bucket_location, bucket_name)
+
+  def insert_bucket(self, bucket_name, acl=None, location_constraint=None):
+    """Create a bucket. See gcs.Gcs.insert_bucket.
+
+    Returns:
+      A multiprocessing.pool.AsyncResult.
+    """
+    return self._submit(self._gcs_client.insert_bucket, bucket_name, acl,
+                        location_constraint)
+
+  def set_bucket_cors(self, bucket_name, origins=None, methods=None,
+                      response_headers=None, max_age_sec=None):
+    """Sets CORS on the specified bucket. See gcs.Gcs.set_bucket_cors.
+
+    Returns:
+      A multiprocessing.pool.AsyncResult.
+    """
+    return self._submit(self._gcs_client.set_bucket_cors, bucket_name, origins,
+                        methods, response_headers, max_age_sec)
+
+  def delete_bucket(self, bucket_name, recursive=False, concurrency=None):
+    """Deletes the given bucket. See gcs.Gcs.delete_bucket.
+
+    Returns:
+      A multiprocessing.pool.AsyncResult.
+    """
+    return self._submit(self._gcs_client.delete_bucket, bucket_name, recursive,
+                        concurrency)
+
+  def get_object(self, bucket_name, object_name, decompress=False):
+    """Gets an object in a Cloud Storage bucket. See gcs.Gcs.get_object.
+
+    Returns:
+      A multiprocessing.pool.AsyncResult.
+    """
+    return self._submit(self._gcs_client.get_object, bucket_name, object_name,
+                        decompress)
+
+  def download_object(self, bucket_name, object_name, sink, buffer_size=None,
+                      decompress=False, range_size=None):
+    """Streams an object to a sink. See gcs.Gcs.download_object.
+
+    Returns:
+      A multiprocessing.pool.AsyncResult.
+    """
+    return self._submit(self._gcs_client.download_object, bucket_name,
+                        object_name, sink, buffer_size, decompress,
+                        range_size)
+
+  def download_object_sliced(self, bucket_name, object_name, file_path,
+                             slice_size=None, concurrency=None,
+                             buffer_size=None):
+    """Downloads an object in slices. See gcs.Gcs.download_object_sliced.
+
+    Returns:
+      A multiprocessing.pool.AsyncResult.
+    """
+    return self._submit(self._gcs_client.download_object_sliced, bucket_name,
+                        object_name, file_path, slice_size, concurrency,
+                        buffer_size)
+
+  def get_object_acls(self, bucket_name, object_name):
+    """Gets an object's ACLs. See gcs.Gcs.get_object_acls.
+
+    Returns:
+      A multiprocessing.pool.AsyncResult.
+    """
+    return self._submit(self._gcs_client.get_object_acls, bucket_name,
+                        object_name)
+
+  def get_object_acl_entries(self, bucket_name, object_name):
+    """Gets an object's parsed ACLs. See gcs.Gcs.get_object_acl_entries.
+
+    Returns:
+      A multiprocessing.pool.AsyncResult.
+    """
+    return self._submit(self._gcs_client.get_object_acl_entries, bucket_name,
+                        object_name)
+
+  def get_object_metadata(self, bucket_name, object_name):
+    """Gets an object's metadata. See gcs.Gcs.get_object_metadata.
+
+    Returns:
+      A multiprocessing.pool.AsyncResult.
+    """
+    return self._submit(self._gcs_client.get_object_metadata, bucket_name,
+                        object_name)
+
+  def insert_object(self, bucket_name, file_path=None, object_name=None,
+                    content_type=None, content_encoding=None, acl=None,
+                    content_md5=None, compress=False):
+    """Insert an object. See gcs.Gcs.insert_object.
+
+    Returns:
+      A multiprocessing.pool.AsyncResult.
+    """
+    return self._submit(self._gcs_client.insert_object, bucket_name, file_path,
+                        object_name, content_type, content_encoding, acl,
+                        content_md5, compress)
+
+  def insert_object_stream(self, bucket_name, stream, object_name, size=None,
+                           content_type=None, content_encoding=None, acl=None,
+                           chunk_size=None, content_md5=None, compress=False):
+    """Insert an object from a stream. See gcs.Gcs.insert_object_stream.
+
+    Returns:
+      A multiprocessing.pool.AsyncResult.
+    """
+    return self._submit(self._gcs_client.insert_object_stream, bucket_name,
+                        stream, object_name, size, content_type,
+                        content_encoding, acl, chunk_size, content_md5,
+                        compress)
+
+  def insert_object_resumable(self, bucket_name, file_path, object_name=None,
+                              content_type=None, content_encoding=None,
+                              acl=None, chunk_size=None, state_path=None):
+    """Insert an object resumably. See gcs.Gcs.insert_object_resumable.
+
+    Returns:
+      A multiprocessing.pool.AsyncResult.
+    """
+    return self._submit(self._gcs_client.insert_object_resumable, bucket_name,
+                        file_path, object_name, content_type,
+                        content_encoding, acl, chunk_size, state_path)
+
+  def insert_object_parallel(self, bucket_name, file_path, object_name=None,
+                             content_type=None, content_encoding=None,
+                             acl=None, part_size=None, concurrency=None):
+    """Insert an object in parallel parts. See gcs.Gcs.insert_object_parallel.
+
+    Returns:
+      A multiprocessing.pool.AsyncResult.
+    """
+    return self._submit(self._gcs_client.insert_object_parallel, bucket_name,
+                        file_path, object_name, content_type,
+                        content_encoding, acl, part_size, concurrency)
+
+  def copy_object(self, original_bucket_name, original_object_name,
+                  new_bucket_name, new_object_name=None, acl=None):
+    """Copy an existing object. See gcs.Gcs.copy_object.
+
+    Returns:
+      A multiprocessing.pool.AsyncResult.
+    """
+    return self._submit(self._gcs_client.copy_object, original_bucket_name,
+                        original_object_name, new_bucket_name,
+                        new_object_name, acl)
+
+  def delete_object(self, bucket_name, object_name):
+    """Delete an existing object. See gcs.Gcs.delete_object.
+
+    Returns:
+      A multiprocessing.pool.AsyncResult.
+    """
+    return self._submit(self._gcs_client.delete_object, bucket_name,
+                        object_name)
+
+  def delete_objects(self, bucket_name, object_names, concurrency=None):
+    """Delete many objects. See gcs.Gcs.delete_objects.
+
+    Returns:
+      A multiprocessing.pool.AsyncResult whose value is the list of
+      (object_name, error) tuples.
+    """
+    return self._submit(_collect, self._gcs_client.delete_objects,
+                        bucket_name, object_names, concurrency)
+
+  def copy_prefix(self, bucket_name, prefix, new_bucket_name,
+                  new_prefix=None, marker=None, acl=None, concurrency=None):
+    """Copies every object under a prefix. See gcs.Gcs.copy_prefix.
+
+    Returns:
+      A multiprocessing.pool.AsyncResult whose value is the list of
+      (object_name, error, marker) tuples.
+    """
+    return self._submit(_collect, self._gcs_client.copy_prefix, bucket_name,
+                        prefix, new_bucket_name, new_prefix, marker, acl,
+                        concurrency)
+
+  def move_prefix(self, bucket_name, prefix, new_bucket_name,
+                  new_prefix=None, marker=None, acl=None, concurrency=None):
+    """Moves every object under a prefix. See gcs.Gcs.move_prefix.
+
+    Returns:
+      A multiprocessing.pool.AsyncResult whose value is the list of
+      (object_name, error, marker) tuples.
+    """
+    return self._submit(_collect, self._gcs_client.move_prefix, bucket_name,
+                        prefix, new_bucket_name, new_prefix, marker, acl,
+                        concurrency)
+
+  def sync_directory(self, bucket_name, directory, prefix=None,
+                     download=False, delete=False, concurrency=None):
+    """Syncs a local directory with a bucket. See gcs.Gcs.sync_directory.
+
+    Returns:
+      A multiprocessing.pool.AsyncResult.
+    """
+    return self._submit(self._gcs_client.sync_directory, bucket_name,
+                        directory, prefix, download, delete, concurrency)
+
+  def _submit(self, method, *args):
+    """Schedules a client call on the worker pool.
+
+    Blocks while max_pending calls are already outstanding.
+
+    Args:
+      method: The bound gcs.Gcs method to call.
+      *args: The positional arguments for the call.
+
+    Returns:
+      A multiprocessing.pool.AsyncResult for the call.
+    """
+    self._pending.acquire()
+    try:
+      return self._pool.apply_async(
+          _call_and_release, (method, args, self._pending))
+    except:
+      self._pending.release()
+      raise
+
+
+def _collect(method, *args):
+  """Runs a client method that yields its results to completion.
+
+  Args:
+    method: The bound gcs.Gcs generator method to call.
+    *args: The positional arguments for the call.
+
+  Returns:
+    The list of values the method yielded.
+  """
+  return list(method(*args))
+
+
+def _call_and_release(method, args, pending):
+  """Runs a client call and frees its pending slot.
+
+  Args:
+    method: The bound gcs.Gcs method to call.
+    args: A tuple of positional arguments.
+    pending: The threading.BoundedSemaphore tracking outstanding calls.
+
+  Returns:
+    The result of the call.
+  """
+  try:
+    return method(*args)
+  finally:
+    pending.release()
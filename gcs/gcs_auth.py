@@ -0,0 +1,256 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Shared OAuth 2.0 access tokens that are refreshed before they expire."""
+
+import datetime
+import logging
+import threading
+
+import httplib2
+
+DEFAULT_REFRESH_MARGIN_SEC = 300
+MIN_RETRY_DELAY_SEC = 5
+MAX_RETRY_DELAY_SEC = 60
+# How often to look again when the token has no known expiry.
+UNKNOWN_EXPIRY_CHECK_SEC = 60
+UNAUTHORIZED = 401
+
+
+class CredentialManager(object):
+  """Keeps one OAuth 2.0 access token fresh for every connection in a process.
+
+  A background thread refreshes the token refresh_margin_sec before it
+  expires, so requests never wait for a refresh. Every httplib2.Http
+  authorized by the manager reads the current token on each request.
+  Refreshes are serialized: when several requests see a 401 for the same
+  token, only the first one refreshes it. oauth2client writes refreshed
+  tokens back to the credentials' store, such as the credential file.
+
+  Attributes:
+    credentials: The oauth2client.client.OAuth2Credentials being managed.
+    refresh_margin_sec: How long before expiry the token is refreshed.
+  """
+
+  def __init__(self, credentials, storage=None,
+               refresh_margin_sec=DEFAULT_REFRESH_MARGIN_SEC, http=None):
+    """Inits CredentialManager with credentials.
+
+    Args:
+      credentials: An oauth2client.client.OAuth2Credentials instance.
+      storage: An optional oauth2client Storage that receives refreshed
+          tokens. Defaults to the store the credentials were loaded from.
+      refresh_margin_sec: How long before expiry the token is refreshed.
+      http: An unauthorized httplib2.Http used for the token requests.
+          Defaults to a new httplib2.Http.
+    """
+    self.credentials = credentials
+    self.refresh_margin_sec = refresh_margin_sec
+    if storage: credentials.set_store(storage)
+    if not http: http = httplib2.Http()
+    self._http = http
+    self._lock = threading.Lock()
+    self._stopped = threading.Event()
+    self._thread = None
+    self._lifetime_sec = None
+    self._stats = {'refreshes': 0, 'refresh_failures': 0,
+                   'unauthorized_retries': 0}
+
+  def start(self):
+    """Makes sure there is a valid token and keeps it fresh in the background.
+
+    Raises:
+      oauth2client.client.AccessTokenRefreshError if there is no valid token
+          and one could not be fetched.
+    """
+    if self._thread:
+      return
+    self.get_access_token()
+    self._stopped.clear()
+    self._thread = threading.Thread(target=self._refresh_loop)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def stop(self):
+    """Stops the background refresh."""
+    self._stopped.set()
+    if self._thread:
+      self._thread.join()
+      self._thread = None
+
+  def get_access_token(self):
+    """Gets a valid access token, refreshing it first only if it expired.
+
+    Returns:
+      The string access token.
+    """
+    if not self._is_valid():
+      with self._lock:
+        if not self._is_valid():
+          self._refresh_locked()
+    return self.credentials.access_token
+
+  def refresh(self, stale_token=None):
+    """Refreshes the access token.
+
+    Args:
+      stale_token: The token the caller found to be invalid. If another
+          thread has already replaced it, no new refresh is made.
+
+    Raises:
+      oauth2client.client.AccessTokenRefreshError if the refresh failed.
+    """
+    with self._lock:
+      if stale_token and self.credentials.access_token != stale_token:
+        return
+      self._refresh_locked()
+
+  def authorize(self, http):
+    """Makes an httplib2.Http send the managed token with every request.
+
+    A request that is answered with 401 is sent once more after a refresh,
+    if its body can be sent again.
+
+    Args:
+      http: An httplib2.Http instance.
+
+    Returns:
+      The same httplib2.Http instance.
+    """
+    request_orig = http.request
+    manager = self
+
+    def new_request(uri, method='GET', body=None, headers=None, **kwargs):
+      token = manager.get_access_token()
+      response, content = request_orig(
+          uri, method, body=body, headers=_with_token(headers, token),
+          **kwargs)
+      if response.status != UNAUTHORIZED or not _rewind(body):
+        return response, content
+      with manager._lock:
+        manager._stats['unauthorized_retries'] += 1
+      manager.refresh(token)
+      return request_orig(
+          uri, method, body=body,
+          headers=_with_token(headers, manager.get_access_token()), **kwargs)
+
+    http.request = new_request
+    return http
+
+  def get_stats(self):
+    """Gets the refresh counters.
+
+    Returns:
+      A dictionary with the refreshes, refresh_failures and
+      unauthorized_retries counters.
+    """
+    with self._lock:
+      return dict(self._stats)
+
+  def _refresh_locked(self):
+    """Refreshes the access token. The caller holds the lock."""
+    try:
+      self.credentials.refresh(self._http)
+    except Exception:
+      self._stats['refresh_failures'] += 1
+      raise
+    self._stats['refreshes'] += 1
+    self._lifetime_sec = self._get_seconds_left()
+
+  def _is_valid(self):
+    """Checks whether there is a token that has not expired.
+
+    Returns:
+      True if the token can be used.
+    """
+    if not self.credentials.access_token:
+      return False
+    seconds_left = self._get_seconds_left()
+    return seconds_left is None or seconds_left > 0
+
+  def _get_seconds_left(self):
+    """Gets the time until the token expires.
+
+    Returns:
+      The number of seconds left, or None if the expiry is unknown.
+    """
+    expiry = self.credentials.token_expiry
+    if not expiry:
+      return None
+    delta = expiry - datetime.datetime.utcnow()
+    return delta.days * 86400 + delta.seconds + delta.microseconds / 1e6
+
+  def _refresh_loop(self):
+    """Refreshes the token shortly before each expiry until stopped."""
+    retry_delay_sec = MIN_RETRY_DELAY_SEC
+    while not self._stopped.is_set():
+      seconds_left = self._get_seconds_left()
+      if seconds_left is None and self.credentials.access_token:
+        delay_sec = UNKNOWN_EXPIRY_CHECK_SEC
+      elif seconds_left is None:
+        delay_sec = 0
+      else:
+        margin_sec = self.refresh_margin_sec
+        # Tokens that live shorter than the margin are refreshed halfway.
+        if self._lifetime_sec:
+          margin_sec = min(margin_sec, self._lifetime_sec / 2.0)
+        delay_sec = seconds_left - margin_sec
+      if delay_sec > 0:
+        self._stopped.wait(delay_sec)
+        continue
+      try:
+        self.refresh(self.credentials.access_token)
+      except Exception, e:
+        logging.warning('Could not refresh the access token, retrying in '
+                        '%ds: %s', retry_delay_sec, e)
+        self._stopped.wait(retry_delay_sec)
+        retry_delay_sec = min(MAX_RETRY_DELAY_SEC, retry_delay_sec * 2)
+      else:
+        retry_delay_sec = MIN_RETRY_DELAY_SEC
+
+
+def _with_token(headers, token):
+  """Copies request headers, adding an Authorization header.
+
+  Args:
+    headers: A dictionary of request headers, or None.
+    token: The string access token.
+
+  Returns:
+    A new dictionary of headers.
+  """
+  headers = dict(headers or {})
+  headers['Authorization'] = 'Bearer ' + token
+  return headers
+
+
+def _rewind(body):
+  """Prepares a request body to be sent again.
+
+  Args:
+    body: The request body: None, a string or a file-like object.
+
+  Returns:
+    True if the body can be sent again.
+  """
+  if body is None or isinstance(body, basestring):
+    return True
+  seekable = getattr(body, 'seekable', None)
+  if seekable and not seekable():
+    return False
+  try:
+    body.seek(0)
+  except (AttributeError, IOError):
+    return False
+  return True
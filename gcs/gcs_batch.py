@@ -0,0 +1,150 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Non-interactive execution of Cloud Storage commands from a manifest.
+
+A manifest is a JSON lines file with one operation per line. Each line names
+the operation and gives the values the matching command would otherwise
+prompt for, keyed by parameter name. Underscores may be used for the dashes
+in a parameter name:
+
+  {"op": "insert_object", "bucket": "logs", "file_path": "a.log"}
+  {"op": "delete_object", "bucket": "logs", "object": "old.log"}
+
+Every operation produces one JSON line of results, in completion order:
+
+  {"line": 1, "op": "insert_object", "ok": true, "result": "...",
+   "elapsed_sec": 0.08}
+
+A last line summarizes the run:
+
+  {"summary": {"operations": 2, "succeeded": 2, "failed": 0,
+   "elapsed_sec": 0.12, "operations_per_sec": 16.7}}
+"""
+
+import json
+import logging
+import time
+
+import gcs_commands
+import gcs_error
+import gcs_pool
+
+OPERATIONS = {
+    'get_buckets': gcs_commands.GetBucketsCommand,
+    'get_bucket': gcs_commands.GetBucketCommand,
+    'get_bucket_cors': gcs_commands.GetBucketCorsCommand,
+    'get_bucket_location': gcs_commands.GetBucketLocationCommand,
+    'insert_bucket': gcs_commands.InsertBucketCommand,
+    'set_bucket_cors': gcs_commands.SetBucketCorsCommand,
+    'delete_bucket': gcs_commands.DeleteBucketCommand,
+    'get_object': gcs_commands.GetObjectCommand,
+    'get_object_acls': gcs_commands.GetObjectAclsCommand,
+    'get_object_metadata': gcs_commands.GetObjectMetadataCommand,
+    'insert_object': gcs_commands.InsertObjectCommand,
+    'copy_object': gcs_commands.CopyObjectCommand,
+    'copy_prefix': gcs_commands.CopyPrefixCommand,
+    'move_prefix': gcs_commands.MovePrefixCommand,
+    'delete_object': gcs_commands.DeleteObjectCommand,
+    'sync_directory': gcs_commands.SyncDirectoryCommand,
+}
+
+
+def run_batch(gcs_client, manifest, results, concurrency=None):
+  """Runs every operation in a manifest and writes a result for each.
+
+  The manifest is read lazily, so it may hold more operations than fit in
+  memory.
+
+  Args:
+    gcs_client: An instance of gcs.Gcs with a thread-safe transport.
+    manifest: An iterable of JSON lines, such as an open file.
+    results: A file-like object that receives one JSON line per operation
+        and a last line with the summary.
+    concurrency: The number of operations run at once. Defaults to
+        gcs_pool.DEFAULT_CONCURRENCY.
+
+  Returns:
+    A dictionary with the operations, succeeded and failed counts, the
+    elapsed_sec wall-clock time and the operations_per_sec throughput.
+  """
+  if not concurrency: concurrency = gcs_pool.DEFAULT_CONCURRENCY
+  summary = {'operations': 0, 'succeeded': 0, 'failed': 0}
+  start = time.time()
+  for operation, result, error in gcs_pool.imap_unordered(
+      lambda operation: _run_operation(gcs_client, *operation),
+      _iter_operations(manifest), concurrency):
+    summary['operations'] += 1
+    if result['ok']:
+      summary['succeeded'] += 1
+    else:
+      summary['failed'] += 1
+    results.write(json.dumps(result, default=str) + '\n')
+  elapsed_sec = time.time() - start
+  summary['elapsed_sec'] = round(elapsed_sec, 3)
+  summary['operations_per_sec'] = round(
+      summary['operations'] / max(elapsed_sec, 1e-6), 1)
+  results.write(json.dumps({'summary': summary}) + '\n')
+  return summary
+
+
+def _iter_operations(manifest):
+  """Numbers the non-blank lines of a manifest.
+
+  Args:
+    manifest: An iterable of JSON lines.
+
+  Yields:
+    (line_number, line) tuples, counting from 1.
+  """
+  for line_number, line in enumerate(manifest, 1):
+    if line.strip():
+      yield line_number, line
+
+
+def _run_operation(gcs_client, line_number, line):
+  """Parses and runs one manifest line.
+
+  Args:
+    gcs_client: An instance of gcs.Gcs.
+    line_number: The line number in the manifest.
+    line: The string JSON line.
+
+  Returns:
+    The result dictionary for the line. Failures are reported in the result
+    rather than raised.
+  """
+  result = {'line': line_number, 'op': None, 'ok': False}
+  start = time.time()
+  try:
+    values = json.loads(line)
+    if not isinstance(values, dict):
+      raise ValueError('Manifest lines must be JSON objects.')
+    values = dict(values)
+    op = result['op'] = values.pop('op', None)
+    if op not in OPERATIONS:
+      raise ValueError('Unknown operation: %s' % op)
+    command = OPERATIONS[op](op, gcs_client)
+    result['result'] = command.run_batch_command(values)
+    result['ok'] = True
+  except gcs_error.GcsError, ge:
+    result['error'] = ge.message
+    result['status'] = ge.status
+  except (ValueError, IOError, OSError), e:
+    result['error'] = str(e)
+  except Exception, e:
+    logging.exception('Line %d failed unexpectedly.', line_number)
+    result['error'] = '%s: %s' % (e.__class__.__name__, e)
+  result['elapsed_sec'] = round(time.time() - start, 6)
+  return result
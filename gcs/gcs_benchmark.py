@@ -0,0 +1,342 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Throughput benchmarks of GcsXml against the in-process emulator.
+
+Each benchmark runs a fixed amount of work through a GcsXml client backed by
+a gcs_emulator.EmulatorTransport, at every requested concurrency level, and
+produces one result record. Upload and download benchmarks also run once per
+object size. The report is plain data that can be dumped as JSON, and two
+reports made with the same settings can be compared with compare_reports.
+
+Result records hold:
+  id: A string such as 'upload/size=1048576/concurrency=8' that identifies
+      the result across reports.
+  benchmark: upload, download, metadata or list.
+  object_size: The object size in bytes, for upload and download.
+  concurrency: The number of operations run at once.
+  operations: The number of operations timed.
+  bytes: The number of object bytes transferred.
+  elapsed_sec: The wall time of the run.
+  ops_per_sec: Operations, or listed entries for list, per second.
+  mb_per_sec: Object megabytes per second, for upload and download.
+  latency_sec: The p50, p90 and p99 operation latencies.
+"""
+
+import cStringIO
+import os
+import platform
+import time
+
+import gcs_emulator
+import gcs_pool
+import gcs_xml
+
+BENCHMARKS = ('upload', 'download', 'metadata', 'list')
+DEFAULT_OBJECT_SIZES = (4 * 1024, 256 * 1024, 4 * 1024 * 1024)
+DEFAULT_CONCURRENCY_LEVELS = (1, 8, 32)
+DEFAULT_BYTES_PER_RUN = 64 * 1024 * 1024
+DEFAULT_MAX_OPERATIONS = 512
+DEFAULT_METADATA_OPERATIONS = 2000
+DEFAULT_LIST_OBJECTS = 20000
+DEFAULT_LATENCY_SEC = 0.005
+DEFAULT_BANDWIDTH_BYTES_PER_SEC = 100 * 1024 * 1024
+REPORT_VERSION = 1
+BUCKET_NAME = 'benchmark'
+MB = 1024 * 1024
+# The metric compared between reports, where larger is better.
+COMPARED_METRIC = 'ops_per_sec'
+
+
+def run_benchmarks(benchmarks=BENCHMARKS, object_sizes=DEFAULT_OBJECT_SIZES,
+                   concurrency_levels=DEFAULT_CONCURRENCY_LEVELS,
+                   latency_sec=DEFAULT_LATENCY_SEC,
+                   bandwidth_bytes_per_sec=DEFAULT_BANDWIDTH_BYTES_PER_SEC,
+                   bytes_per_run=DEFAULT_BYTES_PER_RUN,
+                   max_operations=DEFAULT_MAX_OPERATIONS,
+                   metadata_operations=DEFAULT_METADATA_OPERATIONS,
+                   list_objects=DEFAULT_LIST_OBJECTS):
+  """Runs the benchmarks and builds a report.
+
+  Args:
+    benchmarks: The names of the benchmarks to run, from BENCHMARKS.
+    object_sizes: The object sizes in bytes for upload and download.
+    concurrency_levels: The numbers of operations to run at once.
+    latency_sec: The emulated request latency, in seconds.
+    bandwidth_bytes_per_sec: The emulated per-request bandwidth, or None for
+        no limit.
+    bytes_per_run: The number of bytes each upload or download run
+        transfers, within max_operations and at least one operation per
+        concurrent worker.
+    max_operations: The maximum number of operations in an upload or
+        download run.
+    metadata_operations: The number of get_object_metadata calls per run.
+    list_objects: The number of objects in the listed bucket.
+
+  Returns:
+    A dictionary with the report version, the settings under config, and
+    the result records under results.
+
+  Raises:
+    ValueError if a benchmark name is not recognized.
+  """
+  for benchmark in benchmarks:
+    if benchmark not in BENCHMARKS:
+      raise ValueError('Unknown benchmark %s.' % benchmark)
+  results = []
+  for object_size in object_sizes:
+    if 'upload' not in benchmarks and 'download' not in benchmarks:
+      break
+    data = os.urandom(object_size)
+    operations = max(1, min(max_operations, bytes_per_run / object_size))
+    for concurrency in concurrency_levels:
+      emulator = gcs_emulator.EmulatorTransport(latency_sec,
+                                                bandwidth_bytes_per_sec)
+      gcs_client = _create_client(emulator)
+      names = ['object-%d' % index
+               for index in range(max(operations, concurrency))]
+      if 'upload' in benchmarks:
+        results.append(_run(
+            'upload', concurrency, names,
+            lambda name: _upload(gcs_client, name, data),
+            object_size=object_size))
+      else:
+        for name in names:
+          emulator.put_object(BUCKET_NAME, name, data)
+      if 'download' in benchmarks:
+        results.append(_run(
+            'download', concurrency, names,
+            lambda name: gcs_client.get_object(BUCKET_NAME, name),
+            object_size=object_size))
+
+  for concurrency in concurrency_levels:
+    if 'metadata' not in benchmarks:
+      break
+    emulator = gcs_emulator.EmulatorTransport(latency_sec,
+                                              bandwidth_bytes_per_sec)
+    gcs_client = _create_client(emulator)
+    emulator.put_object(BUCKET_NAME, 'object', '')
+    results.append(_run(
+        'metadata', concurrency, ['object'] * metadata_operations,
+        lambda name: gcs_client.get_object_metadata(BUCKET_NAME, name)))
+
+  if 'list' in benchmarks:
+    emulator = gcs_emulator.EmulatorTransport(latency_sec,
+                                              bandwidth_bytes_per_sec)
+    gcs_client = _create_client(emulator)
+    for index in range(list_objects):
+      emulator.put_object(BUCKET_NAME, 'dir-%d/object-%08d' % (index % 10,
+                                                               index), '')
+    results.append(_run_list(gcs_client, list_objects))
+
+  return {
+      'version': REPORT_VERSION,
+      'config': {
+          'benchmarks': list(benchmarks),
+          'object_sizes': list(object_sizes),
+          'concurrency_levels': list(concurrency_levels),
+          'latency_sec': latency_sec,
+          'bandwidth_bytes_per_sec': bandwidth_bytes_per_sec,
+          'bytes_per_run': bytes_per_run,
+          'max_operations': max_operations,
+          'metadata_operations': metadata_operations,
+          'list_objects': list_objects,
+          'python': platform.python_version(),
+          'platform': platform.platform(),
+      },
+      'results': results,
+  }
+
+
+def compare_reports(baseline, report, tolerance=0.1):
+  """Compares the throughput of two reports.
+
+  Args:
+    baseline: The report dictionary to compare against.
+    report: The new report dictionary.
+    tolerance: The fraction by which throughput may drop before a result is
+        counted as a regression.
+
+  Returns:
+    A list of dictionaries, one per result id present in both reports, with
+    the id, the baseline and current ops_per_sec, their change as a fraction
+    of the baseline, and regression set if the drop exceeds tolerance.
+  """
+  baseline_results = dict((result['id'], result)
+                          for result in baseline['results'])
+  comparisons = []
+  for result in report['results']:
+    baseline_result = baseline_results.get(result['id'])
+    if not baseline_result or not baseline_result[COMPARED_METRIC]:
+      continue
+    before = baseline_result[COMPARED_METRIC]
+    after = result[COMPARED_METRIC]
+    change = (after - before) / before
+    comparisons.append({
+        'id': result['id'],
+        'baseline': before,
+        'current': after,
+        'change': change,
+        'regression': change < -tolerance,
+    })
+  return comparisons
+
+
+def _create_client(emulator):
+  """Creates a client backed by the emulator, with an empty bucket.
+
+  Args:
+    emulator: The gcs_emulator.EmulatorTransport.
+
+  Returns:
+    A gcs_xml.GcsXml instance.
+  """
+  gcs_client = gcs_xml.GcsXml(None, 'benchmark', transport=emulator)
+  gcs_client.insert_bucket(BUCKET_NAME)
+  return gcs_client
+
+
+def _upload(gcs_client, object_name, data):
+  """Uploads one benchmark object.
+
+  Args:
+    gcs_client: The gcs_xml.GcsXml client.
+    object_name: The string object name.
+    data: The string object body.
+
+  Returns:
+    The string response of the upload.
+  """
+  return gcs_client.insert_object_stream(
+      BUCKET_NAME, cStringIO.StringIO(data), object_name, size=len(data),
+      content_type='application/octet-stream')
+
+
+def _run(benchmark, concurrency, items, func, object_size=None):
+  """Times func over every item at the given concurrency.
+
+  Args:
+    benchmark: The string benchmark name.
+    concurrency: The number of calls to run at once.
+    items: A list of items to pass to func.
+    func: A callable taking one item.
+    object_size: The object size in bytes, or None.
+
+  Returns:
+    The result record.
+
+  Raises:
+    Exception raised by the first failing call.
+  """
+  latencies = []
+
+  def timed(item):
+    start = time.time()
+    func(item)
+    latencies.append(time.time() - start)
+
+  start = time.time()
+  for item, result, error in gcs_pool.imap_unordered(timed, items,
+                                                     concurrency):
+    if error:
+      raise error
+  elapsed_sec = time.time() - start
+
+  result_id = '%s/concurrency=%d' % (benchmark, concurrency)
+  total_bytes = 0
+  if object_size is not None:
+    result_id = '%s/size=%d/concurrency=%d' % (benchmark, object_size,
+                                               concurrency)
+    total_bytes = object_size * len(items)
+  result = _get_result(result_id, benchmark, concurrency, len(items),
+                       elapsed_sec, latencies)
+  if object_size is not None:
+    result['object_size'] = object_size
+    result['bytes'] = total_bytes
+    result['mb_per_sec'] = total_bytes / elapsed_sec / MB
+  return result
+
+
+def _run_list(gcs_client, list_objects):
+  """Times a full listing of the benchmark bucket.
+
+  Args:
+    gcs_client: The gcs_xml.GcsXml client.
+    list_objects: The number of objects in the bucket.
+
+  Returns:
+    The result record. Its operations are listed entries and its latencies
+    are those of the listing pages.
+  """
+  latencies = []
+  entries = 0
+  start = time.time()
+  page_start = start
+  for entry in gcs_client.list_objects(BUCKET_NAME):
+    entries += 1
+    if entries % gcs_emulator.DEFAULT_MAX_KEYS == 0:
+      now = time.time()
+      latencies.append(now - page_start)
+      page_start = now
+  elapsed_sec = time.time() - start
+  if entries != list_objects:
+    raise ValueError('Listed %d of %d objects.' % (entries, list_objects))
+  return _get_result('list/concurrency=1', 'list', 1, entries, elapsed_sec,
+                     latencies)
+
+
+def _get_result(result_id, benchmark, concurrency, operations, elapsed_sec,
+                latencies):
+  """Builds a result record.
+
+  Args:
+    result_id: The string result id.
+    benchmark: The string benchmark name.
+    concurrency: The number of operations run at once.
+    operations: The number of operations timed.
+    elapsed_sec: The wall time of the run.
+    latencies: A list of operation latencies, in seconds.
+
+  Returns:
+    The result record dictionary.
+  """
+  latencies = sorted(latencies)
+  return {
+      'id': result_id,
+      'benchmark': benchmark,
+      'concurrency': concurrency,
+      'operations': operations,
+      'elapsed_sec': elapsed_sec,
+      'ops_per_sec': operations / elapsed_sec,
+      'latency_sec': {
+          'p50': _get_percentile(latencies, 0.5),
+          'p90': _get_percentile(latencies, 0.9),
+          'p99': _get_percentile(latencies, 0.99),
+      },
+  }
+
+
+def _get_percentile(values, quantile):
+  """Picks a quantile from sorted values.
+
+  Args:
+    values: A sorted list of numbers.
+    quantile: The quantile, between 0 and 1.
+
+  Returns:
+    The nearest-rank quantile, or None if values is empty.
+  """
+  if not values:
+    return None
+  return values[min(len(values) - 1, int(quantile * len(values)))]
@@ -0,0 +1,256 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""On-disk, ETag-validated cache of Cloud Storage object bodies.
+
+Each entry is a single file holding the ETag on its first line followed by
+the body. Entries are written to a temporary file and renamed into place, so
+readers in other processes see either the old or the new entry, never a mix.
+Least recently used entries are removed once the cache grows past its size
+cap; eviction is serialized between processes with a lock file where fcntl
+is available.
+
+Each process keeps a running total of the cache size, taken from a scan of
+the directory and adjusted by its own stores and removals, and only scans
+the directory again once that total exceeds the cap. Stores by other
+processes are therefore noticed at the next scan, so several processes
+sharing a directory can overshoot the cap until one of them rescans.
+"""
+
+import errno
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+ENTRY_SUFFIX = '.entry'
+LOCK_FILE = '.lock'
+# Eviction frees space down to this fraction of the cap, so that a full cache
+# is not scanned again on every store.
+EVICTION_TARGET_RATIO = 0.9
+
+
+class ObjectBodyCache(object):
+  """Caches object bodies with their ETags in a local directory.
+
+  Attributes:
+    directory: The string path of the cache directory.
+    max_bytes: The maximum total size of the cached entries.
+  """
+
+  def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+    """Inits ObjectBodyCache with a directory and a size cap.
+
+    Args:
+      directory: The string path of the cache directory. It is created if it
+          does not exist and may be shared by several processes.
+      max_bytes: The maximum total size of the cached entries.
+    """
+    self.directory = directory
+    self.max_bytes = max_bytes
+    self._lock = threading.Lock()
+    self._stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+    # The estimated size of the entries, or None before the first scan.
+    self._total_bytes = None
+    try:
+      os.makedirs(directory)
+    except OSError, e:
+      if e.errno != errno.EEXIST:
+        raise
+
+  def get(self, bucket_name, object_name):
+    """Reads a cached entry and marks it as recently used.
+
+    Args:
+      bucket_name: The string bucket name.
+      object_name: The string object name.
+
+    Returns:
+      An (etag, body) tuple, or (None, None) if the object is not cached.
+    """
+    path = self._get_path(bucket_name, object_name)
+    try:
+      entry_file = open(path, 'rb')
+    except IOError:
+      self._count('misses')
+      return None, None
+    try:
+      etag = entry_file.readline().rstrip('\n')
+      body = entry_file.read()
+    finally:
+      entry_file.close()
+    try:
+      os.utime(path, None)
+    except OSError:
+      pass
+    return etag, body
+
+  def put(self, bucket_name, object_name, etag, body):
+    """Stores an entry, then evicts old entries if over the size cap.
+
+    Eviction scans the directory only when the running total of the cache
+    size exceeds max_bytes.
+
+    Args:
+      bucket_name: The string bucket name.
+      object_name: The string object name.
+      etag: The string ETag of the body.
+      body: The string object body.
+    """
+    if not etag or len(body) > self.max_bytes:
+      return
+    path = self._get_path(bucket_name, object_name)
+    etag_line = etag.replace('\n', '') + '\n'
+    fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+    try:
+      entry_file = os.fdopen(fd, 'wb')
+      try:
+        entry_file.write(etag_line)
+        entry_file.write(body)
+      finally:
+        entry_file.close()
+      replaced_size = _get_size(path)
+      os.rename(temp_path, path)
+    except:
+      try:
+        os.remove(temp_path)
+      except OSError:
+        pass
+      raise
+    self._count('stores')
+    with self._lock:
+      if self._total_bytes is not None:
+        self._total_bytes += len(etag_line) + len(body) - replaced_size
+      full = self._total_bytes is None or self._total_bytes > self.max_bytes
+    if full:
+      self._evict()
+
+  def record_hit(self):
+    """Counts a cached body that was served after server validation."""
+    self._count('hits')
+
+  def record_miss(self):
+    """Counts a cached body that the server reported as changed."""
+    self._count('misses')
+
+  def invalidate(self, bucket_name, object_name):
+    """Removes the entry for an object.
+
+    Args:
+      bucket_name: The string bucket name.
+      object_name: The string object name.
+    """
+    path = self._get_path(bucket_name, object_name)
+    size = _get_size(path)
+    try:
+      os.remove(path)
+    except OSError:
+      return
+    with self._lock:
+      if self._total_bytes is not None:
+        self._total_bytes = max(0, self._total_bytes - size)
+
+  def get_stats(self):
+    """Gets the counters of this process.
+
+    Returns:
+      A dictionary with the hits, misses, stores and evictions counters.
+    """
+    with self._lock:
+      return dict(self._stats)
+
+  def _get_path(self, bucket_name, object_name):
+    """Gets the entry path for an object.
+
+    Args:
+      bucket_name: The string bucket name.
+      object_name: The string object name.
+
+    Returns:
+      The string path of the entry file.
+    """
+    key = hashlib.sha1('%s/%s' % (bucket_name, object_name)).hexdigest()
+    return os.path.join(self.directory, key + ENTRY_SUFFIX)
+
+  def _evict(self):
+    """Removes least recently used entries once over max_bytes.
+
+    The directory is scanned, the running total is reset from the scan, and
+    entries are removed until the cache holds at most EVICTION_TARGET_RATIO
+    of max_bytes.
+    """
+    lock_file = open(os.path.join(self.directory, LOCK_FILE), 'a')
+    try:
+      if fcntl: fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+      entries = []
+      total = 0
+      for name in os.listdir(self.directory):
+        if not name.endswith(ENTRY_SUFFIX):
+          continue
+        path = os.path.join(self.directory, name)
+        try:
+          stat = os.stat(path)
+        except OSError:
+          continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+      entries.sort()
+      target = total
+      if total > self.max_bytes:
+        target = int(self.max_bytes * EVICTION_TARGET_RATIO)
+      for mtime, size, path in entries:
+        if total <= target:
+          break
+        try:
+          os.remove(path)
+        except OSError, e:
+          logging.warning('Could not evict %s: %s', path, e)
+          continue
+        total -= size
+        self._count('evictions')
+      with self._lock:
+        self._total_bytes = total
+    finally:
+      lock_file.close()
+
+  def _count(self, counter):
+    """Increments a counter.
+
+    Args:
+      counter: The string counter name.
+    """
+    with self._lock:
+      self._stats[counter] += 1
+
+
+def _get_size(path):
+  """Gets the size of a file.
+
+  Args:
+    path: The string file path.
+
+  Returns:
+    The size in bytes, or 0 if the file does not exist.
+  """
+  try:
+    return os.path.getsize(path)
+  except OSError:
+    return 0
@@ -0,0 +1,466 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""In-memory metadata cache for Google Cloud Storage clients."""
+
+import collections
+import os
+import threading
+import time
+
+DEFAULT_MAX_ENTRIES = 10000
+LOCATION = 'location'
+CORS = 'cors'
+CORS_RULES = 'cors_rules'
+METADATA = 'metadata'
+DEFAULT_TTLS_SEC = {
+    LOCATION: 3600,
+    CORS: 300,
+    CORS_RULES: 300,
+    METADATA: 60,
+}
+
+
+class LruCache(object):
+  """Thread-safe LRU cache whose entries expire after a per-kind TTL.
+
+  Keys are tuples whose first item is the kind of result, such as
+  METADATA, and whose second item is the bucket name.
+
+  A value fetched while its key or bucket was invalidated may be stale, so
+  put drops it. Each invalidation is stamped with a counter. The latest stamp
+  of each key and bucket is kept for the last max_entries invalidations.
+  Older stamps fold into a floor that applies to every key, so memory stays
+  bounded and a dropped stamp can only make put more cautious.
+
+  Attributes:
+    max_entries: The maximum number of entries kept.
+    ttls_sec: A dictionary mapping each kind to its time to live in seconds.
+  """
+
+  def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttls_sec=None):
+    """Inits LruCache with its size bound and TTLs.
+
+    Args:
+      max_entries: The maximum number of entries kept.
+      ttls_sec: A dictionary mapping kinds to TTLs in seconds, merged over
+          DEFAULT_TTLS_SEC.
+    """
+    self.max_entries = max_entries
+    self.ttls_sec = dict(DEFAULT_TTLS_SEC)
+    if ttls_sec: self.ttls_sec.update(ttls_sec)
+    self._entries = collections.OrderedDict()
+    self._lock = threading.Lock()
+    self._generation = 0
+    self._invalidated = collections.OrderedDict()
+    self._invalidated_floor = 0
+    self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0,
+                   'invalidations': 0}
+
+  def get(self, key):
+    """Looks up a live entry and marks it as recently used.
+
+    Args:
+      key: The tuple cache key.
+
+    Returns:
+      A (found, value) tuple.
+    """
+    with self._lock:
+      entry = self._entries.pop(key, None)
+      if entry is None:
+        self._stats['misses'] += 1
+        return False, None
+      expires_at, value = entry
+      if expires_at <= time.time():
+        self._stats['expirations'] += 1
+        self._stats['misses'] += 1
+        return False, None
+      self._entries[key] = entry
+      self._stats['hits'] += 1
+      return True, value
+
+  def get_generation(self):
+    """Gets a counter that changes whenever an entry is invalidated.
+
+    Returns:
+      The integer generation, to pass to put. Only invalidations of the key
+      put or of its bucket made after this call cause put to drop the value.
+    """
+    with self._lock:
+      return self._generation
+
+  def put(self, key, value, generation=None):
+    """Stores an entry, evicting the least recently used if full.
+
+    Args:
+      key: The tuple cache key.
+      value: The value to cache.
+      generation: The result of get_generation from before the value was
+          fetched. If the key or its bucket has been invalidated since, the
+          value may be stale and is not stored.
+    """
+    ttl_sec = self.ttls_sec.get(key[0])
+    if not ttl_sec or self.max_entries <= 0:
+      return
+    with self._lock:
+      if generation is not None and generation < max(
+          self._invalidated_floor, self._invalidated.get(key, 0),
+          self._invalidated.get(key[1], 0)):
+        return
+      self._entries.pop(key, None)
+      self._entries[key] = (time.time() + ttl_sec, value)
+      while len(self._entries) > self.max_entries:
+        self._entries.popitem(last=False)
+        self._stats['evictions'] += 1
+
+  def invalidate(self, key):
+    """Removes an entry.
+
+    Args:
+      key: The tuple cache key.
+    """
+    with self._lock:
+      self._stamp_invalidation(key)
+      if self._entries.pop(key, None) is not None:
+        self._stats['invalidations'] += 1
+
+  def invalidate_bucket(self, bucket_name):
+    """Removes every entry for a bucket.
+
+    Args:
+      bucket_name: The string bucket name.
+    """
+    with self._lock:
+      self._stamp_invalidation(bucket_name)
+      for key in [key for key in self._entries if key[1] == bucket_name]:
+        del self._entries[key]
+        self._stats['invalidations'] += 1
+
+  def get_stats(self):
+    """Gets the cache counters.
+
+    Returns:
+      A dictionary with the hits, misses, evictions, expirations and
+      invalidations counters and the current number of entries.
+    """
+    with self._lock:
+      stats = dict(self._stats)
+      stats['entries'] = len(self._entries)
+    return stats
+
+  def _stamp_invalidation(self, name):
+    """Records that a key or bucket was invalidated. The caller holds the lock.
+
+    Args:
+      name: The tuple cache key, or the string bucket name.
+    """
+    self._generation += 1
+    self._invalidated.pop(name, None)
+    self._invalidated[name] = self._generation
+    while len(self._invalidated) > max(self.max_entries, 1):
+      _, stamp = self._invalidated.popitem(last=False)
+      self._invalidated_floor = max(self._invalidated_floor, stamp)
+
+
+class CachingGcs(object):
+  """Caches bucket location, CORS and object metadata around a Gcs client.
+
+  Results are kept in an LruCache and invalidated whenever a write made
+  through this wrapper may have changed them. Writes made by other clients
+  are only picked up when the TTL expires. Methods that are not cached are
+  passed straight to the wrapped client.
+
+  Attributes:
+    cache: The LruCache holding the results.
+  """
+
+  def __init__(self, gcs_client, max_entries=DEFAULT_MAX_ENTRIES,
+               ttls_sec=None):
+    """Inits CachingGcs with a client and cache limits.
+
+    Args:
+      gcs_client: An instance of gcs.Gcs.
+      max_entries: The maximum number of cached results.
+      ttls_sec: A dictionary mapping LOCATION, CORS, CORS_RULES and METADATA
+          to TTLs in seconds. A TTL of 0 disables caching for that kind.
+    """
+    self._gcs_client = gcs_client
+    self.cache = LruCache(max_entries, ttls_sec)
+
+  def __getattr__(self, name):
+    """Passes uncached methods and attributes to the wrapped client.
+
+    Args:
+      name: The string attribute name.
+
+    Returns:
+      The attribute of the wrapped client.
+    """
+    return getattr(self._gcs_client, name)
+
+  def get_stats(self):
+    """Gets the cache counters. See LruCache.get_stats.
+
+    Returns:
+      A dictionary of counters.
+    """
+    return self.cache.get_stats()
+
+  def get_bucket_location(self, bucket_name):
+    """Get location of the specified bucket, from the cache if fresh.
+
+    Args:
+      bucket_name: String name of the bucket.
+
+    Returns:
+      The string XML representation of the location.
+    """
+    return self._cached((LOCATION, bucket_name),
+                        self._gcs_client.get_bucket_location, bucket_name)
+
+  def get_bucket_cors(self, bucket_name):
+    """Get CORS for the specified bucket, from the cache if fresh.
+
+    Args:
+      bucket_name: String name of the bucket.
+
+    Returns:
+      The string XML representation of the CORS.
+    """
+    return self._cached((CORS, bucket_name),
+                        self._gcs_client.get_bucket_cors, bucket_name)
+
+  def get_bucket_cors_rules(self, bucket_name):
+    """Get parsed CORS rules for the bucket, from the cache if fresh.
+
+    Args:
+      bucket_name: String name of the bucket.
+
+    Returns:
+      A list of gcs_types.CorsRule instances.
+    """
+    return self._cached((CORS_RULES, bucket_name),
+                        self._gcs_client.get_bucket_cors_rules, bucket_name)
+
+  def get_object_metadata(self, bucket_name, object_name):
+    """Gets an object's metadata, from the cache if fresh.
+
+    Args:
+      bucket_name: String name of the bucket.
+      object_name: The name of the object.
+
+    Returns:
+      The httplib2.Response object from the API call.
+    """
+    return self._cached((METADATA, bucket_name, object_name),
+                        self._gcs_client.get_object_metadata, bucket_name,
+                        object_name)
+
+  def insert_bucket(self, bucket_name, acl=None, location_constraint=None):
+    """Creates a bucket and drops any cached results for it.
+
+    See gcs.Gcs.insert_bucket.
+    """
+    try:
+      return self._gcs_client.insert_bucket(
+          bucket_name, acl, location_constraint)
+    finally:
+      self.cache.invalidate_bucket(bucket_name)
+
+  def set_bucket_cors(self, bucket_name, origins=None, methods=None,
+                      response_headers=None, max_age_sec=None):
+    """Sets CORS on a bucket and drops its cached CORS.
+
+    See gcs.Gcs.set_bucket_cors.
+    """
+    try:
+      return self._gcs_client.set_bucket_cors(
+          bucket_name, origins, methods, response_headers, max_age_sec)
+    finally:
+      self.cache.invalidate((CORS, bucket_name))
+      self.cache.invalidate((CORS_RULES, bucket_name))
+
+  def delete_bucket(self, bucket_name, recursive=False, concurrency=None):
+    """Deletes a bucket and drops every cached result for it.
+
+    See gcs.Gcs.delete_bucket.
+    """
+    try:
+      return self._gcs_client.delete_bucket(
+          bucket_name, recursive, concurrency)
+    finally:
+      self.cache.invalidate_bucket(bucket_name)
+
+  def insert_object(self, bucket_name, file_path=None, object_name=None,
+                    content_type=None, content_encoding=None, acl=None,
+                    content_md5=None, compress=False):
+    """Inserts an object and drops its cached metadata.
+
+    See gcs.Gcs.insert_object.
+    """
+    if not object_name: object_name = os.path.basename(file_path)
+    try:
+      return self._gcs_client.insert_object(
+          bucket_name, file_path, object_name, content_type, content_encoding,
+          acl, content_md5, compress)
+    finally:
+      self.cache.invalidate((METADATA, bucket_name, object_name))
+
+  def insert_object_stream(self, bucket_name, stream, object_name, size=None,
+                           content_type=None, content_encoding=None, acl=None,
+                           chunk_size=None, content_md5=None, compress=False):
+    """Inserts an object from a stream and drops its cached metadata.
+
+    See gcs.Gcs.insert_object_stream.
+    """
+    try:
+      return self._gcs_client.insert_object_stream(
+          bucket_name, stream, object_name, size, content_type,
+          content_encoding, acl, chunk_size, content_md5, compress)
+    finally:
+      self.cache.invalidate((METADATA, bucket_name, object_name))
+
+  def insert_object_resumable(self, bucket_name, file_path, object_name=None,
+                              content_type=None, content_encoding=None,
+                              acl=None, chunk_size=None, state_path=None):
+    """Inserts an object resumably and drops its cached metadata.
+
+    See gcs.Gcs.insert_object_resumable.
+    """
+    if not object_name: object_name = os.path.basename(file_path)
+    try:
+      return self._gcs_client.insert_object_resumable(
+          bucket_name, file_path, object_name, content_type, content_encoding,
+          acl, chunk_size, state_path)
+    finally:
+      self.cache.invalidate((METADATA, bucket_name, object_name))
+
+  def insert_object_parallel(self, bucket_name, file_path, object_name=None,
+                             content_type=None, content_encoding=None,
+                             acl=None, part_size=None, concurrency=None):
+    """Inserts an object in parallel parts and drops its cached metadata.
+
+    See gcs.Gcs.insert_object_parallel.
+    """
+    if not object_name: object_name = os.path.basename(file_path)
+    try:
+      return self._gcs_client.insert_object_parallel(
+          bucket_name, file_path, object_name, content_type, content_encoding,
+          acl, part_size, concurrency)
+    finally:
+      self.cache.invalidate((METADATA, bucket_name, object_name))
+
+  def copy_object(self, original_bucket_name, original_object_name,
+                  new_bucket_name, new_object_name=None, acl=None):
+    """Copies an object and drops the cached metadata of the copy.
+
+    See gcs.Gcs.copy_object.
+    """
+    if not new_object_name: new_object_name = original_object_name
+    try:
+      return self._gcs_client.copy_object(
+          original_bucket_name, original_object_name, new_bucket_name,
+          new_object_name, acl)
+    finally:
+      self.cache.invalidate((METADATA, new_bucket_name, new_object_name))
+
+  def delete_object(self, bucket_name, object_name):
+    """Deletes an object and drops its cached metadata.
+
+    See gcs.Gcs.delete_object.
+    """
+    try:
+      return self._gcs_client.delete_object(bucket_name, object_name)
+    finally:
+      self.cache.invalidate((METADATA, bucket_name, object_name))
+
+  def delete_objects(self, bucket_name, object_names, concurrency=None):
+    """Deletes many objects and drops their cached metadata.
+
+    See gcs.Gcs.delete_objects.
+
+    Yields:
+      (object_name, error) tuples in completion order.
+    """
+    for object_name, error in self._gcs_client.delete_objects(
+        bucket_name, object_names, concurrency):
+      self.cache.invalidate((METADATA, bucket_name, object_name))
+      yield object_name, error
+
+  def copy_prefix(self, bucket_name, prefix, new_bucket_name,
+                  new_prefix=None, marker=None, acl=None, concurrency=None):
+    """Copies objects under a prefix and drops the destination's cache.
+
+    See gcs.Gcs.copy_prefix.
+
+    Yields:
+      (object_name, error, marker) tuples in completion order.
+    """
+    try:
+      for result in self._gcs_client.copy_prefix(
+          bucket_name, prefix, new_bucket_name, new_prefix, marker, acl,
+          concurrency):
+        yield result
+    finally:
+      self.cache.invalidate_bucket(new_bucket_name)
+
+  def move_prefix(self, bucket_name, prefix, new_bucket_name,
+                  new_prefix=None, marker=None, acl=None, concurrency=None):
+    """Moves objects under a prefix and drops the cache of both buckets.
+
+    See gcs.Gcs.move_prefix.
+
+    Yields:
+      (object_name, error, marker) tuples in completion order.
+    """
+    try:
+      for result in self._gcs_client.move_prefix(
+          bucket_name, prefix, new_bucket_name, new_prefix, marker, acl,
+          concurrency):
+        yield result
+    finally:
+      self.cache.invalidate_bucket(bucket_name)
+      self.cache.invalidate_bucket(new_bucket_name)
+
+  def sync_directory(self, bucket_name, directory, prefix=None,
+                     download=False, delete=False, concurrency=None):
+    """Syncs a local directory with a bucket, dropping its cached metadata.
+
+    See gcs.Gcs.sync_directory.
+    """
+    try:
+      return self._gcs_client.sync_directory(
+          bucket_name, directory, prefix, download, delete, concurrency)
+    finally:
+      if not download: self.cache.invalidate_bucket(bucket_name)
+
+  def _cached(self, key, method, *args):
+    """Returns a fresh cached result, or calls method and caches its result.
+
+    Args:
+      key: The tuple cache key.
+      method: The bound client method to call on a miss.
+      *args: The positional arguments for the call.
+
+    Returns:
+      The cached or fetched result.
+    """
+    found, value = self.cache.get(key)
+    if found:
+      return value
+    generation = self.cache.get_generation()
+    value = method(*args)
+    self.cache.put(key, value, generation)
+    return value
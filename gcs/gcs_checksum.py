@@ -0,0 +1,171 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Incremental MD5 and CRC32C checksums for streamed object data.
+
+CRC32C is computed with crcmod when it is installed and skipped otherwise;
+MD5 is always available.
+"""
+
+import base64
+import binascii
+import hashlib
+
+try:
+  import crcmod.predefined
+except ImportError:
+  crcmod = None
+
+import gcs_error
+
+
+class StreamHasher(object):
+  """Hashes an object's bytes as they stream past.
+
+  Bytes are fed with their offset in the object. Bytes that were already
+  hashed, such as a chunk sent again after a retry, are skipped, so the
+  digests cover each byte exactly once. If bytes are skipped over, the
+  digests no longer describe the object and complete is False.
+
+  Attributes:
+    bytes_hashed: The number of leading object bytes that have been hashed.
+    complete: False if a gap in the fed bytes made the digests unusable.
+  """
+
+  def __init__(self):
+    """Inits StreamHasher with empty digests."""
+    self.bytes_hashed = 0
+    self.complete = True
+    self._md5 = hashlib.md5()
+    self._crc32c = None
+    if crcmod: self._crc32c = crcmod.predefined.Crc('crc-32c')
+
+  def update(self, data, offset=None):
+    """Adds bytes to the digests.
+
+    Args:
+      data: The string bytes.
+      offset: The offset of data in the object. Defaults to following the
+          bytes hashed so far.
+    """
+    if offset is None: offset = self.bytes_hashed
+    if offset > self.bytes_hashed:
+      self.complete = False
+    if not self.complete or offset + len(data) <= self.bytes_hashed:
+      return
+    if offset < self.bytes_hashed:
+      data = data[self.bytes_hashed - offset:]
+    self._md5.update(data)
+    if self._crc32c: self._crc32c.update(data)
+    self.bytes_hashed += len(data)
+
+  def get_md5(self):
+    """Returns the base64 MD5 digest, as used by Content-MD5."""
+    return base64.b64encode(self._md5.digest())
+
+  def get_crc32c(self):
+    """Returns the base64 CRC32C checksum, or None without crcmod."""
+    if not self._crc32c:
+      return None
+    return base64.b64encode(self._crc32c.digest())
+
+  def verify(self, response, description):
+    """Checks the digests against the hashes the server reported.
+
+    The x-goog-hash header is preferred. Without it, an ETag that is an MD5
+    digest is used. Nothing is checked if the digests are incomplete or the
+    body was transcoded, since the server hashes refer to the stored bytes.
+
+    Args:
+      response: The httplib2.Response carrying the server hashes.
+      description: A string naming the transfer, for the error message.
+
+    Returns:
+      True if at least one checksum was compared.
+
+    Raises:
+      gcs_error.GcsIntegrityError if a checksum does not match.
+    """
+    if not self.complete or is_transcoded(response):
+      return False
+    expected = parse_hash_header(response.get('x-goog-hash'))
+    if not expected:
+      etag = response.get('etag', '').strip('"')
+      if len(etag) == 32:
+        try:
+          expected['md5'] = base64.b64encode(binascii.unhexlify(etag))
+        except TypeError:
+          pass
+    checked = False
+    for name, actual in (('md5', self.get_md5()),
+                         ('crc32c', self.get_crc32c())):
+      if name not in expected or not actual:
+        continue
+      if expected[name] != actual:
+        raise gcs_error.GcsIntegrityError(
+            '%s checksum mismatch for %s.' % (name, description), name,
+            expected[name], actual)
+      checked = True
+    return checked
+
+
+def parse_hash_header(x_goog_hash):
+  """Parses an x-goog-hash response header.
+
+  Args:
+    x_goog_hash: The header value, such as 'crc32c=n03x6A==,md5=...', or None.
+        Repeated headers joined with commas are accepted.
+
+  Returns:
+    A dictionary mapping hash names to base64 digests.
+  """
+  hashes = {}
+  if not x_goog_hash:
+    return hashes
+  for value in x_goog_hash.split(','):
+    name, _, digest = value.strip().partition('=')
+    if name and digest:
+      hashes[name] = digest
+  return hashes
+
+
+def md5_hex_to_base64(md5):
+  """Converts a hex MD5 digest to the base64 form used by Content-MD5.
+
+  Args:
+    md5: The hex MD5 digest string.
+
+  Returns:
+    The base64 digest string.
+  """
+  return base64.b64encode(binascii.unhexlify(md5))
+
+
+def is_transcoded(response):
+  """Checks whether a response body differs from the stored object bytes.
+
+  httplib2 decompresses gzip bodies and moves the original header to
+  '-content-encoding'.
+
+  Args:
+    response: An httplib2.Response.
+
+  Returns:
+    True if the body was decompressed in transit.
+  """
+  if response.get('-content-encoding'):
+    return True
+  stored = response.get('x-goog-stored-content-encoding')
+  return bool(stored) and stored != response.get('content-encoding',
+                                                 'identity')
@@ -19,6 +19,7 @@ Retrieves input from user, runs Cloud Storage API request, displays output.
 
 import logging
 import os
+import time
 
 import gcs_error
 
@@ -82,6 +83,47 @@ class UserInput(object):
           input_value = processing_method(input_value)
         self.values[key] = input_value
 
+  def set_values(self, values):
+    """Sets the values without prompting, as in batch mode.
+
+    String values go through the same processing as typed input, so an
+    omitted value behaves like input left blank. Other JSON values, such as
+    lists and booleans, are used as they are. A key that is not a parameter
+    may spell the dashes of one with underscores, as in file_path.
+
+    Args:
+      values: A dictionary mapping parameter keys to values.
+
+    Raises:
+      ValueError if a required value is missing, a key is not recognized or
+      a parameter is given twice.
+    """
+    parameters = self.parameters or {}
+    unknown = []
+    named_values = {}
+    for key, value in values.iteritems():
+      name = key
+      if name not in parameters: name = key.replace('_', '-')
+      if name not in parameters:
+        unknown.append(key)
+      elif name in named_values:
+        raise ValueError('%s is given more than once.' % name)
+      else:
+        named_values[name] = value
+    if unknown:
+      raise ValueError('Unknown parameters: %s' % ', '.join(sorted(unknown)))
+    values = named_values
+    for key in parameters:
+      user_input = parameters[key]
+      input_value = values.get(key, '')
+      if input_value in ('', None) and not user_input.get('default'):
+        raise ValueError('%s cannot be blank.' % user_input['text'])
+      if input_value is None: input_value = ''
+      processing_method = user_input.get('processing', None)
+      if processing_method and isinstance(input_value, basestring):
+        input_value = processing_method(input_value)
+      self.values[key] = input_value
+
   def _get_input(self, text, default=None):
     """Get input from the user.
 
@@ -137,6 +179,9 @@ class GcsCommand(object):
       ValueError if user entered an invalid value.
     """
     self._input.get_user_input_values()
+    metrics = getattr(self._gcs_client, 'metrics', None)
+    if metrics: totals = metrics.get_totals()
+    start = time.time()
     try:
       result = self._run_api_command()
     except gcs_error.GcsError, ge:
@@ -145,8 +190,44 @@ class GcsCommand(object):
     except ValueError, ve:
       logging.error('%s failed: %s', self.description, ve.message)
       raise
+    finally:
+      if metrics: self._log_metrics(metrics, totals, time.time() - start)
     self._process_result(result)
 
+  def _log_metrics(self, metrics, totals, elapsed_sec):
+    """Logs the requests a command sent.
+
+    Args:
+      metrics: The gcs_metrics.Metrics of the client.
+      totals: The metrics totals from before the command ran.
+      elapsed_sec: The time the command took, in seconds.
+    """
+    end_totals = metrics.get_totals()
+    logging.info(
+        '%s took %.3fs: %d requests, %d bytes sent, %d bytes received, '
+        '%d retries', self.description, elapsed_sec,
+        end_totals['requests'] - totals['requests'],
+        end_totals['request_bytes'] - totals['request_bytes'],
+        end_totals['response_bytes'] - totals['response_bytes'],
+        end_totals['retries'] - totals['retries'])
+
+  def run_batch_command(self, values):
+    """Call the Cloud Storage API with the given input, without prompting.
+
+    Args:
+      values: A dictionary mapping parameter keys to values. See
+          UserInput.set_values.
+
+    Returns:
+      The result of the API call.
+
+    Raises:
+      gcs_error.GcsError if API call fails.
+      ValueError if a value is missing or invalid.
+    """
+    self._input.set_values(values)
+    return self._run_api_command()
+
   def _run_api_command(self):
     """Run the appropriate Cloud Storage API call."""
     raise NotImplementedError('You need to override this function')
@@ -325,7 +406,13 @@ class DeleteBucketCommand(GcsCommand):
       description: The description for the user menu.
       gcs_client: An instance of gcs.Gcs.
     """
-    params = {'bucket': self.DEFAULT_BUCKET_USER_INPUT}
+    params = {}
+    params['bucket'] = self.DEFAULT_BUCKET_USER_INPUT
+    params['recursive'] = {
+        'text': 'y to delete all objects in the bucket first',
+        'default': 'n',
+        'processing': lambda recursive: recursive.strip().lower() == 'y'
+    }
     super(DeleteBucketCommand, self).__init__(description, gcs_client, params)
 
   def _run_api_command(self):
@@ -334,7 +421,9 @@ class DeleteBucketCommand(GcsCommand):
     Returns:
       The Bucket deleted string message.
     """
-    self._gcs_client.delete_bucket(self._input.values['bucket'])
+    self._gcs_client.delete_bucket(
+        self._input.values['bucket'],
+        recursive=self._input.values['recursive'])
     return self._input.values['bucket'] + ' deleted.'
 
 
@@ -351,31 +440,36 @@ class GetObjectCommand(GcsCommand):
     params = {}
     params['bucket'] = self.DEFAULT_BUCKET_USER_INPUT
     params['object'] = self.DEFAULT_OBJECT_USER_INPUT
+    params['decompress'] = {
+        'text': 'y to fetch gzip-encoded objects compressed',
+        'default': 'n',
+        'processing': lambda decompress: decompress.strip().lower() == 'y'
+    }
     super(GetObjectCommand, self).__init__(description, gcs_client, params)
 
   def _run_api_command(self):
-    """Get an object.
+    """Download an object to a local file named after it.
 
     Returns:
-      The string API call results.
+      The string local file path.
     """
-    results = self._gcs_client.get_object(
+    object_name = self._input.values['object']
+    if object_name.count('/'):
+      object_name = object_name.split('/')[-1]
+    self._gcs_client.download_object(
         self._input.values['bucket'],
-        self._input.values['object'])
-    return results
+        self._input.values['object'],
+        object_name,
+        decompress=self._input.values['decompress'])
+    return object_name
 
   def _process_result(self, result=None):
-    """Saves API call results to file.
+    """Reports where the object was downloaded.
 
     Args:
-      result: The string API call results.
+      result: The string local file path.
     """
-    object_name = self._input.values['object']
-    if object_name.count('/'):
-      object_name = object_name.split('/')[-1]
-    downloaded_file = open(object_name, 'w')
-    downloaded_file.write(result)
-    logging.info('File downloaded locally to ' + object_name)
+    logging.info('File downloaded locally to ' + result)
 
 
 class GetObjectAclsCommand(GcsCommand):
@@ -457,8 +551,37 @@ class InsertObjectCommand(GcsCommand):
         'text': 'an acl (private, public-read, etc)',
         'default': 'private'
     }
+    params['compress'] = {
+        'text': 'y to gzip the file while uploading',
+        'default': 'n',
+        'processing': lambda compress: compress.strip().lower() == 'y'
+    }
     super(InsertObjectCommand, self).__init__(description, gcs_client, params)
 
+  def run_batch_command(self, values):
+    """Insert a new object from an existing file, without prompting.
+
+    Unlike typed input, a missing or unreadable file fails the command
+    rather than uploading the test file in its place.
+
+    Args:
+      values: A dictionary mapping parameter keys to values. See
+          UserInput.set_values.
+
+    Returns:
+      The successful file upload string message.
+
+    Raises:
+      gcs_error.GcsError if API call fails.
+      ValueError if a value is missing or invalid.
+    """
+    file_path = values.get('file-path', values.get('file_path'))
+    if not file_path:
+      raise ValueError('path to file cannot be blank.')
+    if not os.path.isfile(file_path):
+      raise ValueError('File does not exist: %s' % file_path)
+    return super(InsertObjectCommand, self).run_batch_command(values)
+
   def _process_input(self, file_path):
     """Checks to make sure that the entered file path exists.
 
@@ -511,7 +634,8 @@ class InsertObjectCommand(GcsCommand):
         self._input.values['object'],
         self._input.values['content-type'],
         self._input.values['encoding'],
-        self._input.values['acl'])
+        self._input.values['acl'],
+        compress=self._input.values['compress'])
     return 'File %s was uploaded.' % self._input.values['file-path']
 
 
@@ -552,6 +676,103 @@ class CopyObjectCommand(GcsCommand):
         self._input.values['new-bucket'])
 
 
+class CopyPrefixCommand(GcsCommand):
+  """Copy every object under a prefix."""
+
+  PROGRESS_INTERVAL = 1000
+
+  def __init__(self, description, gcs_client):
+    """Initialize CopyPrefixCommand with description and gcs_client.
+
+    Args:
+      description: The description for the user menu.
+      gcs_client: An instance of gcs.Gcs.
+    """
+    params = {}
+    params['original-bucket'] = {'text': 'current bucket'}
+    params['prefix'] = {'text': 'object name prefix', 'default': 'none'}
+    params['new-bucket'] = {'text': 'new bucket'}
+    params['new-prefix'] = {
+        'text': 'new object name prefix',
+        'default': 'original prefix'
+    }
+    params['marker'] = {
+        'text': 'marker to resume after',
+        'default': 'start from the beginning'
+    }
+    super(CopyPrefixCommand, self).__init__(description, gcs_client, params)
+
+  def _run_api_command(self):
+    """Copy every object under a prefix.
+
+    Failures are logged one by one, and progress is logged with the marker
+    that resumes the command.
+
+    Returns:
+      The copy summary string message.
+
+    Raises:
+      gcs_error.GcsError if any object could not be copied.
+    """
+    return self._transfer(self._gcs_client.copy_prefix, 'copied')
+
+  def _transfer(self, method, verb):
+    """Runs copy_prefix or move_prefix and summarizes the results.
+
+    Args:
+      method: The bound copy_prefix or move_prefix method.
+      verb: The string past tense of the operation, for messages.
+
+    Returns:
+      The summary string message.
+
+    Raises:
+      gcs_error.GcsError if any object could not be transferred.
+    """
+    count = 0
+    failures = 0
+    first_error = None
+    marker = self._input.values['marker'] or None
+    try:
+      for object_name, error, marker in method(
+          self._input.values['original-bucket'],
+          self._input.values['prefix'],
+          self._input.values['new-bucket'],
+          self._input.values['new-prefix'] or None,
+          marker):
+        count += 1
+        if error:
+          logging.error('%s could not be %s: %s', object_name, verb, error)
+          failures += 1
+          first_error = first_error or error
+        if count % self.PROGRESS_INTERVAL == 0:
+          logging.info('%d objects %s, resume marker %s', count, verb, marker)
+    except:
+      logging.error('Stopped after %d objects, resume marker %s', count,
+                    marker)
+      raise
+    if first_error:
+      raise gcs_error.GcsError(
+          getattr(first_error, 'status', None),
+          '%d of %d objects could not be %s.' % (failures, count, verb))
+    return '%d objects %s.' % (count, verb)
+
+
+class MovePrefixCommand(CopyPrefixCommand):
+  """Move every object under a prefix."""
+
+  def _run_api_command(self):
+    """Move every object under a prefix.
+
+    Returns:
+      The move summary string message.
+
+    Raises:
+      gcs_error.GcsError if any object could not be moved.
+    """
+    return self._transfer(self._gcs_client.move_prefix, 'moved')
+
+
 class DeleteObjectCommand(GcsCommand):
   """Delete an object."""
 
@@ -577,3 +798,49 @@ class DeleteObjectCommand(GcsCommand):
         self._input.values['bucket'],
         self._input.values['object'])
     return '%s deleted.' % self._input.values['object']
+
+
+class SyncDirectoryCommand(GcsCommand):
+  """Sync a local directory with a bucket."""
+
+  def __init__(self, description, gcs_client):
+    """Initialize SyncDirectoryCommand with description and gcs_client.
+
+    Args:
+      description: The description for the user menu.
+      gcs_client: An instance of gcs.Gcs.
+    """
+    params = {}
+    params['directory'] = {
+        'text': 'local directory',
+        'default': '.',
+        'processing': lambda directory: directory or '.'
+    }
+    params['bucket'] = self.DEFAULT_BUCKET_USER_INPUT
+    params['prefix'] = {'text': 'object name prefix', 'default': 'none'}
+    params['direction'] = {
+        'text': 'up to upload or down to download',
+        'default': 'up',
+        'processing': lambda direction: direction.strip().lower() == 'down'
+    }
+    params['delete'] = {
+        'text': 'y to delete files missing from the source',
+        'default': 'n',
+        'processing': lambda delete: delete.strip().lower() == 'y'
+    }
+    super(SyncDirectoryCommand, self).__init__(description, gcs_client, params)
+
+  def _run_api_command(self):
+    """Sync a local directory with a bucket.
+
+    Returns:
+      The sync summary string message.
+    """
+    counts = self._gcs_client.sync_directory(
+        self._input.values['bucket'],
+        self._input.values['directory'],
+        self._input.values['prefix'],
+        download=self._input.values['direction'],
+        delete=self._input.values['delete'])
+    return ('%(uploaded)d uploaded, %(downloaded)d downloaded, '
+            '%(deleted)d deleted, %(unchanged)d unchanged.' % counts)
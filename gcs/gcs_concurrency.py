@@ -0,0 +1,247 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Adaptive limit on the number of requests a client has in flight."""
+
+import collections
+import logging
+import threading
+import time
+
+THROTTLE_STATUSES = (429, 503)
+DEFAULT_INITIAL_LIMIT = 8
+DEFAULT_MIN_LIMIT = 1
+DEFAULT_MAX_LIMIT = 64
+DEFAULT_BACKOFF_RATIO = 0.7
+DEFAULT_LATENCY_TOLERANCE = 2.0
+DEFAULT_HISTORY_SIZE = 20
+# Weight with which a latency above the baseline raises it, so the baseline
+# follows lasting changes such as a slower network path.
+BASELINE_WEIGHT = 0.001
+# Latencies a baseline needs before it counts towards latency decisions.
+MIN_LATENCY_SAMPLES = 20
+
+# Condition.wait without a timeout cannot be interrupted with Ctrl-C.
+_WAIT_TIMEOUT_SEC = 60 * 60 * 24
+
+INCREASE = 'increase'
+THROTTLED = 'throttled'
+LATENCY = 'latency'
+
+
+class ConcurrencyLimiter(object):
+  """Additive increase, multiplicative decrease limit on requests in flight.
+
+  The limit is revised once per round, a round being as many responses as
+  the limit. A round whose requests filled the limit raises it by one. A
+  round whose latencies averaged more than latency_tolerance times their
+  baselines lowers it by backoff_ratio, and so does the first throttling
+  response, 429 or 503, to a request sent since the last decrease. The
+  baseline of an operation and transfer size class is the lowest latency
+  seen, rising slowly while latencies stay above it, so it approximates the
+  latency of an unloaded service. Requests sent before a decrease do not
+  lower the limit again, so a burst of throttling responses backs off once.
+
+  The limiter bounds requests, not threads: a thread calls acquire before
+  sending a request and release when the response arrives, and waits while
+  the limit is reached.
+
+  Attributes:
+    min_limit: The lowest limit.
+    max_limit: The highest limit.
+    backoff_ratio: The factor applied to the limit on a decrease.
+    latency_tolerance: The ratio of round latency to baseline latency above
+        which the limit is lowered.
+    metrics: The gcs_metrics.Metrics that receives the limit, or None.
+  """
+
+  def __init__(self, initial_limit=DEFAULT_INITIAL_LIMIT,
+               min_limit=DEFAULT_MIN_LIMIT, max_limit=DEFAULT_MAX_LIMIT,
+               backoff_ratio=DEFAULT_BACKOFF_RATIO,
+               latency_tolerance=DEFAULT_LATENCY_TOLERANCE,
+               history_size=DEFAULT_HISTORY_SIZE, metrics=None):
+    """Inits ConcurrencyLimiter with limit bounds and adjustment factors.
+
+    Args:
+      initial_limit: The starting limit.
+      min_limit: The lowest limit.
+      max_limit: The highest limit.
+      backoff_ratio: The factor applied to the limit on a decrease, between
+          0 and 1.
+      latency_tolerance: The ratio of round latency to baseline latency
+          above which the limit is lowered.
+      history_size: The number of recent adjustments kept for get_stats.
+      metrics: An optional gcs_metrics.Metrics that receives the limit and
+          counts the adjustments.
+    """
+    self.min_limit = min_limit
+    self.max_limit = max_limit
+    self.backoff_ratio = backoff_ratio
+    self.latency_tolerance = latency_tolerance
+    self.metrics = metrics
+    self._limit = float(max(min_limit, min(max_limit, initial_limit)))
+    self._in_flight = 0
+    self._generation = 0
+    self._baselines = {}
+    self._history = collections.deque(maxlen=history_size)
+    self._condition = threading.Condition()
+    self._stats = {INCREASE: 0, THROTTLED: 0, LATENCY: 0, 'waits': 0}
+    self._start_round()
+    if metrics: metrics.record_concurrency_limit(int(self._limit))
+
+  def acquire(self):
+    """Waits until a request may be sent and counts it as in flight.
+
+    Returns:
+      A ticket to pass to release.
+    """
+    with self._condition:
+      if self._in_flight >= int(self._limit):
+        self._stats['waits'] += 1
+        while self._in_flight >= int(self._limit):
+          self._condition.wait(_WAIT_TIMEOUT_SEC)
+      self._in_flight += 1
+      if self._in_flight >= int(self._limit):
+        self._round_saturated = True
+      return self._generation
+
+  def release(self, ticket, operation, status, latency_sec, size=0):
+    """Counts a request as finished and revises the limit from its outcome.
+
+    Args:
+      ticket: The value acquire returned for the request.
+      operation: The string operation name.
+      status: The integer HTTP status, or gcs_metrics.NO_RESPONSE if the
+          request failed without a response.
+      latency_sec: The time from sending the request to reading the
+          response.
+      size: The number of bytes sent and received.
+    """
+    with self._condition:
+      self._in_flight -= 1
+      if status in THROTTLE_STATUSES:
+        if ticket == self._generation:
+          self._decrease(THROTTLED)
+      elif isinstance(status, int):
+        self._record_latency((operation, size.bit_length() / 2),
+                             latency_sec)
+      self._round_responses += 1
+      if self._round_responses >= int(self._limit):
+        self._end_round()
+      self._condition.notify_all()
+
+  def get_limit(self):
+    """Gets the current limit.
+
+    Returns:
+      The integer number of requests that may be in flight.
+    """
+    with self._condition:
+      return int(self._limit)
+
+  def get_stats(self):
+    """Gets the limit, counters and recent adjustments.
+
+    Returns:
+      A dictionary with the limit, the requests in flight, the number of
+      increase, throttled and latency adjustments, the number of acquire
+      calls that had to wait, and under adjustments the recent adjustments
+      as dictionaries with their time, reason, and the limit before and
+      after.
+    """
+    with self._condition:
+      stats = dict(self._stats)
+      stats['limit'] = int(self._limit)
+      stats['in_flight'] = self._in_flight
+      stats['adjustments'] = list(self._history)
+    return stats
+
+  def _record_latency(self, key, latency_sec):
+    """Adds a latency to the round and updates its baseline.
+
+    The caller holds the lock.
+
+    Args:
+      key: The operation name and size class of the request.
+      latency_sec: The latency of the request, in seconds.
+    """
+    baseline = self._baselines.get(key)
+    if baseline is None:
+      self._baselines[key] = [latency_sec, 1]
+      return
+    if baseline[1] >= MIN_LATENCY_SAMPLES and baseline[0] > 0:
+      self._round_latency_ratio += latency_sec / baseline[0]
+      self._round_latency_count += 1
+    if latency_sec < baseline[0]:
+      baseline[0] = latency_sec
+    else:
+      baseline[0] += BASELINE_WEIGHT * (latency_sec - baseline[0])
+    baseline[1] += 1
+
+  def _end_round(self):
+    """Revises the limit from the finished round and starts the next one.
+
+    The caller holds the lock.
+    """
+    if (self._round_latency_count and
+        self._round_latency_ratio / self._round_latency_count >
+        self.latency_tolerance):
+      self._decrease(LATENCY)
+      return
+    if self._round_saturated and self._limit < self.max_limit:
+      self._adjust(min(self.max_limit, self._limit + 1), INCREASE)
+    self._start_round()
+
+  def _decrease(self, reason):
+    """Lowers the limit and starts a new round.
+
+    The caller holds the lock.
+
+    Args:
+      reason: THROTTLED or LATENCY.
+    """
+    self._generation += 1
+    self._adjust(max(self.min_limit, self._limit * self.backoff_ratio),
+                 reason)
+    self._start_round()
+
+  def _adjust(self, limit, reason):
+    """Sets the limit and records the adjustment.
+
+    The caller holds the lock.
+
+    Args:
+      limit: The new limit.
+      reason: INCREASE, THROTTLED or LATENCY.
+    """
+    previous = int(self._limit)
+    self._limit = limit
+    self._stats[reason] += 1
+    self._history.append({'time': time.time(), 'reason': reason,
+                          'previous': previous, 'limit': int(limit)})
+    if reason != INCREASE:
+      logging.debug('Concurrency limit lowered from %d to %d (%s).',
+                    previous, int(limit), reason)
+    if self.metrics:
+      self.metrics.record_concurrency_limit(int(limit), reason)
+
+  def _start_round(self):
+    """Clears the round counters.
+
+    The caller holds the lock.
+    """
+    self._round_responses = 0
+    self._round_saturated = False
+    self._round_latency_ratio = 0.0
+    self._round_latency_count = 0
@@ -0,0 +1,667 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""In-process emulator of the Cloud Storage XML API.
+
+EmulatorTransport answers the requests of a GcsXml client from memory instead
+of sending them over the network, so the client can be exercised and
+benchmarked without Cloud Storage. It serves the service, bucket and object
+GET, PUT, HEAD and DELETE requests the client sends, including ?cors,
+?location, ?acl, copies, compose requests, listings and resumable uploads.
+
+Every request is delayed by a fixed latency plus the time its request and
+response bodies take at the configured bandwidth. The delay is applied per
+request, like the round trip and throughput of a single connection, so
+concurrent requests overlap as they would on separate connections.
+
+Example:
+  emulator = gcs_emulator.EmulatorTransport(latency_sec=0.02,
+                                            bandwidth_bytes_per_sec=10 << 20)
+  gcs_client = gcs_xml.GcsXml(None, 'project', transport=emulator)
+"""
+
+import base64
+import bisect
+import hashlib
+import itertools
+import re
+import threading
+import time
+import urllib
+import urlparse
+import xml.etree.ElementTree as xml
+from xml.sax import saxutils
+
+import httplib2
+
+import gcs_stream
+import gcs_transport
+
+BASE_HOST = 'storage.googleapis.com'
+DEFAULT_LOCATION = 'US'
+DEFAULT_MAX_KEYS = 1000
+XML_NAMESPACE = 'http://doc.s3.amazonaws.com/2006-03-01'
+RESUME_INCOMPLETE = 308
+REASONS = {
+    200: 'OK',
+    201: 'Created',
+    204: 'No Content',
+    206: 'Partial Content',
+    304: 'Not Modified',
+    308: 'Resume Incomplete',
+    400: 'Bad Request',
+    404: 'Not Found',
+    409: 'Conflict',
+    412: 'Precondition Failed',
+    416: 'Requested Range Not Satisfiable',
+}
+
+# Object generations increase with every write, like Cloud Storage's.
+_generations = itertools.count(int(time.time() * 1000000))
+
+
+class _Object(object):
+  """A stored object.
+
+  Attributes:
+    data: The string object body, as stored.
+    content_type: The string content type.
+    content_encoding: The string content encoding, or None.
+    etag: The string hex MD5 of data.
+    md5: The string base64 MD5 of data.
+    last_modified: The string ISO 8601 creation time.
+    generation: The integer generation of the object.
+  """
+
+  __slots__ = ('data', 'content_type', 'content_encoding', 'etag', 'md5',
+               'last_modified', 'generation')
+
+  def __init__(self, data, content_type=None, content_encoding=None):
+    """Inits _Object with its body and metadata.
+
+    Args:
+      data: The string object body.
+      content_type: The string content type.
+      content_encoding: The string content encoding.
+    """
+    digest = hashlib.md5(data)
+    self.data = data
+    self.content_type = content_type or 'application/octet-stream'
+    self.content_encoding = content_encoding
+    self.etag = digest.hexdigest()
+    self.md5 = base64.b64encode(digest.digest())
+    self.last_modified = time.strftime('%Y-%m-%dT%H:%M:%S.000Z',
+                                       time.gmtime())
+    self.generation = next(_generations)
+
+
+class _Bucket(object):
+  """A bucket and its objects.
+
+  Attributes:
+    objects: A dictionary mapping object names to _Object instances.
+    names: The sorted list of object names.
+    location: The string location constraint.
+    cors: The string CorsConfig XML document.
+    creation_date: The string ISO 8601 creation time.
+  """
+
+  def __init__(self, location=DEFAULT_LOCATION):
+    """Inits an empty _Bucket.
+
+    Args:
+      location: The string location constraint.
+    """
+    self.objects = {}
+    self.names = []
+    self.location = location
+    self.cors = '<CorsConfig/>'
+    self.creation_date = time.strftime('%Y-%m-%dT%H:%M:%S.000Z',
+                                       time.gmtime())
+
+  def put(self, name, obj):
+    """Stores an object, replacing any object with the same name.
+
+    Args:
+      name: The string object name.
+      obj: The _Object to store.
+    """
+    if name not in self.objects:
+      bisect.insort(self.names, name)
+    self.objects[name] = obj
+
+  def remove(self, name):
+    """Removes an object.
+
+    Args:
+      name: The string object name, which must exist.
+    """
+    del self.objects[name]
+    del self.names[bisect.bisect_left(self.names, name)]
+
+
+class _Upload(object):
+  """A resumable upload session.
+
+  Attributes:
+    bucket_name: The string bucket name.
+    object_name: The string object name.
+    content_type: The string content type.
+    content_encoding: The string content encoding, or None.
+    parts: A list of the string chunks committed so far.
+    committed: The number of bytes committed so far.
+  """
+
+  def __init__(self, bucket_name, object_name, content_type,
+               content_encoding):
+    """Inits an empty _Upload.
+
+    Args:
+      bucket_name: The string bucket name.
+      object_name: The string object name.
+      content_type: The string content type.
+      content_encoding: The string content encoding.
+    """
+    self.bucket_name = bucket_name
+    self.object_name = object_name
+    self.content_type = content_type
+    self.content_encoding = content_encoding
+    self.parts = []
+    self.committed = 0
+
+
+class EmulatorTransport(gcs_transport.Transport):
+  """Thread-safe transport serving the XML API from an in-memory store.
+
+  Buckets are created on first use by put_object, or by an insert bucket
+  request.
+
+  Attributes:
+    latency_sec: The delay added to every request, in seconds.
+    bandwidth_bytes_per_sec: The rate at which request and response bodies
+        are transferred, or None for no limit.
+  """
+
+  def __init__(self, latency_sec=0, bandwidth_bytes_per_sec=None):
+    """Inits EmulatorTransport with an empty store and a network profile.
+
+    Args:
+      latency_sec: The delay added to every request, in seconds.
+      bandwidth_bytes_per_sec: The rate at which request and response bodies
+          are transferred, or None for no limit.
+    """
+    self.latency_sec = latency_sec
+    self.bandwidth_bytes_per_sec = bandwidth_bytes_per_sec
+    self._buckets = {}
+    self._uploads = {}
+    self._next_upload_id = 0
+    self._lock = threading.Lock()
+    self._stats = {'requests': 0, 'request_bytes': 0, 'response_bytes': 0}
+
+  def put_object(self, bucket_name, object_name, data, content_type=None,
+                 content_encoding=None):
+    """Stores an object directly, without a request or delay.
+
+    Args:
+      bucket_name: The string bucket name. The bucket is created if needed.
+      object_name: The string object name.
+      data: The string object body.
+      content_type: The string content type.
+      content_encoding: The string content encoding.
+    """
+    obj = _Object(data, content_type, content_encoding)
+    with self._lock:
+      bucket = self._buckets.get(bucket_name)
+      if not bucket:
+        bucket = self._buckets[bucket_name] = _Bucket()
+      bucket.put(object_name, obj)
+
+  def request(self, uri, method='GET', headers=None, body=None):
+    """Serves an XML API request from the store.
+
+    Args:
+      uri: The full request URI.
+      method: The HTTP request method.
+      headers: A dictionary of request headers.
+      body: The request body, a string or a file-like object.
+
+    Returns:
+      The httplib2.Response and string content.
+    """
+    if not headers: headers = {}
+    headers = dict((key.lower(), value) for key, value in headers.iteritems())
+    body = _read_body(body)
+    parsed = urlparse.urlsplit(uri)
+    bucket_name = None
+    if parsed.hostname != BASE_HOST:
+      bucket_name = parsed.hostname[:-len(BASE_HOST) - 1]
+    object_name = urllib.unquote(parsed.path[1:])
+    query = urlparse.parse_qs(parsed.query, keep_blank_values=True)
+    query = dict((key, values[0]) for key, values in query.iteritems())
+
+    with self._lock:
+      status, response_headers, content = self._dispatch(
+          method, bucket_name, object_name, query, headers, body)
+    response_headers['status'] = str(status)
+    response_headers['reason'] = REASONS.get(status, '')
+    response_headers['content-length'] = str(len(content))
+    if method == 'HEAD': content = ''
+
+    with self._lock:
+      self._stats['requests'] += 1
+      self._stats['request_bytes'] += len(body)
+      self._stats['response_bytes'] += len(content)
+    delay = self.latency_sec
+    if self.bandwidth_bytes_per_sec:
+      delay += float(len(body) + len(content)) / self.bandwidth_bytes_per_sec
+    if delay > 0: time.sleep(delay)
+    return httplib2.Response(response_headers), content
+
+  def get_stats(self):
+    """Gets the request counters of the emulator.
+
+    Returns:
+      A dictionary with the requests, request_bytes and response_bytes
+      counters.
+    """
+    with self._lock:
+      return dict(self._stats)
+
+  def _dispatch(self, method, bucket_name, object_name, query, headers,
+                body):
+    """Routes a request to its handler. The caller holds the lock.
+
+    Args:
+      method: The HTTP request method.
+      bucket_name: The string bucket name, or None for the service.
+      object_name: The string object name, or '' for a bucket request.
+      query: A dictionary of query parameters.
+      headers: A dictionary of request headers with lower case names.
+      body: The string request body.
+
+    Returns:
+      A (status, headers, content) tuple.
+    """
+    if 'upload_id' in query:
+      return self._put_upload_chunk(query['upload_id'], headers, body)
+    if not bucket_name:
+      if method != 'GET':
+        return _error(400, 'InvalidArgument')
+      return self._get_buckets()
+    bucket = self._buckets.get(bucket_name)
+    if not object_name:
+      if method == 'PUT' and 'cors' not in query:
+        return self._insert_bucket(bucket_name, body)
+      if not bucket:
+        return _error(404, 'NoSuchBucket')
+      if method == 'DELETE':
+        return self._delete_bucket(bucket_name)
+      if 'cors' in query:
+        if method == 'PUT':
+          bucket.cors = body
+          return 200, {}, ''
+        return 200, {}, bucket.cors
+      if 'location' in query:
+        return 200, {}, (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<LocationConstraint>%s</LocationConstraint>' % bucket.location)
+      return self._list_objects(bucket_name, bucket, query)
+    if not bucket:
+      return _error(404, 'NoSuchBucket')
+    if method == 'POST' and headers.get('x-goog-resumable') == 'start':
+      return self._start_upload(bucket_name, object_name, headers)
+    if method == 'PUT' and 'compose' in query:
+      return self._compose_object(bucket, object_name, headers, body)
+    if method == 'PUT' and 'x-goog-copy-source' in headers:
+      return self._copy_object(bucket, object_name, headers)
+    if method == 'PUT':
+      return self._insert_object(bucket, object_name, headers, body)
+    obj = bucket.objects.get(object_name)
+    if not obj:
+      return _error(404, 'NoSuchKey')
+    if method == 'DELETE':
+      generation = headers.get('x-goog-if-generation-match')
+      if generation and generation != str(obj.generation):
+        return _error(412, 'PreconditionFailed')
+      bucket.remove(object_name)
+      return 204, {}, ''
+    if 'acl' in query:
+      return 200, {}, (
+          '<?xml version="1.0" encoding="UTF-8"?><AccessControlList>'
+          '<Entries><Entry><Scope type="UserById"><ID>emulator</ID></Scope>'
+          '<Permission>FULL_CONTROL</Permission></Entry></Entries>'
+          '</AccessControlList>')
+    return self._get_object(obj, headers)
+
+  def _get_buckets(self):
+    """Lists every bucket.
+
+    Returns:
+      A (status, headers, content) tuple.
+    """
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>'
+             '<ListAllMyBucketsResult xmlns="%s"><Buckets>' % XML_NAMESPACE]
+    for name in sorted(self._buckets):
+      parts.append('<Bucket><Name>%s</Name><CreationDate>%s</CreationDate>'
+                   '</Bucket>' % (saxutils.escape(name),
+                                  self._buckets[name].creation_date))
+    parts.append('</Buckets></ListAllMyBucketsResult>')
+    return 200, {}, ''.join(parts)
+
+  def _insert_bucket(self, bucket_name, body):
+    """Creates a bucket.
+
+    Args:
+      bucket_name: The string bucket name.
+      body: The string CreateBucketConfiguration document, or ''.
+
+    Returns:
+      A (status, headers, content) tuple.
+    """
+    if bucket_name in self._buckets:
+      return _error(409, 'BucketAlreadyOwnedByYou')
+    location = DEFAULT_LOCATION
+    if body:
+      match = re.search(r'<LocationConstraint>(.*?)</LocationConstraint>',
+                        body)
+      if match: location = match.group(1)
+    self._buckets[bucket_name] = _Bucket(location)
+    return 200, {}, ''
+
+  def _delete_bucket(self, bucket_name):
+    """Deletes an empty bucket.
+
+    Args:
+      bucket_name: The string bucket name, which must exist.
+
+    Returns:
+      A (status, headers, content) tuple.
+    """
+    if self._buckets[bucket_name].objects:
+      return _error(409, 'BucketNotEmpty')
+    del self._buckets[bucket_name]
+    return 204, {}, ''
+
+  def _list_objects(self, bucket_name, bucket, query):
+    """Lists one page of a bucket.
+
+    Args:
+      bucket_name: The string bucket name.
+      bucket: The _Bucket to list.
+      query: A dictionary with the optional prefix, delimiter, marker and
+          max-keys parameters.
+
+    Returns:
+      A (status, headers, content) tuple.
+    """
+    prefix = query.get('prefix', '')
+    delimiter = query.get('delimiter')
+    marker = query.get('marker', '')
+    max_keys = int(query.get('max-keys', DEFAULT_MAX_KEYS))
+    names = bucket.names
+    index = bisect.bisect_right(names, marker)
+    if prefix: index = max(index, bisect.bisect_left(names, prefix))
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>'
+             '<ListBucketResult xmlns="%s"><Name>%s</Name>'
+             % (XML_NAMESPACE, saxutils.escape(bucket_name))]
+    count = 0
+    last_name = None
+    truncated = False
+    while index < len(names):
+      name = names[index]
+      if not name.startswith(prefix):
+        break
+      if count == max_keys:
+        truncated = True
+        break
+      if delimiter:
+        position = name.find(delimiter, len(prefix))
+        if position != -1:
+          common_prefix = name[:position + len(delimiter)]
+          while index < len(names) and names[index].startswith(common_prefix):
+            index += 1
+          # A marker naming a common prefix resumes after the whole prefix.
+          if common_prefix > marker:
+            parts.append(
+                '<CommonPrefixes><Prefix>%s</Prefix></CommonPrefixes>'
+                % saxutils.escape(common_prefix))
+            count += 1
+            last_name = common_prefix
+          continue
+      obj = bucket.objects[name]
+      parts.append(
+          '<Contents><Key>%s</Key><LastModified>%s</LastModified>'
+          '<ETag>"%s"</ETag><Size>%d</Size></Contents>'
+          % (saxutils.escape(name), obj.last_modified, obj.etag,
+             len(obj.data)))
+      count += 1
+      last_name = name
+      index += 1
+    parts.append('<IsTruncated>%s</IsTruncated>' % str(truncated).lower())
+    if truncated and last_name:
+      parts.append('<NextMarker>%s</NextMarker>' % saxutils.escape(last_name))
+    parts.append('</ListBucketResult>')
+    return 200, {}, ''.join(parts)
+
+  def _get_object(self, obj, headers):
+    """Serves an object body, a byte range of it, or its metadata.
+
+    Args:
+      obj: The _Object to serve.
+      headers: A dictionary of request headers with lower case names.
+
+    Returns:
+      A (status, headers, content) tuple.
+    """
+    response_headers = _get_object_headers(obj)
+    if headers.get('if-none-match', '').strip('"') == obj.etag:
+      return 304, response_headers, ''
+    if obj.content_encoding:
+      response_headers['content-encoding'] = obj.content_encoding
+    byte_range = headers.get('range')
+    if not byte_range:
+      return 200, response_headers, obj.data
+    first, _, last = byte_range.split('=', 1)[1].partition('-')
+    size = len(obj.data)
+    first = int(first)
+    if first >= size:
+      return _error(416, 'InvalidRange')
+    last = size - 1 if not last else min(int(last), size - 1)
+    response_headers['content-range'] = 'bytes %d-%d/%d' % (first, last, size)
+    return 206, response_headers, obj.data[first:last + 1]
+
+  def _insert_object(self, bucket, object_name, headers, body):
+    """Stores an object sent in a single request.
+
+    Args:
+      bucket: The _Bucket to store the object in.
+      object_name: The string object name.
+      headers: A dictionary of request headers with lower case names.
+      body: The string object body.
+
+    Returns:
+      A (status, headers, content) tuple.
+    """
+    obj = _Object(body, headers.get('content-type'),
+                  headers.get('content-encoding'))
+    content_md5 = headers.get('content-md5')
+    if content_md5 and content_md5 != obj.md5:
+      return _error(400, 'BadDigest')
+    bucket.put(object_name, obj)
+    return 200, _get_object_headers(obj), ''
+
+  def _copy_object(self, bucket, object_name, headers):
+    """Copies an object within or between buckets.
+
+    Args:
+      bucket: The destination _Bucket.
+      object_name: The string destination object name.
+      headers: A dictionary of request headers with lower case names,
+          including x-goog-copy-source.
+
+    Returns:
+      A (status, headers, content) tuple.
+    """
+    source_bucket_name, _, source_name = (
+        headers['x-goog-copy-source'].lstrip('/').partition('/'))
+    source_bucket = self._buckets.get(source_bucket_name)
+    if not source_bucket or source_name not in source_bucket.objects:
+      return _error(404, 'NoSuchKey')
+    obj = source_bucket.objects[source_name]
+    bucket.put(object_name, obj)
+    return 200, {}, (
+        '<?xml version="1.0" encoding="UTF-8"?><CopyObjectResult>'
+        '<LastModified>%s</LastModified><ETag>"%s"</ETag></CopyObjectResult>'
+        % (obj.last_modified, obj.etag))
+
+  def _compose_object(self, bucket, object_name, headers, body):
+    """Joins objects of a bucket into a new object.
+
+    Args:
+      bucket: The _Bucket holding the components.
+      object_name: The string name of the composed object.
+      headers: A dictionary of request headers with lower case names.
+      body: The string ComposeRequest document.
+
+    Returns:
+      A (status, headers, content) tuple.
+    """
+    parts = []
+    for component in xml.fromstring(body).iter('Name'):
+      obj = bucket.objects.get(component.text)
+      if not obj:
+        return _error(400, 'InvalidArgument')
+      parts.append(obj.data)
+    obj = _Object(''.join(parts), headers.get('content-type'),
+                  headers.get('content-encoding'))
+    bucket.put(object_name, obj)
+    return 200, _get_object_headers(obj), ''
+
+  def _start_upload(self, bucket_name, object_name, headers):
+    """Starts a resumable upload session.
+
+    Args:
+      bucket_name: The string bucket name.
+      object_name: The string object name.
+      headers: A dictionary of request headers with lower case names.
+
+    Returns:
+      A (status, headers, content) tuple whose location header holds the
+      session URI.
+    """
+    self._next_upload_id += 1
+    upload_id = '%d' % self._next_upload_id
+    self._uploads[upload_id] = _Upload(
+        bucket_name, object_name, headers.get('content-type'),
+        headers.get('content-encoding'))
+    return 201, {'location': 'http://%s.%s/%s?upload_id=%s' % (
+        bucket_name, BASE_HOST, urllib.quote(object_name), upload_id)}, ''
+
+  def _put_upload_chunk(self, upload_id, headers, body):
+    """Commits a chunk of a resumable upload, or reports its progress.
+
+    Args:
+      upload_id: The string upload session id.
+      headers: A dictionary of request headers with lower case names,
+          including Content-Range.
+      body: The string chunk.
+
+    Returns:
+      A (status, headers, content) tuple. The status is RESUME_INCOMPLETE
+      until the last byte of the object has been committed.
+    """
+    upload = self._uploads.get(upload_id)
+    if not upload:
+      return _error(404, 'NoSuchUpload')
+    match = re.match(r'bytes (?:(\d+)-\d+|\*)/(\d+|\*)',
+                     headers.get('content-range', ''))
+    if not match:
+      return _error(400, 'InvalidArgument')
+    first, total = match.groups()
+    if first is not None:
+      first = int(first)
+      if first > upload.committed:
+        return _error(400, 'InvalidArgument')
+      data = body[upload.committed - first:]
+      upload.parts.append(data)
+      upload.committed += len(data)
+    if total == '*' or upload.committed < int(total):
+      response_headers = {}
+      if upload.committed:
+        response_headers['range'] = 'bytes=0-%d' % (upload.committed - 1)
+      return RESUME_INCOMPLETE, response_headers, ''
+    bucket = self._buckets.get(upload.bucket_name)
+    if not bucket:
+      return _error(404, 'NoSuchBucket')
+    obj = _Object(''.join(upload.parts), upload.content_type,
+                  upload.content_encoding)
+    bucket.put(upload.object_name, obj)
+    del self._uploads[upload_id]
+    return 200, _get_object_headers(obj), ''
+
+
+def _get_object_headers(obj):
+  """Builds the metadata headers sent with an object.
+
+  Args:
+    obj: The _Object.
+
+  Returns:
+    A dictionary of response headers with lower case names.
+  """
+  return {
+      'content-type': obj.content_type,
+      'etag': '"%s"' % obj.etag,
+      'x-goog-generation': str(obj.generation),
+      'x-goog-hash': 'md5=%s' % obj.md5,
+      'x-goog-stored-content-encoding': obj.content_encoding or 'identity',
+      'x-goog-stored-content-length': str(len(obj.data)),
+  }
+
+
+def _error(status, code):
+  """Builds an XML API error response.
+
+  Args:
+    status: The integer HTTP status.
+    code: The string error code, such as NoSuchKey.
+
+  Returns:
+    A (status, headers, content) tuple.
+  """
+  return status, {'content-type': 'application/xml'}, (
+      '<?xml version="1.0" encoding="UTF-8"?>'
+      '<Error><Code>%s</Code></Error>' % code)
+
+
+def _read_body(body):
+  """Reads a request body into a string.
+
+  Args:
+    body: A string, a file-like object, or None.
+
+  Returns:
+    The string body.
+  """
+  if not body:
+    return ''
+  if not hasattr(body, 'read'):
+    return body
+  parts = []
+  while True:
+    data = body.read(gcs_stream.DEFAULT_CHUNK_SIZE)
+    if not data:
+      break
+    parts.append(data)
+  return ''.join(parts)
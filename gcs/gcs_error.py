@@ -17,23 +17,31 @@
 __author__ = 'kbrisbin@google.com (Kathryn Hurley)'
 
 
+RETRYABLE_STATUSES = (408, 429, 500, 502, 503, 504)
+
+
 class GcsError(Exception):
   """Exception raised when API call does not return a 20x status.
 
   Attributes:
     status: The string status of the HTTP response.
     message: A string message explaining the error.
+    retryable: True if the request may succeed when sent again.
   """
 
-  def __init__(self, status, message):
+  def __init__(self, status, message, retryable=None):
     """Inits GcsError with status and message.
 
     Args:
       status: String status of the HTTP response.
       message: A string message explaining the error.
+      retryable: Whether the request may succeed when sent again. Defaults to
+          True for throttling, timeout and server error statuses.
     """
     self.status = status
     self.message = message
+    if retryable is None: retryable = status in RETRYABLE_STATUSES
+    self.retryable = retryable
 
   def __str__(self):
     """Displays the error as <status>: <error message>.
@@ -42,3 +50,52 @@ class GcsError(Exception):
       The string representation of the error.
     """
     return '%s: %s' % (repr(self.status), repr(self.message))
+
+
+class GcsIntegrityError(GcsError):
+  """Exception raised when transferred bytes do not match their checksums.
+
+  Attributes:
+    hash_name: The string name of the mismatched hash, md5 or crc32c.
+    expected: The base64 digest reported by Cloud Storage.
+    actual: The base64 digest of the bytes sent or received.
+  """
+
+  def __init__(self, message, hash_name=None, expected=None, actual=None):
+    """Inits GcsIntegrityError with the mismatched digests.
+
+    Args:
+      message: A string message explaining the error.
+      hash_name: The string name of the mismatched hash.
+      expected: The base64 digest reported by Cloud Storage.
+      actual: The base64 digest of the bytes sent or received.
+    """
+    super(GcsIntegrityError, self).__init__(None, message, retryable=True)
+    self.hash_name = hash_name
+    self.expected = expected
+    self.actual = actual
+
+
+class GcsWriteSupersededError(GcsError):
+  """Exception raised when a queued write is replaced by a newer write.
+
+  The write was never sent. The newer write to the same object is sent in its
+  place, so retrying the superseded write would undo it.
+
+  Attributes:
+    bucket_name: The name of the bucket of the object.
+    object_name: The name of the object.
+  """
+
+  def __init__(self, bucket_name, object_name):
+    """Inits GcsWriteSupersededError with the object written.
+
+    Args:
+      bucket_name: The name of the bucket of the object.
+      object_name: The name of the object.
+    """
+    super(GcsWriteSupersededError, self).__init__(
+        None, 'Write to %s/%s superseded by a newer write.' % (
+            bucket_name, object_name), retryable=False)
+    self.bucket_name = bucket_name
+    self.object_name = object_name
@@ -0,0 +1,326 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Hedging policy that cuts the tail latency of idempotent reads."""
+
+import collections
+import logging
+import Queue
+import threading
+import time
+
+HEDGED_METHODS = ('GET', 'HEAD')
+DEFAULT_PERCENTILE = 0.95
+DEFAULT_BUDGET_RATIO = 0.05
+DEFAULT_BUDGET_MAX_TOKENS = 10
+DEFAULT_WINDOW_SIZE = 1000
+DEFAULT_MIN_SAMPLES = 50
+DEFAULT_MAX_HEDGE_BYTES = 256 * 1024
+# The hedge delay is recomputed after this many new latency samples.
+RECOMPUTE_INTERVAL = 25
+
+# Queue.get without a timeout cannot be interrupted with Ctrl-C.
+_WAIT_TIMEOUT_SEC = 60 * 60 * 24
+
+
+class Cancellation(object):
+  """Lets one thread cancel a request that another thread is sending.
+
+  A transport that can interrupt a request, such as
+  gcs_http2.Http2Transport, registers a callback that does so and returns
+  True if the request was still in flight. Cancelling runs the callbacks
+  once; a callback added afterwards runs at once.
+
+  Attributes:
+    cancelled: True once cancel has been called.
+  """
+
+  def __init__(self):
+    """Inits a Cancellation that has not been cancelled."""
+    self.cancelled = False
+    self._callbacks = []
+    self._lock = threading.Lock()
+
+  def add_callback(self, callback):
+    """Registers a callable to run when the request is cancelled.
+
+    Args:
+      callback: A callable taking no arguments.
+    """
+    with self._lock:
+      if not self.cancelled:
+        self._callbacks.append(callback)
+        return
+    callback()
+
+  def cancel(self):
+    """Cancels the request by running the registered callbacks.
+
+    Returns:
+      True if a callback reported that it interrupted a request in flight.
+    """
+    with self._lock:
+      if self.cancelled:
+        return False
+      self.cancelled = True
+      callbacks = self._callbacks
+      self._callbacks = []
+    interrupted = False
+    for callback in callbacks:
+      try:
+        interrupted = callback() or interrupted
+      except Exception:
+        logging.exception('Cancelling a request failed.')
+    return interrupted
+
+
+class HedgePolicy(object):
+  """Sends a second copy of a slow read and keeps whichever finishes first.
+
+  The hedge delay of an operation is the given percentile of its recent
+  latencies, so only the slowest requests are duplicated. Every call
+  deposits budget_ratio tokens into a client-wide budget, up to
+  budget_max_tokens, and every hedge spends one, so hedges add at most
+  budget_ratio extra requests once the initial tokens are spent.
+
+  Each copy is given a Cancellation, and the slower copy is cancelled once
+  the other finishes. A transport that cannot interrupt it leaves it to
+  complete, its response discarded and its latency still counted towards
+  the delay. Hedging needs a transport that runs requests concurrently,
+  such as gcs_transport.PooledHttpTransport.
+
+  Operations that download object bodies are hedged only when the body is
+  small: when its expected size is known and at most max_hedge_bytes, or
+  otherwise when every recent response of the operation was that small.
+
+  Attributes:
+    percentile: The latency percentile after which a hedge is sent.
+    budget_ratio: Tokens earned per call.
+    budget_max_tokens: The most tokens the budget holds.
+    window_size: The number of recent latencies kept per operation.
+    min_samples: The number of latencies needed before an operation is
+        hedged.
+    max_hedge_bytes: The largest response body that is hedged.
+  """
+
+  def __init__(self, percentile=DEFAULT_PERCENTILE,
+               budget_ratio=DEFAULT_BUDGET_RATIO,
+               budget_max_tokens=DEFAULT_BUDGET_MAX_TOKENS,
+               window_size=DEFAULT_WINDOW_SIZE,
+               min_samples=DEFAULT_MIN_SAMPLES,
+               max_hedge_bytes=DEFAULT_MAX_HEDGE_BYTES):
+    """Inits HedgePolicy with a hedge percentile and budget limits.
+
+    Args:
+      percentile: The latency percentile after which a hedge is sent,
+          between 0 and 1.
+      budget_ratio: Tokens earned per call.
+      budget_max_tokens: The most tokens the budget holds. The budget starts
+          full.
+      window_size: The number of recent latencies kept per operation.
+      min_samples: The number of latencies needed before an operation is
+          hedged.
+      max_hedge_bytes: The largest response body that is hedged.
+    """
+    self.percentile = percentile
+    self.budget_ratio = budget_ratio
+    self.budget_max_tokens = budget_max_tokens
+    self.window_size = window_size
+    self.min_samples = min_samples
+    self.max_hedge_bytes = max_hedge_bytes
+    self._tokens = float(budget_max_tokens)
+    self._latencies = {}
+    self._delays = {}
+    self._sizes = {}
+    self._samples_since_update = collections.defaultdict(int)
+    self._lock = threading.Lock()
+    self._stats = {'calls': 0, 'hedges': 0, 'hedge_wins': 0,
+                   'hedge_cancels': 0, 'budget_exhausted': 0}
+
+  def call(self, operation, func):
+    """Calls func, and calls it again if the first call is slow.
+
+    Args:
+      operation: The string operation name, such as get_object_metadata.
+      func: A callable that sends the request, taking a Cancellation that
+          is cancelled if the other copy finishes first.
+
+    Returns:
+      The result of the first call to finish without raising.
+
+    Raises:
+      The exception of the first call if both calls raised, or if the first
+      call raised before a hedge was sent.
+    """
+    with self._lock:
+      self._stats['calls'] += 1
+      self._tokens = min(self.budget_max_tokens,
+                         self._tokens + self.budget_ratio)
+      delay = self._delays.get(operation)
+    if delay is None:
+      start = time.time()
+      result = func(Cancellation())
+      self.record_latency(operation, time.time() - start)
+      return result
+
+    results = Queue.Queue()
+    cancellations = (Cancellation(), Cancellation())
+    self._start(operation, func, results, cancellations, False)
+    try:
+      hedged, result, error = results.get(True, delay)
+    except Queue.Empty:
+      pass
+    else:
+      if error:
+        raise error
+      return result
+
+    if not self._spend_token():
+      hedged, result, error = results.get(True, _WAIT_TIMEOUT_SEC)
+      if error:
+        raise error
+      return result
+    logging.debug('Hedging %s after %.3fs.', operation, delay)
+    self._start(operation, func, results, cancellations, True)
+    first_error = None
+    for _ in range(2):
+      hedged, result, error = results.get(True, _WAIT_TIMEOUT_SEC)
+      if not error:
+        # The other copy is still in flight unless it already failed.
+        cancelled = (not first_error and
+                     cancellations[not hedged].cancel())
+        with self._lock:
+          if hedged: self._stats['hedge_wins'] += 1
+          if cancelled: self._stats['hedge_cancels'] += 1
+        return result
+      first_error = first_error or error
+    raise first_error
+
+  def record_latency(self, operation, latency_sec):
+    """Adds the latency of a completed call to the operation's window.
+
+    Args:
+      operation: The string operation name.
+      latency_sec: The latency of the call, in seconds.
+    """
+    with self._lock:
+      latencies = self._latencies.get(operation)
+      if latencies is None:
+        latencies = self._latencies[operation] = collections.deque(
+            maxlen=self.window_size)
+      latencies.append(latency_sec)
+      self._samples_since_update[operation] += 1
+      if (len(latencies) < self.min_samples or
+          self._samples_since_update[operation] < RECOMPUTE_INTERVAL):
+        return
+      self._samples_since_update[operation] = 0
+      ordered = sorted(latencies)
+      self._delays[operation] = ordered[
+          min(len(ordered) - 1, int(self.percentile * len(ordered)))]
+
+  def record_size(self, operation, size):
+    """Adds the body size of a completed call to the operation's window.
+
+    Args:
+      operation: The string operation name.
+      size: The number of bytes in the response body.
+    """
+    with self._lock:
+      sizes = self._sizes.get(operation)
+      if sizes is None:
+        sizes = self._sizes[operation] = collections.deque(
+            maxlen=self.window_size)
+      sizes.append(size)
+
+  def is_small(self, operation, size=None):
+    """Checks whether a response body is small enough to hedge.
+
+    Args:
+      operation: The string operation name.
+      size: The expected number of bytes in the body, or None if unknown.
+
+    Returns:
+      True if size is at most max_hedge_bytes, or if size is unknown and
+      each of at least min_samples recent bodies was.
+    """
+    if size is not None:
+      return size <= self.max_hedge_bytes
+    with self._lock:
+      sizes = self._sizes.get(operation)
+      return bool(sizes and len(sizes) >= self.min_samples and
+                  max(sizes) <= self.max_hedge_bytes)
+
+  def get_delay(self, operation):
+    """Gets the current hedge delay of an operation.
+
+    Args:
+      operation: The string operation name.
+
+    Returns:
+      The delay in seconds after which a hedge is sent, or None while too
+      few latencies have been recorded.
+    """
+    with self._lock:
+      return self._delays.get(operation)
+
+  def get_stats(self):
+    """Gets the hedging counters.
+
+    Returns:
+      A dictionary with the calls, hedges, hedge_wins, hedge_cancels and
+      budget_exhausted counters and the tokens left in the budget.
+    """
+    with self._lock:
+      stats = dict(self._stats)
+      stats['budget_tokens'] = self._tokens
+    return stats
+
+  def _spend_token(self):
+    """Takes a token from the budget for a hedge.
+
+    Returns:
+      True if a hedge may be sent.
+    """
+    with self._lock:
+      if self._tokens < 1:
+        self._stats['budget_exhausted'] += 1
+        return False
+      self._tokens -= 1
+      self._stats['hedges'] += 1
+      return True
+
+  def _start(self, operation, func, results, cancellations, hedged):
+    """Runs func on a daemon thread.
+
+    Args:
+      operation: The string operation name.
+      func: A callable taking a Cancellation.
+      results: The Queue.Queue that receives a (hedged, result, error)
+          tuple.
+      cancellations: The Cancellation of the first call and of the hedge.
+      hedged: True if this call is the hedge.
+    """
+    def run():
+      start = time.time()
+      try:
+        result = func(cancellations[hedged])
+      except Exception, e:
+        results.put((hedged, None, e))
+        return
+      self.record_latency(operation, time.time() - start)
+      results.put((hedged, result, None))
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
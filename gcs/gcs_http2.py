@@ -0,0 +1,738 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""HTTP/2 transport that multiplexes requests over a few connections.
+
+Http2Transport sends each request as a stream on one of a small number of
+HTTP/2 connections instead of holding a socket per request. Bucket host names
+such as bucket.storage.googleapis.com are rewritten to path-style requests on
+one host, so requests for every bucket share the same connections.
+
+Each connection has a reader thread that feeds received frames to the h2
+protocol state machine and wakes the streams they belong to. Callers send
+their own request bodies, within the flow-control windows granted by the
+server. Response bodies are acknowledged as they arrive, so the receive
+windows only bound how far the server can run ahead. Bytes are written to
+the socket outside the lock that guards the state machine, and in pieces
+between which the reader thread may receive, so a slow send does not hold
+up responses. A TLS socket must not be used by two threads at once, so
+every socket call is made under one socket lock.
+
+The h2 package is required. Connections use TLS with ALPN by default; a
+plaintext connection with prior knowledge (h2c) can be used to test against
+a local server.
+
+Example:
+  transport = credentials.authorize(gcs_http2.Http2Transport())
+  gcs_client = gcs_xml.GcsXml(None, project_id, transport=transport)
+"""
+
+import collections
+import httplib
+import select
+import socket
+import ssl
+import threading
+import time
+import urlparse
+
+try:
+  import h2.config
+  import h2.connection
+  import h2.errors
+  import h2.events
+  import h2.exceptions
+  import h2.settings
+except ImportError:
+  h2 = None
+
+import httplib2
+
+import gcs_transport
+
+GCS_HOST = 'storage.googleapis.com'
+DEFAULT_MAX_CONNECTIONS = 4
+DEFAULT_MAX_STREAMS = 100
+DEFAULT_STREAM_WINDOW_SIZE = 1024 * 1024
+DEFAULT_CONNECTION_WINDOW_SIZE = 16 * 1024 * 1024
+DEFAULT_TIMEOUT_SEC = 60
+# The initial connection and stream window defined by RFC 7540.
+INITIAL_WINDOW_SIZE = 65535
+READ_SIZE = 64 * 1024
+# The most bytes written to the socket at a time, so that the reader thread
+# is not kept from the socket while a large body is sent.
+WRITE_SIZE = 16 * 1024
+POLL_INTERVAL_SEC = 1
+# Headers that are specific to HTTP/1.1 connections and not sent on streams.
+CONNECTION_HEADERS = ('connection', 'host', 'keep-alive', 'proxy-connection',
+                      'transfer-encoding', 'upgrade')
+
+
+class Http2Transport(gcs_transport.Transport):
+  """Thread-safe transport multiplexing requests as HTTP/2 streams.
+
+  A request is sent on the open connection with the fewest streams in
+  flight that is below its stream cap. A new connection is opened only when
+  every connection is full, up to max_connections; beyond that, callers wait
+  for a stream to finish.
+
+  Attributes:
+    host: The string host name connections are made to.
+    port: The integer port connections are made to.
+    secure: True if connections use TLS, False for plaintext h2c.
+    max_connections: The maximum number of open connections.
+    max_streams: The maximum number of streams in flight per connection. The
+        server's SETTINGS_MAX_CONCURRENT_STREAMS lowers it further.
+    stream_window_size: The receive window of each stream, in bytes.
+    connection_window_size: The receive window of each connection, in bytes.
+    timeout_sec: Seconds a request may go without hearing from the server
+        before it fails.
+  """
+
+  cancels_requests = True
+
+  def __init__(self, host=GCS_HOST, port=None, secure=True,
+               max_connections=DEFAULT_MAX_CONNECTIONS,
+               max_streams=DEFAULT_MAX_STREAMS,
+               stream_window_size=DEFAULT_STREAM_WINDOW_SIZE,
+               connection_window_size=DEFAULT_CONNECTION_WINDOW_SIZE,
+               timeout_sec=DEFAULT_TIMEOUT_SEC, ssl_context=None):
+    """Inits Http2Transport with an endpoint and multiplexing limits.
+
+    Args:
+      host: The string host name to connect to, such as localhost to test
+          against a local server.
+      port: The integer port. Defaults to 443 with TLS and 80 without.
+      secure: If True, use TLS and negotiate h2 with ALPN. If False, speak
+          h2c with prior knowledge.
+      max_connections: The maximum number of open connections.
+      max_streams: The maximum number of streams in flight per connection.
+      stream_window_size: The receive window advertised for each stream, in
+          bytes. Larger windows let a single download use more bandwidth.
+      connection_window_size: The receive window of each connection, in
+          bytes, shared by its streams.
+      timeout_sec: Seconds a request may go without hearing from the server
+          before it fails. Each frame received for the request restarts it.
+      ssl_context: An optional ssl.SSLContext for TLS connections.
+
+    Raises:
+      ImportError if the h2 package is not installed.
+    """
+    if not h2:
+      raise ImportError('Http2Transport requires the h2 package.')
+    if not port: port = 443 if secure else 80
+    self.host = host
+    self.port = port
+    self.secure = secure
+    self.max_connections = max_connections
+    self.max_streams = max_streams
+    self.stream_window_size = stream_window_size
+    self.connection_window_size = connection_window_size
+    self.timeout_sec = timeout_sec
+    self._ssl_context = ssl_context
+    self._connections = []
+    self._lock = threading.Lock()
+    self._stream_released = threading.Condition(self._lock)
+    self._stats = {'requests': 0, 'connections_opened': 0,
+                   'connection_failures': 0, 'stream_waits': 0}
+
+  def request(self, uri, method='GET', headers=None, body=None,
+              cancellation=None):
+    """Sends an HTTP request as a stream on a pooled connection.
+
+    Args:
+      uri: The full request URI.
+      method: The HTTP request method.
+      headers: A dictionary of request headers.
+      body: The request body, a string or a file-like object.
+      cancellation: An optional gcs_hedge.Cancellation. Cancelling it
+          resets the stream.
+
+    Returns:
+      The httplib2.Response and string content.
+
+    Raises:
+      IOError if the connection failed, the server did not answer in time
+      or the request was cancelled.
+    """
+    path = self._get_path(uri)
+    connection = self._acquire()
+    try:
+      status, response_headers, content = connection.request(
+          method, path, headers or {}, body, cancellation)
+    finally:
+      self._release(connection)
+    info = {'status': str(status),
+            'reason': httplib.responses.get(status, '')}
+    for name, value in response_headers:
+      if name.startswith(':'):
+        continue
+      if name in info:
+        value = '%s, %s' % (info[name], value)
+      info[name] = value
+    return httplib2.Response(info), content
+
+  def get_stats(self):
+    """Gets counters describing the connections.
+
+    Returns:
+      A dictionary with the requests, connections_opened,
+      connection_failures and stream_waits counters and the open
+      connections and active_streams gauges.
+    """
+    with self._lock:
+      stats = dict(self._stats)
+      stats['connections'] = len(self._connections)
+      stats['active_streams'] = sum(connection.active
+                                    for connection in self._connections)
+    return stats
+
+  def close(self):
+    """Closes every connection."""
+    with self._lock:
+      connections = self._connections
+      self._connections = []
+    for connection in connections:
+      connection.close()
+
+  def _get_path(self, uri):
+    """Converts a request URI into the path sent to host.
+
+    Args:
+      uri: The full request URI. Bucket host names are moved into the path.
+
+    Returns:
+      The string request path, including the query.
+    """
+    parsed = urlparse.urlsplit(uri)
+    path = parsed.path or '/'
+    hostname = parsed.hostname or ''
+    if hostname.endswith('.' + GCS_HOST):
+      path = '/%s%s' % (hostname[:-len(GCS_HOST) - 1], path)
+    if parsed.query:
+      path += '?' + parsed.query
+    return path
+
+  def _acquire(self):
+    """Reserves a stream on the least busy connection, opening one if needed.
+
+    Returns:
+      The _Connection to send the request on.
+
+    Raises:
+      IOError if a new connection could not be opened.
+    """
+    with self._lock:
+      self._stats['requests'] += 1
+      waited = False
+      while True:
+        self._connections = [connection for connection in self._connections
+                             if connection.is_usable()]
+        available = [connection for connection in self._connections
+                     if connection.active <
+                     connection.get_max_streams(self.max_streams)]
+        if available:
+          connection = min(available,
+                           key=lambda connection: connection.active)
+          break
+        if len(self._connections) < self.max_connections:
+          connection = self._connect()
+          self._connections.append(connection)
+          break
+        if not waited:
+          self._stats['stream_waits'] += 1
+          waited = True
+        self._stream_released.wait(POLL_INTERVAL_SEC)
+      connection.active += 1
+      return connection
+
+  def _release(self, connection):
+    """Frees a stream reserved by _acquire.
+
+    Args:
+      connection: The _Connection the request was sent on.
+    """
+    with self._lock:
+      connection.active -= 1
+      self._stream_released.notify()
+
+  def _connect(self):
+    """Opens a connection. The caller holds the lock.
+
+    Returns:
+      A new _Connection.
+
+    Raises:
+      IOError if the connection could not be opened.
+    """
+    try:
+      connection = _Connection(
+          self.host, self.port, self.secure, self._ssl_context,
+          self.stream_window_size, self.connection_window_size,
+          self.timeout_sec)
+    except (socket.error, h2.exceptions.H2Error), e:
+      self._stats['connection_failures'] += 1
+      raise IOError('Could not open an HTTP/2 connection to %s:%d: %s' % (
+          self.host, self.port, e))
+    self._stats['connections_opened'] += 1
+    return connection
+
+
+class _Stream(object):
+  """The response state of one request.
+
+  Attributes:
+    headers: The list of (name, value) response header tuples.
+    data: The list of received string body chunks.
+    ended: True once the response is complete.
+    error: The IOError that ended the stream, or None.
+    last_received: The time a frame for the stream last arrived.
+    changed: The threading.Condition, on the connection lock, notified when
+        the stream state or its send window changes.
+  """
+
+  def __init__(self, lock):
+    """Inits an empty _Stream.
+
+    Args:
+      lock: The threading.Lock of the connection.
+    """
+    self.headers = None
+    self.data = []
+    self.ended = False
+    self.error = None
+    self.last_received = time.time()
+    self.changed = threading.Condition(lock)
+
+
+class _Connection(object):
+  """One HTTP/2 connection and the streams in flight on it.
+
+  The h2 state machine is used under the connection lock, which queues the
+  bytes it produces. The queued bytes are written to the socket in order
+  under a separate write lock, once the connection lock is released. Each
+  recv and send on the socket holds the socket lock, which is never held
+  while waiting for the connection lock.
+
+  Attributes:
+    active: The number of streams reserved by the transport. Guarded by the
+        transport lock.
+  """
+
+  def __init__(self, host, port, secure, ssl_context, stream_window_size,
+               connection_window_size, timeout_sec):
+    """Connects, sends the connection preface and starts the reader thread.
+
+    Args:
+      host: The string host name.
+      port: The integer port.
+      secure: If True, use TLS and negotiate h2 with ALPN.
+      ssl_context: An optional ssl.SSLContext.
+      stream_window_size: The receive window of each stream, in bytes.
+      connection_window_size: The receive window of the connection, in bytes.
+      timeout_sec: Seconds a request may go without hearing from the
+          server.
+
+    Raises:
+      socket.error if the connection failed or h2 was not negotiated.
+    """
+    self.active = 0
+    self._host = host
+    self._secure = secure
+    self._timeout_sec = timeout_sec
+    self._streams = {}
+    self._accepting = True
+    self._closed = False
+    self._lock = threading.Lock()
+    self._write_lock = threading.Lock()
+    self._sock_lock = threading.Lock()
+    self._outbound = collections.deque()
+
+    sock = socket.create_connection((host, port), timeout_sec)
+    if secure:
+      if not ssl_context:
+        ssl_context = ssl.create_default_context()
+      ssl_context.set_alpn_protocols(['h2'])
+      sock = ssl_context.wrap_socket(sock, server_hostname=host)
+      if sock.selected_alpn_protocol() != 'h2':
+        sock.close()
+        raise socket.error('%s did not negotiate h2.' % host)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    self._sock = sock
+
+    self._h2 = h2.connection.H2Connection(config=h2.config.H2Configuration(
+        client_side=True, header_encoding=None))
+    self._h2.initiate_connection()
+    self._h2.update_settings({
+        h2.settings.SettingCodes.ENABLE_PUSH: 0,
+        h2.settings.SettingCodes.INITIAL_WINDOW_SIZE: stream_window_size,
+    })
+    if connection_window_size > INITIAL_WINDOW_SIZE:
+      self._h2.increment_flow_control_window(
+          connection_window_size - INITIAL_WINDOW_SIZE)
+    self._sock.sendall(self._h2.data_to_send())
+
+    reader = threading.Thread(target=self._read_loop)
+    reader.daemon = True
+    reader.start()
+
+  def is_usable(self):
+    """Checks whether new streams may be opened on the connection.
+
+    Returns:
+      False once the connection failed or the server sent GOAWAY.
+    """
+    return self._accepting and not self._closed
+
+  def get_max_streams(self, max_streams):
+    """Gets the number of streams the connection may carry at once.
+
+    Args:
+      max_streams: The cap configured on the transport.
+
+    Returns:
+      The smaller of max_streams and the server's concurrent stream limit.
+    """
+    return min(max_streams, self._h2.remote_settings.max_concurrent_streams)
+
+  def request(self, method, path, headers, body, cancellation=None):
+    """Sends a request on a new stream and waits for the whole response.
+
+    Args:
+      method: The HTTP request method.
+      path: The string request path, including the query.
+      headers: A dictionary of request headers.
+      body: The request body, a string, a file-like object, or None.
+      cancellation: An optional gcs_hedge.Cancellation that resets the
+          stream when cancelled.
+
+    Returns:
+      A (status, headers, content) tuple with the integer status, the list
+      of (name, value) response headers and the string body.
+
+    Raises:
+      IOError if the connection failed, the stream was reset or cancelled,
+      or the server sent nothing for the stream within the timeout.
+    """
+    request_headers = [
+        (':method', method),
+        (':scheme', 'https' if self._secure else 'http'),
+        (':authority', self._host),
+        (':path', path),
+    ]
+    for name, value in headers.iteritems():
+      name = name.lower()
+      if name not in CONNECTION_HEADERS:
+        request_headers.append((name, str(value)))
+
+    has_body = body is not None and body != ''
+    with self._lock:
+      self._check_open()
+      # Stream ids must be opened in increasing order, so the id is taken
+      # and its headers are queued without releasing the lock.
+      stream_id = self._h2.get_next_available_stream_id()
+      stream = _Stream(self._lock)
+      self._streams[stream_id] = stream
+      try:
+        self._h2.send_headers(stream_id, request_headers,
+                              end_stream=not has_body)
+        self._flush()
+      except h2.exceptions.H2Error, e:
+        del self._streams[stream_id]
+        raise IOError('Could not start an HTTP/2 stream: %s' % e)
+    if cancellation:
+      cancellation.add_callback(lambda: self._cancel(stream_id, stream))
+    try:
+      self._send_queued()
+      if has_body:
+        self._send_body(stream_id, stream, body)
+      with self._lock:
+        # The timeout restarts with every frame received for the stream, so
+        # a long download fails only if it stalls.
+        stream.last_received = time.time()
+        while not stream.ended and not stream.error:
+          remaining = stream.last_received + self._timeout_sec - time.time()
+          if remaining <= 0:
+            self._reset(stream_id)
+            raise IOError('Timed out waiting for an HTTP/2 response.')
+          stream.changed.wait(remaining)
+        if stream.error:
+          raise stream.error
+    finally:
+      with self._lock:
+        self._streams.pop(stream_id, None)
+      # Sends a reset queued for a stream that timed out.
+      self._send_queued_quietly()
+    status = 0
+    for name, value in stream.headers or []:
+      if name == ':status':
+        status = int(value)
+    return status, stream.headers or [], ''.join(stream.data)
+
+  def close(self):
+    """Closes the connection and fails its streams."""
+    with self._lock:
+      if self._closed:
+        return
+      try:
+        self._h2.close_connection()
+        self._flush()
+      except h2.exceptions.H2Error:
+        pass
+      self._fail(IOError('The HTTP/2 connection was closed.'))
+    self._send_queued_quietly()
+
+  def _send_body(self, stream_id, stream, body):
+    """Sends a request body within the stream and connection send windows.
+
+    Every frame is sent before the next window wait, so the server sees the
+    data it must acknowledge.
+
+    Args:
+      stream_id: The integer stream id.
+      stream: The _Stream of the request.
+      body: The request body, a string or a file-like object.
+
+    Raises:
+      IOError if the connection failed or the window stayed closed for the
+      whole timeout.
+    """
+    offset = 0
+    chunk = ''
+    while True:
+      if not chunk:
+        if hasattr(body, 'read'):
+          chunk = body.read(READ_SIZE)
+        else:
+          chunk = body[offset:offset + READ_SIZE]
+          offset += len(chunk)
+        if not chunk:
+          with self._lock:
+            self._h2.end_stream(stream_id)
+            self._flush()
+          self._send_queued()
+          return
+      with self._lock:
+        window = self._wait_for_window(stream_id, stream)
+        if not window:
+          # The server answered before reading the whole body.
+          return
+        size = min(len(chunk), window, self._h2.max_outbound_frame_size)
+        try:
+          self._h2.send_data(stream_id, chunk[:size])
+          self._flush()
+        except h2.exceptions.H2Error, e:
+          raise IOError('Could not send on an HTTP/2 stream: %s' % e)
+      chunk = chunk[size:]
+      self._send_queued()
+
+  def _wait_for_window(self, stream_id, stream):
+    """Waits until the stream may send. The caller holds the lock.
+
+    Args:
+      stream_id: The integer stream id.
+      stream: The _Stream of the request.
+
+    Returns:
+      The number of bytes the stream may send, or 0 if its response has
+      already ended.
+
+    Raises:
+      IOError if the stream failed or the window stayed closed for the whole
+      timeout.
+    """
+    deadline = time.time() + self._timeout_sec
+    while True:
+      if stream.error:
+        raise stream.error
+      if stream.ended:
+        return 0
+      window = self._h2.local_flow_control_window(stream_id)
+      if window > 0:
+        return window
+      remaining = deadline - time.time()
+      if remaining <= 0:
+        self._reset(stream_id)
+        raise IOError('Timed out waiting for the HTTP/2 send window.')
+      stream.changed.wait(remaining)
+
+  def _read_loop(self):
+    """Reads frames until the connection closes. Runs on its own thread."""
+    try:
+      self._read_frames()
+    except (socket.error, select.error, h2.exceptions.H2Error), e:
+      with self._lock:
+        self._fail(IOError('The HTTP/2 connection failed: %s' % e))
+    with self._sock_lock:
+      self._sock.close()
+
+  def _read_frames(self):
+    """Feeds received data to the h2 state machine until it is closed."""
+    while not self._closed:
+      with self._sock_lock:
+        pending = self._secure and self._sock.pending()
+      if not pending:
+        readable, _, _ = select.select([self._sock], [], [],
+                                       POLL_INTERVAL_SEC)
+        if not readable:
+          continue
+      with self._sock_lock:
+        data = self._sock.recv(READ_SIZE)
+      with self._lock:
+        if self._closed:
+          return
+        if not data:
+          self._fail(IOError('The server closed the HTTP/2 connection.'))
+          return
+        for event in self._h2.receive_data(data):
+          self._handle_event(event)
+        self._flush()
+      self._send_queued()
+
+  def _handle_event(self, event):
+    """Applies a received h2 event to its stream. The caller holds the lock.
+
+    Args:
+      event: An h2.events.Event.
+    """
+    stream = self._streams.get(getattr(event, 'stream_id', None))
+    if stream: stream.last_received = time.time()
+    if isinstance(event, h2.events.ResponseReceived):
+      if stream: stream.headers = event.headers
+    elif isinstance(event, h2.events.DataReceived):
+      self._h2.acknowledge_received_data(event.flow_controlled_length,
+                                         event.stream_id)
+      if stream: stream.data.append(event.data)
+    elif isinstance(event, h2.events.StreamEnded):
+      if stream:
+        stream.ended = True
+        stream.changed.notify_all()
+    elif isinstance(event, h2.events.StreamReset):
+      if stream:
+        stream.error = IOError('HTTP/2 stream reset with error %s.' %
+                               event.error_code)
+        stream.changed.notify_all()
+    elif isinstance(event, h2.events.WindowUpdated):
+      if event.stream_id:
+        if stream: stream.changed.notify_all()
+      else:
+        for stream in self._streams.itervalues():
+          stream.changed.notify_all()
+    elif isinstance(event, h2.events.ConnectionTerminated):
+      self._accepting = False
+      for stream_id, stream in self._streams.items():
+        if event.last_stream_id is None or stream_id > event.last_stream_id:
+          stream.error = IOError('The server refused the HTTP/2 stream.')
+          stream.changed.notify_all()
+
+  def _check_open(self):
+    """Fails if the connection is closed. The caller holds the lock.
+
+    Raises:
+      IOError if the connection is closed.
+    """
+    if self._closed:
+      raise IOError('The HTTP/2 connection is closed.')
+
+  def _cancel(self, stream_id, stream):
+    """Resets a stream whose request was cancelled and fails the request.
+
+    Args:
+      stream_id: The integer stream id.
+      stream: The _Stream of the request.
+
+    Returns:
+      True if the request was still in flight and has been reset.
+    """
+    with self._lock:
+      if self._streams.get(stream_id) is not stream or stream.ended:
+        return False
+      self._reset(stream_id)
+      stream.error = IOError('The HTTP/2 request was cancelled.')
+      stream.changed.notify_all()
+    self._send_queued_quietly()
+    return True
+
+  def _reset(self, stream_id):
+    """Cancels a stream. The caller holds the lock and sends the queued reset.
+
+    Args:
+      stream_id: The integer stream id.
+    """
+    try:
+      self._h2.reset_stream(stream_id, h2.errors.ErrorCodes.CANCEL)
+      self._flush()
+    except h2.exceptions.H2Error:
+      pass
+
+  def _flush(self):
+    """Queues the bytes produced by the h2 state machine for _send_queued.
+
+    The caller holds the lock.
+    """
+    data = self._h2.data_to_send()
+    if data:
+      self._outbound.append(data)
+
+  def _send_queued(self):
+    """Writes the queued bytes to the socket in order.
+
+    If another thread is writing, it sends the bytes instead, so the reader
+    thread never waits behind a large request body. The bytes go out in
+    pieces of at most WRITE_SIZE, each under the socket lock and only once
+    the socket is writable, so the reader thread can receive in between.
+    The writer checks the queue again after releasing the write lock to
+    pick up bytes queued as it finished.
+
+    The caller must not hold the connection lock.
+
+    Raises:
+      socket.error if the write failed.
+    """
+    while self._outbound:
+      if not self._write_lock.acquire(False):
+        return
+      try:
+        while self._outbound:
+          data = self._outbound.popleft()
+          for offset in xrange(0, len(data), WRITE_SIZE):
+            try:
+              select.select([], [self._sock], [], self._timeout_sec)
+            except select.error, e:
+              raise socket.error(*e.args)
+            with self._sock_lock:
+              self._sock.sendall(data[offset:offset + WRITE_SIZE])
+      finally:
+        self._write_lock.release()
+
+  def _send_queued_quietly(self):
+    """Writes the queued bytes, ignoring a failed connection."""
+    try:
+      self._send_queued()
+    except socket.error:
+      pass
+
+  def _fail(self, error):
+    """Marks the connection closed and fails every stream on it.
+
+    The caller holds the lock.
+
+    Args:
+      error: The IOError given to the streams.
+    """
+    self._closed = True
+    for stream in self._streams.itervalues():
+      if not stream.ended:
+        stream.error = error
+      stream.changed.notify_all()
@@ -0,0 +1,278 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Request metrics for Cloud Storage clients.
+
+Latencies are counted into fixed histogram buckets, so recording a request
+costs a lock, a binary search and a few integer additions, and memory does
+not grow with the number of requests.
+"""
+
+import bisect
+import threading
+
+DEFAULT_BUCKETS_SEC = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5,
+                       10, 30, 60)
+# The status recorded for requests that failed without an HTTP response.
+NO_RESPONSE = 'error'
+PROMETHEUS_PREFIX = 'gcs'
+
+
+class Histogram(object):
+  """A cumulative latency histogram with fixed bucket bounds.
+
+  Attributes:
+    bounds: The sorted upper bounds of the buckets, in seconds.
+    counts: The number of observations in each bucket, with a final bucket
+        for observations above the last bound.
+    total: The sum of all observations.
+    count: The number of observations.
+  """
+
+  def __init__(self, bounds=DEFAULT_BUCKETS_SEC):
+    """Inits Histogram with bucket bounds.
+
+    Args:
+      bounds: The sorted upper bounds of the buckets, in seconds.
+    """
+    self.bounds = bounds
+    self.counts = [0] * (len(bounds) + 1)
+    self.total = 0.0
+    self.count = 0
+
+  def observe(self, value):
+    """Records an observation.
+
+    Args:
+      value: The observed latency in seconds.
+    """
+    self.counts[bisect.bisect_left(self.bounds, value)] += 1
+    self.total += value
+    self.count += 1
+
+  def get_quantile(self, quantile):
+    """Estimates a quantile from the buckets.
+
+    Args:
+      quantile: The quantile, between 0 and 1.
+
+    Returns:
+      The upper bound of the bucket holding the quantile, or None if there
+      are no observations. Observations above the last bound are reported
+      as the last bound.
+    """
+    if not self.count:
+      return None
+    rank = quantile * self.count
+    seen = 0
+    for bound, count in zip(self.bounds, self.counts):
+      seen += count
+      if seen >= rank:
+        return bound
+    return self.bounds[-1]
+
+
+class Metrics(object):
+  """Thread-safe request counters and latency histograms per operation.
+
+  Operations are short names such as get_object or insert_object. A
+  gcs_concurrency.ConcurrencyLimiter can also report its limit here.
+  """
+
+  def __init__(self, bounds=DEFAULT_BUCKETS_SEC):
+    """Inits Metrics with empty counters.
+
+    Args:
+      bounds: The latency histogram bucket bounds, in seconds.
+    """
+    self._bounds = bounds
+    self._lock = threading.Lock()
+    self._operations = {}
+    self._concurrency_limit = None
+    self._limit_adjustments = {}
+
+  def record_request(self, operation, status, latency_sec, request_bytes=0,
+                     response_bytes=0):
+    """Records one HTTP exchange.
+
+    Args:
+      operation: The string operation name.
+      status: The integer HTTP status, or NO_RESPONSE.
+      latency_sec: The time from sending the request to reading the
+          response.
+      request_bytes: The size of the request body.
+      response_bytes: The size of the response body.
+    """
+    with self._lock:
+      stats = self._get_operation(operation)
+      stats['latency'].observe(latency_sec)
+      stats['statuses'][status] = stats['statuses'].get(status, 0) + 1
+      stats['request_bytes'] += request_bytes
+      stats['response_bytes'] += response_bytes
+
+  def record_retry(self, operation):
+    """Records that a request is about to be retried.
+
+    Args:
+      operation: The string operation name.
+    """
+    with self._lock:
+      self._get_operation(operation)['retries'] += 1
+
+  def record_concurrency_limit(self, limit, reason=None):
+    """Records the current concurrency limit.
+
+    Args:
+      limit: The integer number of requests that may be in flight.
+      reason: The reason the limit was adjusted, or None for the initial
+          limit.
+    """
+    with self._lock:
+      self._concurrency_limit = limit
+      if reason:
+        self._limit_adjustments[reason] = (
+            self._limit_adjustments.get(reason, 0) + 1)
+
+  def get_totals(self):
+    """Sums the counters over every operation.
+
+    Returns:
+      A dictionary with the requests, retries, request_bytes and
+      response_bytes totals.
+    """
+    totals = {'requests': 0, 'retries': 0, 'request_bytes': 0,
+              'response_bytes': 0}
+    with self._lock:
+      for stats in self._operations.itervalues():
+        totals['requests'] += stats['latency'].count
+        totals['retries'] += stats['retries']
+        totals['request_bytes'] += stats['request_bytes']
+        totals['response_bytes'] += stats['response_bytes']
+    return totals
+
+  def get_snapshot(self):
+    """Copies the metrics into plain data that can be dumped as JSON.
+
+    Returns:
+      A dictionary mapping each operation to its requests, retries,
+      request_bytes, response_bytes and statuses counters and a latency
+      dictionary with the count, sum, p50, p90 and p99 estimates and the
+      bucket counts keyed by upper bound. Once a concurrency limit is
+      recorded, a concurrency entry holds the limit and the number of
+      adjustments by reason.
+    """
+    snapshot = {}
+    with self._lock:
+      for operation, stats in self._operations.iteritems():
+        latency = stats['latency']
+        buckets = dict(('%g' % bound, count) for bound, count in
+                       zip(latency.bounds, latency.counts))
+        buckets['+Inf'] = latency.counts[-1]
+        snapshot[operation] = {
+            'requests': latency.count,
+            'retries': stats['retries'],
+            'request_bytes': stats['request_bytes'],
+            'response_bytes': stats['response_bytes'],
+            'statuses': dict((str(status), count) for status, count in
+                             stats['statuses'].iteritems()),
+            'latency_sec': {
+                'count': latency.count,
+                'sum': latency.total,
+                'p50': latency.get_quantile(0.5),
+                'p90': latency.get_quantile(0.9),
+                'p99': latency.get_quantile(0.99),
+                'buckets': buckets,
+            },
+        }
+      if self._concurrency_limit is not None:
+        snapshot['concurrency'] = {
+            'limit': self._concurrency_limit,
+            'adjustments': dict(self._limit_adjustments),
+        }
+    return snapshot
+
+  def to_prometheus(self):
+    """Formats the metrics in the Prometheus text exposition format.
+
+    Returns:
+      The string exposition.
+    """
+    prefix = PROMETHEUS_PREFIX
+    lines = [
+        '# HELP %s_request_duration_seconds Cloud Storage request latency.'
+        % prefix,
+        '# TYPE %s_request_duration_seconds histogram' % prefix,
+    ]
+    counters = []
+    with self._lock:
+      for operation in sorted(self._operations):
+        stats = self._operations[operation]
+        latency = stats['latency']
+        labels = 'operation="%s"' % operation
+        cumulative = 0
+        for bound, count in zip(latency.bounds, latency.counts):
+          cumulative += count
+          lines.append('%s_request_duration_seconds_bucket{%s,le="%g"} %d'
+                       % (prefix, labels, bound, cumulative))
+        lines.append('%s_request_duration_seconds_bucket{%s,le="+Inf"} %d'
+                     % (prefix, labels, latency.count))
+        lines.append('%s_request_duration_seconds_sum{%s} %f'
+                     % (prefix, labels, latency.total))
+        lines.append('%s_request_duration_seconds_count{%s} %d'
+                     % (prefix, labels, latency.count))
+        for status in sorted(stats['statuses']):
+          counters.append(('requests_total', '%s,status="%s"' % (
+              labels, status), stats['statuses'][status]))
+        counters.append(('retries_total', labels, stats['retries']))
+        counters.append(('request_bytes_total', labels,
+                         stats['request_bytes']))
+        counters.append(('response_bytes_total', labels,
+                         stats['response_bytes']))
+      concurrency_limit = self._concurrency_limit
+      for reason in sorted(self._limit_adjustments):
+        counters.append(('concurrency_adjustments_total',
+                         'reason="%s"' % reason,
+                         self._limit_adjustments[reason]))
+    for name in ('requests_total', 'retries_total', 'request_bytes_total',
+                 'response_bytes_total', 'concurrency_adjustments_total'):
+      lines.append('# TYPE %s_%s counter' % (prefix, name))
+      for counter_name, labels, value in counters:
+        if counter_name == name:
+          lines.append('%s_%s{%s} %d' % (prefix, name, labels, value))
+    if concurrency_limit is not None:
+      lines.append('# TYPE %s_concurrency_limit gauge' % prefix)
+      lines.append('%s_concurrency_limit %d' % (prefix, concurrency_limit))
+    return '\n'.join(lines) + '\n'
+
+  def _get_operation(self, operation):
+    """Gets the counters of an operation, creating them if needed.
+
+    The caller holds the lock.
+
+    Args:
+      operation: The string operation name.
+
+    Returns:
+      The dictionary of counters for the operation.
+    """
+    stats = self._operations.get(operation)
+    if stats is None:
+      stats = self._operations[operation] = {
+          'latency': Histogram(self._bounds),
+          'statuses': {},
+          'retries': 0,
+          'request_bytes': 0,
+          'response_bytes': 0,
+      }
+    return stats
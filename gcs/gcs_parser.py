@@ -0,0 +1,231 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Incremental parsers for Google Cloud Storage XML API responses.
+
+Responses are parsed with xml.etree.ElementTree.iterparse. Each record is
+converted to a gcs_types record as soon as its closing tag is read and is
+then detached from the tree, so no full DOM is ever built.
+"""
+
+import cStringIO
+import xml.etree.ElementTree as xml
+
+import gcs_types
+
+
+class ObjectListing(object):
+  """Parses one page of a ListBucketResult.
+
+  Iterating yields the entries. Once iteration has finished, is_truncated
+  and next_marker describe the following page.
+
+  Attributes:
+    is_truncated: True if more entries follow this page.
+    next_marker: The string marker for the next page, or None.
+    last_name: The name of the last entry on the page, or None.
+  """
+
+  def __init__(self, source):
+    """Inits ObjectListing with the response body.
+
+    Args:
+      source: The string XML response, or a file-like object to read it from.
+    """
+    self._source = source
+    self.is_truncated = False
+    self.next_marker = None
+    self.last_name = None
+
+  def __iter__(self):
+    """Parses the page.
+
+    Yields:
+      gcs_types.ObjectEntry instances in listing order. Common prefixes have
+      is_prefix set.
+    """
+    for name, elem, depth in _iter_records(
+        self._source, ('Contents', 'CommonPrefixes', 'IsTruncated',
+                       'NextMarker')):
+      if depth != 1:
+        continue
+      if name == 'Contents':
+        size = _child_text(elem, 'Size')
+        etag = _child_text(elem, 'ETag')
+        entry = gcs_types.ObjectEntry(
+            _child_text(elem, 'Key'),
+            size=int(size) if size else None,
+            etag=etag.strip('"') if etag else None,
+            last_modified=_child_text(elem, 'LastModified'))
+      elif name == 'CommonPrefixes':
+        entry = gcs_types.ObjectEntry(
+            _child_text(elem, 'Prefix'), is_prefix=True)
+      elif name == 'IsTruncated':
+        self.is_truncated = elem.text == 'true'
+        continue
+      else:
+        self.next_marker = elem.text
+        continue
+      self.last_name = max(self.last_name, entry.name)
+      yield entry
+
+
+def iter_buckets(source):
+  """Parses a ListAllMyBucketsResult.
+
+  Args:
+    source: The string XML response, or a file-like object to read it from.
+
+  Yields:
+    gcs_types.BucketEntry instances.
+  """
+  for name, elem, depth in _iter_records(source, ('Bucket',)):
+    yield gcs_types.BucketEntry(
+        _child_text(elem, 'Name'), _child_text(elem, 'CreationDate'))
+
+
+def parse_acl(source):
+  """Parses an AccessControlList.
+
+  Args:
+    source: The string XML response, or a file-like object to read it from.
+
+  Returns:
+    A list of gcs_types.AclEntry instances.
+  """
+  entries = []
+  for name, elem, depth in _iter_records(source, ('Entry',)):
+    scope_elem = _child(elem, 'Scope')
+    scope_type = None
+    scope_id = None
+    scope_name = None
+    if scope_elem is not None:
+      scope_type = scope_elem.get('type')
+      scope_id = (_child_text(scope_elem, 'ID') or
+                  _child_text(scope_elem, 'EmailAddress') or
+                  _child_text(scope_elem, 'Domain'))
+      scope_name = _child_text(scope_elem, 'Name')
+    entries.append(gcs_types.AclEntry(
+        scope_type, _child_text(elem, 'Permission'), scope_id, scope_name))
+  return entries
+
+
+def parse_cors(source):
+  """Parses a CorsConfig.
+
+  Args:
+    source: The string XML response, or a file-like object to read it from.
+
+  Returns:
+    A list of gcs_types.CorsRule instances.
+  """
+  rules = []
+  for name, elem, depth in _iter_records(source, ('Cors',)):
+    max_age_sec = _child_text(elem, 'MaxAgeSec')
+    rules.append(gcs_types.CorsRule(
+        _children_text(_child(elem, 'Origins'), 'Origin'),
+        _children_text(_child(elem, 'Methods'), 'Method'),
+        _children_text(_child(elem, 'ResponseHeaders'), 'ResponseHeader'),
+        int(float(max_age_sec)) if max_age_sec else None))
+  return rules
+
+
+def _iter_records(source, record_names):
+  """Incrementally parses XML, yielding elements with the given names.
+
+  Each element is yielded once its closing tag has been read and is then
+  removed from its parent, so memory use is bounded by the largest record.
+
+  Args:
+    source: The string XML document, or a file-like object to read it from.
+    record_names: A tuple of local element names, without namespaces.
+
+  Yields:
+    (local_name, element, depth) tuples, where depth is 1 for children of
+    the root element.
+  """
+  if isinstance(source, basestring):
+    source = cStringIO.StringIO(source)
+  stack = []
+  for event, elem in xml.iterparse(source, events=('start', 'end')):
+    if event == 'start':
+      stack.append(elem)
+      continue
+    stack.pop()
+    name = _local_name(elem.tag)
+    if name in record_names:
+      yield name, elem, len(stack)
+      if stack:
+        stack[-1].remove(elem)
+
+
+def _local_name(tag):
+  """Strips the namespace from an ElementTree tag.
+
+  Args:
+    tag: A tag such as '{http://doc.s3.amazonaws.com/2006-03-01}Key'.
+
+  Returns:
+    The local name, such as 'Key'.
+  """
+  return tag.rsplit('}', 1)[-1]
+
+
+def _child(elem, name):
+  """Finds the first child of elem with the given local name.
+
+  Args:
+    elem: An ElementTree element, or None.
+    name: The local name of the child.
+
+  Returns:
+    The child element, or None.
+  """
+  if elem is None:
+    return None
+  for child in elem:
+    if _local_name(child.tag) == name:
+      return child
+  return None
+
+
+def _child_text(elem, name):
+  """Gets the text of the first child of elem with the given local name.
+
+  Args:
+    elem: An ElementTree element, or None.
+    name: The local name of the child.
+
+  Returns:
+    The string text of the child, or None.
+  """
+  child = _child(elem, name)
+  if child is None:
+    return None
+  return child.text
+
+
+def _children_text(elem, name):
+  """Gets the text of every child of elem with the given local name.
+
+  Args:
+    elem: An ElementTree element, or None.
+    name: The local name of the children.
+
+  Returns:
+    A list of string texts.
+  """
+  if elem is None:
+    return []
+  return [child.text for child in elem if _local_name(child.tag) == name]
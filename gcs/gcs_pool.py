@@ -0,0 +1,124 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Bounded thread pool for concurrent Cloud Storage requests."""
+
+import Queue
+import sys
+import threading
+
+DEFAULT_CONCURRENCY = 8
+
+# Queue.get without a timeout cannot be interrupted with Ctrl-C.
+_WAIT_TIMEOUT_SEC = 60 * 60 * 24
+
+_STOP = object()
+
+
+def imap_unordered(func, items, concurrency=DEFAULT_CONCURRENCY):
+  """Applies func to each item on a bounded pool of worker threads.
+
+  Items are pulled from the iterable only as workers become free, so at most
+  concurrency items are in flight and the iterable can be an unbounded
+  generator such as a bucket listing. Closing the generator early waits for
+  the calls already in flight.
+
+  Args:
+    func: A callable taking one item.
+    items: An iterable of items.
+    concurrency: The maximum number of calls to run at once.
+
+  Yields:
+    (item, result, error) tuples in completion order. error is the exception
+    raised by func, in which case result is None.
+  """
+  concurrency = max(1, concurrency)
+  tasks = Queue.Queue()
+  results = Queue.Queue()
+  workers = []
+  for _ in range(concurrency):
+    worker = threading.Thread(target=_work, args=(func, tasks, results))
+    worker.daemon = True
+    worker.start()
+    workers.append(worker)
+
+  items = iter(items)
+  pending = 0
+  exhausted = False
+  try:
+    while True:
+      while not exhausted and pending < concurrency:
+        try:
+          item = next(items)
+        except StopIteration:
+          exhausted = True
+          break
+        tasks.put(item)
+        pending += 1
+      if not pending:
+        break
+      result = results.get(True, _WAIT_TIMEOUT_SEC)
+      pending -= 1
+      yield result
+  finally:
+    for _ in workers:
+      tasks.put(_STOP)
+    for worker in workers:
+      worker.join()
+
+
+def run_all(func, items, concurrency=DEFAULT_CONCURRENCY):
+  """Applies func to every item on a bounded pool, stopping at the first error.
+
+  Args:
+    func: A callable taking one item.
+    items: An iterable of items.
+    concurrency: The maximum number of calls to run at once.
+
+  Raises:
+    The first exception raised by func, with its original traceback. No new
+    calls are started after it, and the calls already in flight finish
+    before it is raised.
+  """
+  def call(item):
+    try:
+      func(item)
+    except Exception:
+      return sys.exc_info()
+
+  calls = imap_unordered(call, items, concurrency)
+  try:
+    for item, exc_info, error in calls:
+      if exc_info:
+        raise exc_info[0], exc_info[1], exc_info[2]
+  finally:
+    calls.close()
+
+
+def _work(func, tasks, results):
+  """Runs tasks until told to stop.
+
+  Args:
+    func: A callable taking one item.
+    tasks: The Queue.Queue of items to process.
+    results: The Queue.Queue that receives (item, result, error) tuples.
+  """
+  while True:
+    item = tasks.get()
+    if item is _STOP:
+      return
+    try:
+      results.put((item, func(item), None))
+    except Exception, e:
+      results.put((item, None, e))
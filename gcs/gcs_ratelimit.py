@@ -0,0 +1,296 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Rate limits on object writes, per object and per bucket."""
+
+import threading
+import time
+
+import gcs_error
+
+# Cloud Storage accepts about one write per second to the same object name.
+DEFAULT_OBJECT_RATE = 1.0
+DEFAULT_OBJECT_BURST = 1
+# Buckets start at about 1000 writes per second and should ramp up by
+# doubling the rate no faster than every 20 minutes.
+DEFAULT_BUCKET_RATE = 1000.0
+DEFAULT_BUCKET_BURST = 1000
+DEFAULT_RAMP_INTERVAL_SEC = 20 * 60
+# Idle per-object and per-bucket state is dropped after this many writes.
+PRUNE_INTERVAL = 1000
+
+# Condition.wait without a timeout cannot be interrupted with Ctrl-C.
+_WAIT_TIMEOUT_SEC = 60 * 60 * 24
+
+
+class _TokenBucket(object):
+  """A token bucket refilled at a constant rate.
+
+  Attributes:
+    rate: The tokens added per second.
+    capacity: The most tokens the bucket holds.
+    tokens: The tokens in the bucket at the last update.
+    updated: The time of the last update.
+  """
+
+  def __init__(self, rate, capacity, now):
+    """Inits _TokenBucket full.
+
+    Args:
+      rate: The tokens added per second.
+      capacity: The most tokens the bucket holds.
+      now: The current time.
+    """
+    self.rate = rate
+    self.capacity = capacity
+    self.tokens = float(capacity)
+    self.updated = now
+
+  def get_wait(self, now):
+    """Refills the bucket and gets the time until it holds a token.
+
+    Args:
+      now: The current time.
+
+    Returns:
+      The number of seconds until a token is available, 0 if one is.
+    """
+    self.tokens = min(self.capacity,
+                      self.tokens + (now - self.updated) * self.rate)
+    self.updated = now
+    if self.tokens >= 1:
+      return 0
+    return (1 - self.tokens) / self.rate
+
+
+class _ObjectState(object):
+  """The writes of one object.
+
+  Attributes:
+    tokens: The _TokenBucket of the object.
+    pending: The marker of the newest write waiting to be sent, or None.
+    sending: True while a write of the object is being sent.
+  """
+
+  def __init__(self, rate, burst, now):
+    """Inits _ObjectState with a full token bucket.
+
+    Args:
+      rate: The writes per second allowed to the object.
+      burst: The writes the object may take at once.
+      now: The current time.
+    """
+    self.tokens = _TokenBucket(rate, burst, now)
+    self.pending = None
+    self.sending = False
+
+
+class _BucketState(object):
+  """The write rate of one bucket.
+
+  Attributes:
+    tokens: The _TokenBucket of the bucket.
+    ramp_start: The time the bucket last started taking writes after being
+        idle for a ramp interval.
+    last_write: The time of the last write to the bucket.
+  """
+
+  def __init__(self, rate, burst, now):
+    """Inits _BucketState with a full token bucket.
+
+    Args:
+      rate: The starting writes per second allowed to the bucket.
+      burst: The writes the bucket may take at once.
+      now: The current time.
+    """
+    self.tokens = _TokenBucket(rate, burst, now)
+    self.ramp_start = now
+    self.last_write = now
+
+
+class WriteRateLimiter(object):
+  """Token bucket limits on object writes, with coalescing of queued writes.
+
+  Every write takes a token from its object's bucket and from its Cloud
+  Storage bucket's bucket, waiting until both hold one, and writes to the
+  same object are sent one at a time. The bucket rate starts at bucket_rate
+  and doubles every ramp_interval_sec of use, starting over after the bucket
+  is idle for a ramp interval.
+
+  Only one write per object waits at a time. When a newer write to the same
+  object arrives, the waiting write is abandoned without being sent and its
+  caller gets gcs_error.GcsWriteSupersededError, as the newer write would
+  have overwritten it anyway. A write already being sent is never
+  superseded.
+
+  Attributes:
+    object_rate: The writes per second allowed to each object.
+    object_burst: The writes an object may take at once.
+    bucket_rate: The starting writes per second allowed to each bucket.
+    bucket_burst: The writes a bucket may take at once.
+    ramp_interval_sec: The seconds after which the bucket rate doubles, or
+        None to keep it at bucket_rate.
+  """
+
+  def __init__(self, object_rate=DEFAULT_OBJECT_RATE,
+               object_burst=DEFAULT_OBJECT_BURST,
+               bucket_rate=DEFAULT_BUCKET_RATE,
+               bucket_burst=DEFAULT_BUCKET_BURST,
+               ramp_interval_sec=DEFAULT_RAMP_INTERVAL_SEC):
+    """Inits WriteRateLimiter with object and bucket rates.
+
+    Args:
+      object_rate: The writes per second allowed to each object.
+      object_burst: The writes an object may take at once.
+      bucket_rate: The starting writes per second allowed to each bucket.
+      bucket_burst: The writes a bucket may take at once.
+      ramp_interval_sec: The seconds after which the bucket rate doubles, or
+          None to keep it at bucket_rate.
+    """
+    self.object_rate = object_rate
+    self.object_burst = object_burst
+    self.bucket_rate = bucket_rate
+    self.bucket_burst = bucket_burst
+    self.ramp_interval_sec = ramp_interval_sec
+    self._objects = {}
+    self._buckets = {}
+    self._condition = threading.Condition()
+    self._calls_since_prune = 0
+    self._stats = {'writes': 0, 'superseded': 0, 'waits': 0}
+
+  def call(self, bucket_name, object_name, func):
+    """Calls func to write an object once the rate limits allow it.
+
+    Args:
+      bucket_name: The name of the bucket written to.
+      object_name: The name of the object written.
+      func: A callable taking no arguments that sends the write.
+
+    Returns:
+      The result of func.
+
+    Raises:
+      gcs_error.GcsWriteSupersededError if a newer write to the object
+          arrived before this one was sent.
+      Exception raised by func.
+    """
+    marker = object()
+    with self._condition:
+      now = time.time()
+      self._calls_since_prune += 1
+      if self._calls_since_prune >= PRUNE_INTERVAL:
+        self._prune(now)
+      key = (bucket_name, object_name)
+      state = self._objects.get(key)
+      if state is None:
+        state = self._objects[key] = _ObjectState(
+            self.object_rate, self.object_burst, now)
+      bucket = self._buckets.get(bucket_name)
+      if bucket is None:
+        bucket = self._buckets[bucket_name] = _BucketState(
+            self.bucket_rate, self.bucket_burst, now)
+      if state.pending is not None:
+        self._stats['superseded'] += 1
+        self._condition.notify_all()
+      state.pending = marker
+
+      waited = False
+      while True:
+        if state.pending is not marker:
+          raise gcs_error.GcsWriteSupersededError(bucket_name, object_name)
+        now = time.time()
+        wait = _WAIT_TIMEOUT_SEC
+        if not state.sending:
+          wait = max(state.tokens.get_wait(now),
+                     self._get_bucket_wait(bucket, now))
+        if not wait:
+          break
+        if not waited:
+          self._stats['waits'] += 1
+          waited = True
+        self._condition.wait(wait)
+
+      state.pending = None
+      state.sending = True
+      state.tokens.tokens -= 1
+      bucket.tokens.tokens -= 1
+      bucket.last_write = now
+      self._stats['writes'] += 1
+    try:
+      return func()
+    finally:
+      with self._condition:
+        state.sending = False
+        self._condition.notify_all()
+
+  def get_stats(self):
+    """Gets the write counters.
+
+    Returns:
+      A dictionary with the writes sent, the writes superseded, the writes
+      that had to wait, and the numbers of objects and buckets tracked.
+    """
+    with self._condition:
+      stats = dict(self._stats)
+      stats['objects'] = len(self._objects)
+      stats['buckets'] = len(self._buckets)
+    return stats
+
+  def _get_bucket_wait(self, bucket, now):
+    """Ramps up the rate of a bucket and gets the time until it has a token.
+
+    The caller holds the lock.
+
+    Args:
+      bucket: The _BucketState.
+      now: The current time.
+
+    Returns:
+      The number of seconds until a token is available, 0 if one is.
+    """
+    if not self.ramp_interval_sec:
+      return bucket.tokens.get_wait(now)
+    if now - bucket.last_write > self.ramp_interval_sec:
+      bucket.ramp_start = now
+    doublings = int((now - bucket.ramp_start) / self.ramp_interval_sec)
+    # Tokens earned so far count at the old rate.
+    wait = bucket.tokens.get_wait(now)
+    rate = self.bucket_rate * 2 ** doublings
+    if rate != bucket.tokens.rate:
+      bucket.tokens.rate = rate
+      wait = bucket.tokens.get_wait(now)
+    return wait
+
+  def _prune(self, now):
+    """Drops the state of objects and buckets that are idle and refilled.
+
+    The caller holds the lock.
+
+    Args:
+      now: The current time.
+    """
+    self._calls_since_prune = 0
+    for key, state in self._objects.items():
+      if (state.pending is None and not state.sending and
+          state.tokens.get_wait(now) == 0 and
+          state.tokens.tokens >= state.tokens.capacity):
+        del self._objects[key]
+    for bucket_name, bucket in self._buckets.items():
+      if self.ramp_interval_sec:
+        idle = now - bucket.last_write > self.ramp_interval_sec
+      else:
+        idle = True
+      if (idle and bucket.tokens.get_wait(now) == 0 and
+          bucket.tokens.tokens >= bucket.tokens.capacity):
+        del self._buckets[bucket_name]
@@ -0,0 +1,127 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""On-disk checkpoints for Cloud Storage resumable uploads."""
+
+import json
+import logging
+import os
+
+STATE_FILE_SUFFIX = '.gcs-upload'
+CHUNK_MULTIPLE = 256 * 1024
+DEFAULT_CHUNK_SIZE = 32 * CHUNK_MULTIPLE
+
+
+class UploadState(object):
+  """The progress of a resumable upload session, saved to a local file.
+
+  The state is rewritten after every acknowledged chunk, so a restarted
+  process can continue the session from the last committed byte.
+
+  Attributes:
+    path: The string path of the state file.
+    session_uri: The string upload session URI returned by Cloud Storage.
+    offset: The number of bytes the server has committed.
+    bucket_name: The name of the destination bucket.
+    object_name: The name of the destination object.
+    size: The size of the local file in bytes.
+    mtime: The modification time of the local file.
+  """
+
+  def __init__(self, path, session_uri, bucket_name, object_name, size, mtime,
+               offset=0):
+    """Inits UploadState with the session and the file it uploads.
+
+    Args:
+      path: The string path of the state file.
+      session_uri: The string upload session URI.
+      bucket_name: The name of the destination bucket.
+      object_name: The name of the destination object.
+      size: The size of the local file in bytes.
+      mtime: The modification time of the local file.
+      offset: The number of bytes the server has committed.
+    """
+    self.path = path
+    self.session_uri = session_uri
+    self.bucket_name = bucket_name
+    self.object_name = object_name
+    self.size = size
+    self.mtime = mtime
+    self.offset = offset
+
+  @classmethod
+  def load(cls, path):
+    """Loads the state saved at path.
+
+    Args:
+      path: The string path of the state file.
+
+    Returns:
+      An UploadState, or None if there is no readable state at path.
+    """
+    try:
+      state_file = open(path, 'r')
+    except IOError:
+      return None
+    try:
+      try:
+        values = json.load(state_file)
+        return cls(path, values['session_uri'], values['bucket_name'],
+                   values['object_name'], values['size'], values['mtime'],
+                   values['offset'])
+      except (ValueError, KeyError), e:
+        logging.warning('Ignoring unreadable upload state %s: %s', path, e)
+        return None
+    finally:
+      state_file.close()
+
+  def matches(self, bucket_name, object_name, size, mtime):
+    """Checks whether the state belongs to an upload of the given file.
+
+    Args:
+      bucket_name: The name of the destination bucket.
+      object_name: The name of the destination object.
+      size: The current size of the local file in bytes.
+      mtime: The current modification time of the local file.
+
+    Returns:
+      True if the session can be resumed for this upload.
+    """
+    return (self.bucket_name == bucket_name and
+            self.object_name == object_name and
+            self.size == size and self.mtime == mtime)
+
+  def save(self):
+    """Atomically writes the state to its file."""
+    temp_path = '%s.%d.tmp' % (self.path, os.getpid())
+    state_file = open(temp_path, 'w')
+    try:
+      json.dump({
+          'session_uri': self.session_uri,
+          'bucket_name': self.bucket_name,
+          'object_name': self.object_name,
+          'size': self.size,
+          'mtime': self.mtime,
+          'offset': self.offset,
+      }, state_file)
+    finally:
+      state_file.close()
+    os.rename(temp_path, self.path)
+
+  def delete(self):
+    """Removes the state file once the upload has completed."""
+    try:
+      os.remove(self.path)
+    except OSError:
+      pass
@@ -0,0 +1,114 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Retry policy for Google Cloud Storage API requests."""
+
+import random
+import threading
+
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_BASE_DELAY_SEC = 0.5
+DEFAULT_MAX_DELAY_SEC = 32
+DEFAULT_BUDGET_RATIO = 0.1
+DEFAULT_BUDGET_MAX_TOKENS = 100
+
+
+class RetryPolicy(object):
+  """Exponential backoff with full jitter, bounded by a retry budget.
+
+  Every first attempt deposits budget_ratio tokens into a client-wide budget,
+  up to budget_max_tokens, and every retry spends one. When the budget is
+  empty, failures are raised instead of retried, so during an outage retries
+  add at most budget_ratio extra load once the initial tokens are spent.
+
+  Attributes:
+    max_attempts: The maximum number of attempts per request, including the
+        first.
+    base_delay_sec: The backoff ceiling for the first retry.
+    max_delay_sec: The largest delay before any retry.
+    budget_ratio: Tokens earned per first attempt.
+    budget_max_tokens: The most tokens the budget holds.
+  """
+
+  def __init__(self, max_attempts=DEFAULT_MAX_ATTEMPTS,
+               base_delay_sec=DEFAULT_BASE_DELAY_SEC,
+               max_delay_sec=DEFAULT_MAX_DELAY_SEC,
+               budget_ratio=DEFAULT_BUDGET_RATIO,
+               budget_max_tokens=DEFAULT_BUDGET_MAX_TOKENS):
+    """Inits RetryPolicy with attempt, delay and budget limits.
+
+    Args:
+      max_attempts: The maximum number of attempts per request.
+      base_delay_sec: The backoff ceiling for the first retry.
+      max_delay_sec: The largest delay before any retry.
+      budget_ratio: Tokens earned per first attempt.
+      budget_max_tokens: The most tokens the budget holds. The budget starts
+          full.
+    """
+    self.max_attempts = max_attempts
+    self.base_delay_sec = base_delay_sec
+    self.max_delay_sec = max_delay_sec
+    self.budget_ratio = budget_ratio
+    self.budget_max_tokens = budget_max_tokens
+    self._tokens = float(budget_max_tokens)
+    self._lock = threading.Lock()
+    self._stats = {'requests': 0, 'retries': 0, 'budget_exhausted': 0}
+
+  def record_request(self):
+    """Records a first attempt and earns budget for later retries."""
+    with self._lock:
+      self._stats['requests'] += 1
+      self._tokens = min(self.budget_max_tokens,
+                         self._tokens + self.budget_ratio)
+
+  def get_delay(self, attempt, retry_after=None):
+    """Decides whether a failed attempt is retried and after how long.
+
+    Args:
+      attempt: The number of attempts made so far, starting at 1.
+      retry_after: The Retry-After response header, if any.
+
+    Returns:
+      The number of seconds to wait before retrying, or None if the request
+      should not be retried.
+    """
+    if attempt >= self.max_attempts:
+      return None
+    with self._lock:
+      if self._tokens < 1:
+        self._stats['budget_exhausted'] += 1
+        return None
+      self._tokens -= 1
+      self._stats['retries'] += 1
+    delay = random.uniform(
+        0, min(self.max_delay_sec, self.base_delay_sec * 2 ** (attempt - 1)))
+    if retry_after:
+      try:
+        delay = max(delay, min(self.max_delay_sec, float(retry_after)))
+      except ValueError:
+        pass
+    return delay
+
+  def get_stats(self):
+    """Gets the retry counters.
+
+    Returns:
+      A dictionary with the requests, retries and budget_exhausted counters
+      and the tokens left in the budget.
+    """
+    with self._lock:
+      stats = dict(self._stats)
+      stats['budget_tokens'] = self._tokens
+    return stats
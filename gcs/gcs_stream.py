@@ -0,0 +1,300 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Streaming helpers for Cloud Storage request and response bodies."""
+
+import os
+import zlib
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+# Bytes fetched by each Range request of a streamed download.
+DEFAULT_RANGE_SIZE = 32 * 1024 * 1024
+DEFAULT_COMPRESS_LEVEL = 6
+# zlib window bits selecting the gzip container rather than raw zlib.
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+class ChunkedReader(object):
+  """File-like request body that streams its source in fixed-size chunks.
+
+  httplib sends any body that has a read method block by block, so passing a
+  ChunkedReader as the request body keeps memory use independent of the
+  object size.
+
+  Attributes:
+    size: The total number of bytes the reader produces.
+    chunk_size: The maximum number of bytes returned by a single read.
+    hasher: The gcs_checksum.StreamHasher fed every byte read, or None.
+    hash_offset: The offset in the object of the first byte of the reader.
+  """
+
+  def __init__(self, source, size, chunk_size=DEFAULT_CHUNK_SIZE,
+               hasher=None, hash_offset=0):
+    """Inits ChunkedReader with a source and its size.
+
+    Args:
+      source: A file-like object with a read method, or an iterable of
+          strings.
+      size: The number of bytes to read from the source.
+      chunk_size: The maximum number of bytes returned by a single read.
+      hasher: An optional gcs_checksum.StreamHasher fed every byte read.
+      hash_offset: The offset in the object of the first byte of the reader.
+    """
+    self.size = size
+    self.chunk_size = chunk_size
+    self.hasher = hasher
+    self.hash_offset = hash_offset
+    self._position = 0
+    self._buffer = ''
+    if hasattr(source, 'read'):
+      self._file = source
+      self._iterator = None
+    else:
+      self._file = None
+      self._iterator = iter(source)
+    self._start = None
+    if self._file is not None and hasattr(self._file, 'tell'):
+      try:
+        self._start = self._file.tell()
+      except (IOError, OSError):
+        self._start = None
+
+  def __len__(self):
+    """Returns the total number of bytes the reader produces."""
+    return self.size
+
+  def read(self, amt=-1):
+    """Reads up to amt bytes, never more than chunk_size at a time.
+
+    Args:
+      amt: The maximum number of bytes to return. Defaults to chunk_size.
+
+    Returns:
+      A string of at most amt bytes, or '' once size bytes have been read.
+    """
+    if amt is None or amt < 0 or amt > self.chunk_size:
+      amt = self.chunk_size
+    amt = min(amt, self.size - self._position)
+    if amt <= 0:
+      return ''
+    if self._file is not None:
+      data = self._file.read(amt)
+    else:
+      data = self._read_iterator(amt)
+    if self.hasher: self.hasher.update(data, self.hash_offset + self._position)
+    self._position += len(data)
+    return data
+
+  def tell(self):
+    """Returns the number of bytes read so far."""
+    return self._position
+
+  def seekable(self):
+    """Returns True if the reader can be rewound with seek."""
+    return self._start is not None
+
+  def seek(self, offset, whence=os.SEEK_SET):
+    """Moves the read position, if the underlying source is seekable.
+
+    Args:
+      offset: The byte offset, relative to the start of the reader.
+      whence: Only os.SEEK_SET is supported.
+
+    Raises:
+      IOError if the source cannot be repositioned.
+    """
+    if whence != os.SEEK_SET or self._start is None:
+      raise IOError('ChunkedReader source is not seekable.')
+    self._file.seek(self._start + offset)
+    self._position = offset
+
+  def _read_iterator(self, amt):
+    """Reads up to amt bytes from the iterator source.
+
+    Args:
+      amt: The maximum number of bytes to return.
+
+    Returns:
+      A string of at most amt bytes.
+    """
+    while len(self._buffer) < amt:
+      try:
+        self._buffer += next(self._iterator)
+      except StopIteration:
+        break
+    data, self._buffer = self._buffer[:amt], self._buffer[amt:]
+    return data
+
+
+class GzipReader(object):
+  """Iterable that gzips a source as it is read.
+
+  The compressed size is not known until the source is exhausted, so the
+  output is meant for uploads that do not need a Content-Length up front.
+
+  Attributes:
+    bytes_read: The number of uncompressed bytes read from the source.
+    bytes_compressed: The number of compressed bytes produced.
+  """
+
+  def __init__(self, source, size=None, chunk_size=DEFAULT_CHUNK_SIZE,
+               level=DEFAULT_COMPRESS_LEVEL):
+    """Inits GzipReader with a source.
+
+    Args:
+      source: A file-like object with a read method, or an iterable of
+          strings.
+      size: The number of bytes to read from a file-like source. Defaults to
+          reading until the end.
+      chunk_size: The maximum number of bytes read from the source at once.
+      level: The zlib compression level, from 1 (fastest) to 9 (smallest).
+    """
+    self.bytes_read = 0
+    self.bytes_compressed = 0
+    self._source = source
+    self._size = size
+    self._chunk_size = chunk_size
+    self._level = level
+
+  def __iter__(self):
+    """Compresses the source.
+
+    Yields:
+      Non-empty strings of gzip data.
+    """
+    compressor = zlib.compressobj(self._level, zlib.DEFLATED, GZIP_WBITS)
+    for data in self._iter_source():
+      self.bytes_read += len(data)
+      compressed = compressor.compress(data)
+      if compressed:
+        self.bytes_compressed += len(compressed)
+        yield compressed
+    compressed = compressor.flush()
+    self.bytes_compressed += len(compressed)
+    yield compressed
+
+  def _iter_source(self):
+    """Reads the source in chunks.
+
+    Yields:
+      Strings of at most chunk_size bytes from a file-like source, or the
+      items of an iterable source.
+    """
+    if not hasattr(self._source, 'read'):
+      for data in self._source:
+        yield data
+      return
+    remaining = self._size
+    while remaining is None or remaining > 0:
+      amt = self._chunk_size
+      if remaining is not None: amt = min(amt, remaining)
+      data = self._source.read(amt)
+      if not data:
+        break
+      if remaining is not None: remaining -= len(data)
+      yield data
+
+
+def get_stream_size(stream):
+  """Works out how many bytes remain in a seekable file-like object.
+
+  Args:
+    stream: A file-like object.
+
+  Returns:
+    The number of bytes between the current position and the end of the
+    stream, or None if the size cannot be determined.
+  """
+  try:
+    return os.fstat(stream.fileno()).st_size - stream.tell()
+  except (AttributeError, IOError, OSError):
+    pass
+  try:
+    position = stream.tell()
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell() - position
+    stream.seek(position)
+    return size
+  except (AttributeError, IOError, OSError):
+    return None
+
+
+class Sink(object):
+  """Destination for a streamed response body.
+
+  Attributes:
+    bytes_written: The number of bytes written to the sink so far.
+  """
+
+  def __init__(self, target):
+    """Inits Sink with a target.
+
+    Args:
+      target: A string local file path, a file-like object with a write
+          method, or a callable that accepts each chunk as a string. Files
+          opened from a path are closed by close; file-like objects and
+          callables are left to the caller.
+    """
+    self.bytes_written = 0
+    self._file = None
+    if isinstance(target, basestring):
+      self._file = open(target, 'wb')
+      self._write = self._file.write
+    elif hasattr(target, 'write'):
+      self._write = target.write
+    elif callable(target):
+      self._write = target
+    else:
+      raise ValueError('Sink must be a file path, file object or callable.')
+
+  def write(self, data):
+    """Writes a chunk to the target.
+
+    Args:
+      data: The string chunk.
+    """
+    if data:
+      self._write(data)
+      self.bytes_written += len(data)
+
+  def close(self):
+    """Closes the target file, if the sink opened it."""
+    if self._file:
+      self._file.close()
+      self._file = None
+
+
+def parse_content_range(content_range):
+  """Parses a Content-Range response header.
+
+  Args:
+    content_range: A header value such as 'bytes 0-99/1234'.
+
+  Returns:
+    A (first, last, total) tuple of ints. total is None when the server
+    reports it as '*'.
+
+  Raises:
+    ValueError if the header cannot be parsed.
+  """
+  unit, _, byte_range = content_range.strip().partition(' ')
+  if unit != 'bytes':
+    raise ValueError('Unsupported Content-Range: %s' % content_range)
+  span, _, total = byte_range.partition('/')
+  first, _, last = span.partition('-')
+  if total == '*':
+    total = None
+  else:
+    total = int(total)
+  return int(first), int(last), total
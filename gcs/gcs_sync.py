@@ -0,0 +1,210 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Change detection for syncing a local directory with a bucket.
+
+Local MD5 digests are remembered in a manifest file at the root of the
+synced directory, keyed by relative path and checked against the file size
+and modification time, so unchanged files are never read twice.
+"""
+
+import base64
+import binascii
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+
+import gcs_checksum
+import gcs_resumable
+
+MANIFEST_FILE = '.gcs-sync'
+TEMP_SUFFIX = '.gcs-sync.tmp'
+HASH_BUFFER_SIZE = 1024 * 1024
+
+_MD5_ETAG_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+class SyncManifest(object):
+  """The cached MD5 digests of the files in a synced directory.
+
+  Attributes:
+    path: The string path of the manifest file.
+  """
+
+  def __init__(self, path):
+    """Inits SyncManifest, loading any digests saved at path.
+
+    Args:
+      path: The string path of the manifest file.
+    """
+    self.path = path
+    self._entries = {}
+    self._changed = False
+    self._lock = threading.Lock()
+    try:
+      manifest_file = open(path, 'r')
+    except IOError:
+      return
+    try:
+      try:
+        self._entries = json.load(manifest_file)
+      except ValueError, e:
+        logging.warning('Ignoring unreadable sync manifest %s: %s', path, e)
+    finally:
+      manifest_file.close()
+
+  def get_md5(self, relative_path, file_path, size, mtime):
+    """Gets the hex MD5 digest of a file, hashing it only if it changed.
+
+    Args:
+      relative_path: The string path of the file within the directory.
+      file_path: The string path of the file.
+      size: The size of the file in bytes.
+      mtime: The modification time of the file.
+
+    Returns:
+      The hex MD5 digest string.
+    """
+    with self._lock:
+      entry = self._entries.get(relative_path)
+    if entry and entry[0] == size and entry[1] == mtime:
+      return entry[2]
+    md5 = compute_md5(file_path)
+    self.put(relative_path, size, mtime, md5)
+    return md5
+
+  def put(self, relative_path, size, mtime, md5):
+    """Records the digest of a file.
+
+    Args:
+      relative_path: The string path of the file within the directory.
+      size: The size of the file in bytes.
+      mtime: The modification time of the file.
+      md5: The hex MD5 digest string.
+    """
+    with self._lock:
+      self._entries[relative_path] = [size, mtime, md5]
+      self._changed = True
+
+  def remove(self, relative_path):
+    """Forgets the digest of a deleted file.
+
+    Args:
+      relative_path: The string path of the file within the directory.
+    """
+    with self._lock:
+      if self._entries.pop(relative_path, None) is not None:
+        self._changed = True
+
+  def save(self):
+    """Atomically writes the manifest if any digest changed."""
+    with self._lock:
+      if not self._changed:
+        return
+      temp_path = '%s.%d.tmp' % (self.path, os.getpid())
+      manifest_file = open(temp_path, 'w')
+      try:
+        json.dump(self._entries, manifest_file)
+      finally:
+        manifest_file.close()
+      os.rename(temp_path, self.path)
+      self._changed = False
+
+
+def iter_local_files(directory):
+  """Walks a directory, skipping the files written by the client itself.
+
+  Args:
+    directory: The string path of the directory.
+
+  Yields:
+    (relative_path, size, mtime) tuples. relative_path uses '/' separators.
+  """
+  for dir_path, dir_names, file_names in os.walk(directory):
+    dir_names.sort()
+    for file_name in sorted(file_names):
+      if (file_name.startswith(MANIFEST_FILE) or
+          file_name.endswith(TEMP_SUFFIX) or
+          file_name.endswith(gcs_resumable.STATE_FILE_SUFFIX)):
+        continue
+      file_path = os.path.join(dir_path, file_name)
+      try:
+        stat = os.stat(file_path)
+      except OSError:
+        continue
+      relative_path = os.path.relpath(file_path, directory)
+      yield relative_path.replace(os.sep, '/'), stat.st_size, stat.st_mtime
+
+
+def compute_md5(file_path):
+  """Hashes a file without reading it into memory at once.
+
+  Args:
+    file_path: The string path of the file.
+
+  Returns:
+    The hex MD5 digest string.
+  """
+  md5 = hashlib.md5()
+  hash_file = open(file_path, 'rb')
+  try:
+    while True:
+      data = hash_file.read(HASH_BUFFER_SIZE)
+      if not data:
+        break
+      md5.update(data)
+  finally:
+    hash_file.close()
+  return md5.hexdigest()
+
+
+def get_etag_md5(etag):
+  """Gets the MD5 digest carried by an ETag.
+
+  The ETag of an object uploaded in a single request is its hex MD5 digest.
+  Composite and other objects have opaque ETags.
+
+  Args:
+    etag: The string ETag, with or without quotes, or None.
+
+  Returns:
+    The hex MD5 digest string, or None if the ETag is not an MD5 digest.
+  """
+  if not etag:
+    return None
+  etag = etag.strip('"').lower()
+  if _MD5_ETAG_PATTERN.match(etag):
+    return etag
+  return None
+
+
+def get_hash_header_md5(x_goog_hash):
+  """Gets the MD5 digest from an x-goog-hash response header.
+
+  Args:
+    x_goog_hash: The header value, such as 'crc32c=n03x6A==,md5=...', or None.
+
+  Returns:
+    The hex MD5 digest string, or None if the header has no MD5 digest.
+  """
+  md5 = gcs_checksum.parse_hash_header(x_goog_hash).get('md5')
+  if not md5:
+    return None
+  try:
+    return binascii.hexlify(base64.b64decode(md5))
+  except TypeError:
+    return None
@@ -0,0 +1,389 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""HTTP transports used by the Cloud Storage clients."""
+
+import threading
+import time
+import urlparse
+
+import httplib2
+
+DEFAULT_MAX_CONNECTIONS = 32
+DEFAULT_MAX_PER_HOST = 16
+DEFAULT_IDLE_TIMEOUT_SEC = 60
+# Carries the content-encoding of a response past httplib2's decoding.
+_HIDDEN_ENCODING_HEADER = 'x-gcs-content-encoding'
+
+
+class EncodedContentHttp(httplib2.Http):
+  """An httplib2.Http that returns gzip-encoded bodies when asked for gzip.
+
+  httplib2 inflates every gzip-encoded body it reads, which fails on a range
+  of the compressed bytes. A request that sends Accept-Encoding: gzip itself
+  gets the body as it was sent instead, still carrying its content-encoding
+  header. Other requests are decoded as usual.
+
+  Like httplib2.Http, an instance must be used by one thread at a time.
+  """
+
+  def __init__(self, *args, **kwargs):
+    """Inits EncodedContentHttp with the arguments of httplib2.Http."""
+    httplib2.Http.__init__(self, *args, **kwargs)
+    self._keep_encoding = False
+
+  def request(self, uri, method='GET', body=None, headers=None, *args,
+              **kwargs):
+    """Sends a request. See httplib2.Http.request.
+
+    Returns:
+      The httplib2.Response and string content.
+    """
+    self._keep_encoding = any(
+        name.lower() == 'accept-encoding' and 'gzip' in value
+        for name, value in (headers or {}).items())
+    try:
+      return httplib2.Http.request(self, uri, method, body, headers, *args,
+                                   **kwargs)
+    finally:
+      self._keep_encoding = False
+
+  def _conn_request(self, conn, request_uri, method, body, headers):
+    """Sends a request on a connection, hiding its encoding from httplib2.
+
+    Returns:
+      The httplib2.Response and string content.
+    """
+    if not self._keep_encoding:
+      return httplib2.Http._conn_request(
+          self, conn, request_uri, method, body, headers)
+    response, content = httplib2.Http._conn_request(
+        self, _EncodedConnection(conn), request_uri, method, body, headers)
+    encoding = response.pop(_HIDDEN_ENCODING_HEADER, None)
+    if encoding: response['content-encoding'] = encoding
+    return response, content
+
+
+class _EncodedConnection(object):
+  """Wraps an httplib connection to hide response encodings from httplib2."""
+
+  def __init__(self, connection):
+    """Inits _EncodedConnection with the connection to wrap.
+
+    Args:
+      connection: An httplib.HTTPConnection.
+    """
+    self._connection = connection
+
+  def __getattr__(self, name):
+    """Passes other attributes to the wrapped connection.
+
+    Args:
+      name: The string attribute name.
+
+    Returns:
+      The attribute of the wrapped connection.
+    """
+    return getattr(self._connection, name)
+
+  def getresponse(self):
+    """Reads a response, renaming its content-encoding header.
+
+    Returns:
+      The httplib.HTTPResponse.
+    """
+    response = self._connection.getresponse()
+    encoding = response.msg.getheader('content-encoding')
+    if encoding:
+      del response.msg['content-encoding']
+      response.msg[_HIDDEN_ENCODING_HEADER] = encoding
+    return response
+
+
+class Transport(object):
+  """Sends HTTP requests on behalf of a Gcs client.
+
+  Attributes:
+    decodes_content: True if gzip-encoded response bodies are inflated before
+        they are returned, even when the request asked for gzip. Such a
+        transport cannot return a byte range of a gzip-encoded object.
+    cancels_requests: True if request accepts a cancellation keyword
+        argument, a gcs_hedge.Cancellation that interrupts the request when
+        cancelled.
+  """
+
+  decodes_content = False
+  cancels_requests = False
+
+  def request(self, uri, method='GET', headers=None, body=None):
+    """Sends an HTTP request.
+
+    Args:
+      uri: The full request URI.
+      method: The HTTP request method.
+      headers: A dictionary of request headers.
+      body: The request body, a string or a file-like object.
+
+    Returns:
+      The httplib2.Response and string content.
+
+    Raises:
+      NotImplementedError if the method is not implemented in the subclass.
+    """
+    raise NotImplementedError('You need to override this function')
+
+  def get_stats(self):
+    """Gets counters describing the transport.
+
+    Returns:
+      A dictionary mapping string counter names to numbers.
+    """
+    return {}
+
+  def close(self):
+    """Closes any connections held by the transport."""
+    pass
+
+
+class HttpTransport(Transport):
+  """Sends every request on one shared httplib2.Http, one at a time.
+
+  httplib2.Http is not thread-safe, so concurrent callers are serialized.
+  """
+
+  def __init__(self, http):
+    """Inits HttpTransport with an httplib2.Http.
+
+    Args:
+      http: An authorized instance of httplib2.Http. With an
+          EncodedContentHttp, gzip-encoded objects can be downloaded in
+          compressed ranges.
+    """
+    self._http = http
+    self._lock = threading.Lock()
+    self.decodes_content = not isinstance(http, EncodedContentHttp)
+
+  def request(self, uri, method='GET', headers=None, body=None):
+    """Sends an HTTP request on the shared httplib2.Http.
+
+    Args:
+      uri: The full request URI.
+      method: The HTTP request method.
+      headers: A dictionary of request headers.
+      body: The request body, a string or a file-like object.
+
+    Returns:
+      The httplib2.Response and string content.
+    """
+    with self._lock:
+      return self._http.request(uri, method=method, headers=headers, body=body)
+
+  def close(self):
+    """Closes the connections of the shared httplib2.Http."""
+    with self._lock:
+      _close_http(self._http)
+
+
+class PooledHttpTransport(Transport):
+  """Thread-safe transport backed by a bounded pool of httplib2.Http objects.
+
+  Each pooled httplib2.Http keeps its connection alive between requests and
+  is used by one thread at a time. Idle instances are kept per host and
+  reused most recently used first. When a pool is full, callers wait for an
+  instance to be released.
+
+  Attributes:
+    max_connections: The maximum number of pooled instances across all hosts.
+    max_per_host: The maximum number of pooled instances for one host.
+    idle_timeout_sec: Seconds after which an idle instance is closed.
+  """
+
+  def __init__(self, http_factory, max_connections=DEFAULT_MAX_CONNECTIONS,
+               max_per_host=DEFAULT_MAX_PER_HOST,
+               idle_timeout_sec=DEFAULT_IDLE_TIMEOUT_SEC,
+               decodes_content=True):
+    """Inits PooledHttpTransport with a factory and pool limits.
+
+    Args:
+      http_factory: A callable returning a new authorized httplib2.Http.
+      max_connections: The maximum number of pooled instances across all
+          hosts.
+      max_per_host: The maximum number of pooled instances for one host.
+      idle_timeout_sec: Seconds after which an idle instance is closed.
+      decodes_content: False if http_factory returns EncodedContentHttp
+          instances.
+    """
+    self.decodes_content = decodes_content
+    self.max_connections = max_connections
+    self.max_per_host = min(max_per_host, max_connections)
+    self.idle_timeout_sec = idle_timeout_sec
+    self._http_factory = http_factory
+    self._condition = threading.Condition()
+    self._idle = {}
+    self._in_use = {}
+    self._total = 0
+    self._stats = {'hits': 0, 'misses': 0, 'waits': 0, 'expired': 0,
+                   'evicted': 0, 'discarded': 0}
+
+  def request(self, uri, method='GET', headers=None, body=None):
+    """Sends an HTTP request on a pooled httplib2.Http.
+
+    Args:
+      uri: The full request URI.
+      method: The HTTP request method.
+      headers: A dictionary of request headers.
+      body: The request body, a string or a file-like object.
+
+    Returns:
+      The httplib2.Response and string content.
+    """
+    host = urlparse.urlsplit(uri).netloc
+    http = self._acquire(host)
+    reusable = False
+    try:
+      result = http.request(uri, method=method, headers=headers, body=body)
+      reusable = True
+      return result
+    finally:
+      self._release(host, http, reusable)
+
+  def get_stats(self):
+    """Gets the pool counters.
+
+    Returns:
+      A dictionary with the hits, misses, waits, expired, evicted and
+      discarded counters, and the current number of idle and in_use
+      instances.
+    """
+    with self._condition:
+      stats = dict(self._stats)
+      stats['idle'] = sum(len(idle) for idle in self._idle.values())
+      stats['in_use'] = sum(self._in_use.values())
+    return stats
+
+  def close(self):
+    """Closes all idle instances."""
+    with self._condition:
+      for idle in self._idle.values():
+        for http, last_used in idle:
+          _close_http(http)
+          self._total -= 1
+      self._idle = {}
+      self._condition.notify_all()
+
+  def _acquire(self, host):
+    """Takes an httplib2.Http for host from the pool, creating one if allowed.
+
+    Args:
+      host: The string host and port of the request.
+
+    Returns:
+      An httplib2.Http reserved for the calling thread.
+    """
+    waited = False
+    with self._condition:
+      while True:
+        self._expire_idle()
+        idle = self._idle.get(host)
+        if idle:
+          http, last_used = idle.pop()
+          self._in_use[host] = self._in_use.get(host, 0) + 1
+          self._stats['hits'] += 1
+          return http
+        if self._in_use.get(host, 0) < self.max_per_host:
+          if self._total >= self.max_connections:
+            self._evict_idle()
+          if self._total < self.max_connections:
+            self._in_use[host] = self._in_use.get(host, 0) + 1
+            self._total += 1
+            self._stats['misses'] += 1
+            break
+        if not waited:
+          self._stats['waits'] += 1
+          waited = True
+        self._condition.wait()
+    try:
+      return self._http_factory()
+    except:
+      self._release(host, None, False)
+      raise
+
+  def _release(self, host, http, reusable):
+    """Returns an httplib2.Http to the pool.
+
+    Args:
+      host: The string host and port the instance was acquired for.
+      http: The httplib2.Http instance, or None if it was never created.
+      reusable: False if the request failed, in which case the instance is
+          closed rather than kept.
+    """
+    with self._condition:
+      self._in_use[host] -= 1
+      if http is not None and reusable:
+        self._idle.setdefault(host, []).append((http, time.time()))
+      else:
+        if http is not None:
+          _close_http(http)
+          self._stats['discarded'] += 1
+        self._total -= 1
+      self._condition.notify_all()
+
+  def _expire_idle(self):
+    """Closes instances idle for longer than idle_timeout_sec.
+
+    Must be called with the pool condition held.
+    """
+    cutoff = time.time() - self.idle_timeout_sec
+    for host, idle in self._idle.items():
+      while idle and idle[0][1] < cutoff:
+        http, last_used = idle.pop(0)
+        _close_http(http)
+        self._total -= 1
+        self._stats['expired'] += 1
+      if not idle:
+        del self._idle[host]
+
+  def _evict_idle(self):
+    """Closes the least recently used idle instance of any host.
+
+    Must be called with the pool condition held.
+    """
+    oldest_host = None
+    for host, idle in self._idle.items():
+      if idle and (oldest_host is None or
+                   idle[0][1] < self._idle[oldest_host][0][1]):
+        oldest_host = host
+    if oldest_host is None:
+      return
+    http, last_used = self._idle[oldest_host].pop(0)
+    if not self._idle[oldest_host]:
+      del self._idle[oldest_host]
+    _close_http(http)
+    self._total -= 1
+    self._stats['evicted'] += 1
+
+
+def _close_http(http):
+  """Closes the open connections of an httplib2.Http.
+
+  Args:
+    http: An httplib2.Http instance.
+  """
+  connections = getattr(http, 'connections', None)
+  if not connections:
+    return
+  for connection in connections.values():
+    connection.close()
+  connections.clear()
+
@@ -0,0 +1,167 @@
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Records parsed from Google Cloud Storage XML API responses.
+
+The records use __slots__ so that large listings cost a few fields per entry
+rather than an instance dictionary.
+"""
+
+
+class _Record(object):
+  """Base class for the __slots__ records."""
+
+  __slots__ = ()
+
+  def __repr__(self):
+    """Displays the record as <class>(<field>=<value>, ...).
+
+    Returns:
+      The string representation of the record.
+    """
+    return '%s(%s)' % (
+        self.__class__.__name__,
+        ', '.join('%s=%r' % (slot, getattr(self, slot))
+                  for slot in self.__slots__))
+
+  def __eq__(self, other):
+    """Compares records field by field.
+
+    Args:
+      other: The object to compare with.
+
+    Returns:
+      True if other is the same type of record with equal fields.
+    """
+    return (type(self) is type(other) and
+            all(getattr(self, slot) == getattr(other, slot)
+                for slot in self.__slots__))
+
+  def __ne__(self, other):
+    """Compares records field by field.
+
+    Args:
+      other: The object to compare with.
+
+    Returns:
+      True if the records differ.
+    """
+    return not self == other
+
+
+class ObjectEntry(_Record):
+  """An object, or a common prefix, from a bucket listing.
+
+  Attributes:
+    name: The string object name, or the common prefix.
+    size: The integer size of the object in bytes, or None for a prefix.
+    etag: The string ETag of the object, without quotes, or None.
+    last_modified: The string last modified timestamp, or None.
+    is_prefix: True if the entry is a common prefix rather than an object.
+  """
+
+  __slots__ = ('name', 'size', 'etag', 'last_modified', 'is_prefix')
+
+  def __init__(self, name, size=None, etag=None, last_modified=None,
+               is_prefix=False):
+    """Inits ObjectEntry with the listing fields.
+
+    Args:
+      name: The string object name, or the common prefix.
+      size: The integer size of the object in bytes.
+      etag: The string ETag of the object, without quotes.
+      last_modified: The string last modified timestamp.
+      is_prefix: True if the entry is a common prefix.
+    """
+    self.name = name
+    self.size = size
+    self.etag = etag
+    self.last_modified = last_modified
+    self.is_prefix = is_prefix
+
+
+class BucketEntry(_Record):
+  """A bucket from the list of all buckets in a project.
+
+  Attributes:
+    name: The string bucket name.
+    creation_date: The string creation timestamp.
+  """
+
+  __slots__ = ('name', 'creation_date')
+
+  def __init__(self, name, creation_date=None):
+    """Inits BucketEntry with the listing fields.
+
+    Args:
+      name: The string bucket name.
+      creation_date: The string creation timestamp.
+    """
+    self.name = name
+    self.creation_date = creation_date
+
+
+class AclEntry(_Record):
+  """A single grant from an access control list.
+
+  Attributes:
+    scope_type: The string scope type, such as UserById or AllUsers.
+    scope_id: The string ID, email address or domain of the scope, or None
+        for scopes such as AllUsers.
+    scope_name: The string display name of the scope, or None.
+    permission: The string permission: READ, WRITE or FULL_CONTROL.
+  """
+
+  __slots__ = ('scope_type', 'scope_id', 'scope_name', 'permission')
+
+  def __init__(self, scope_type, permission, scope_id=None, scope_name=None):
+    """Inits AclEntry with the grant fields.
+
+    Args:
+      scope_type: The string scope type.
+      permission: The string permission.
+      scope_id: The string ID, email address or domain of the scope.
+      scope_name: The string display name of the scope.
+    """
+    self.scope_type = scope_type
+    self.permission = permission
+    self.scope_id = scope_id
+    self.scope_name = scope_name
+
+
+class CorsRule(_Record):
+  """A single rule from a bucket CORS configuration.
+
+  Attributes:
+    origins: A list of string origins.
+    methods: A list of string methods.
+    response_headers: A list of string response headers.
+    max_age_sec: The integer max age in seconds, or None.
+  """
+
+  __slots__ = ('origins', 'methods', 'response_headers', 'max_age_sec')
+
+  def __init__(self, origins, methods, response_headers, max_age_sec=None):
+    """Inits CorsRule with the rule fields.
+
+    Args:
+      origins: A list of string origins.
+      methods: A list of string methods.
+      response_headers: A list of string response headers.
+      max_age_sec: The integer max age in seconds.
+    """
+    self.origins = origins
+    self.methods = methods
+    self.response_headers = response_headers
+    self.max_age_sec = max_age_sec
@@ -16,18 +16,66 @@
 
 __author__ = 'kbrisbin@google.com (Kathryn Hurley)'
 
+import binascii
+import collections
+import cStringIO
+import httplib
+import logging
 import mimetypes
 import os
 import re
+import sys
+import time
+import urllib
 import xml.etree.ElementTree as xml
+import zlib
 
 import httplib2
 
 import gcs
+import gcs_checksum
 import gcs_error
+import gcs_hedge
+import gcs_metrics
+import gcs_parser
+import gcs_pool
+import gcs_resumable
+import gcs_retry
+import gcs_stream
+import gcs_sync
+import gcs_transport
 
 DEFAULT_VERSION = '2'
+PARTIAL_CONTENT = 206
+NOT_MODIFIED = 304
+RESUME_INCOMPLETE = 308
 NOT_FOUND = 404
+GONE = 410
+REQUESTED_RANGE_NOT_SATISFIABLE = 416
+MAX_COMPOSE_COMPONENTS = 32
+DEFAULT_PART_SIZE = 32 * 1024 * 1024
+PARALLEL_UPLOAD_PREFIX = '.gcs-parallel-upload'
+DEFAULT_SLICE_SIZE = 32 * 1024 * 1024
+OPERATION_SUBRESOURCES = ('acl', 'compose', 'cors', 'location')
+# Maps (method, resource, subresource) to the operation names used in metrics.
+OPERATION_NAMES = {
+    ('GET', 'service', ''): 'get_buckets',
+    ('GET', 'bucket', ''): 'list_objects',
+    ('GET', 'bucket', 'cors'): 'get_bucket_cors',
+    ('GET', 'bucket', 'location'): 'get_bucket_location',
+    ('PUT', 'bucket', ''): 'insert_bucket',
+    ('PUT', 'bucket', 'cors'): 'set_bucket_cors',
+    ('DELETE', 'bucket', ''): 'delete_bucket',
+    ('GET', 'object', ''): 'get_object',
+    ('GET', 'object', 'acl'): 'get_object_acls',
+    ('HEAD', 'object', ''): 'get_object_metadata',
+    ('PUT', 'object', ''): 'insert_object',
+    ('PUT', 'object', 'compose'): 'compose_object',
+    ('DELETE', 'object', ''): 'delete_object',
+}
+# Operations that download object bodies. These may be large, so they are
+# hedged only when the body is known to be small; see _get_body_size.
+BODY_OPERATIONS = ('get_object',)
 
 
 class GcsXml(gcs.Gcs):
@@ -35,19 +83,65 @@ class GcsXml(gcs.Gcs):
 
   Attributes:
     api_version: The version of the API.
+    transport: The gcs_transport.Transport that sends the requests.
+    body_cache: The gcs_body_cache.ObjectBodyCache used by get_object, or
+        None.
+    retry_policy: The gcs_retry.RetryPolicy applied to every request.
+    metrics: The gcs_metrics.Metrics recording every request.
+    hedge_policy: The gcs_hedge.HedgePolicy applied to reads, or None.
+    concurrency_limiter: The gcs_concurrency.ConcurrencyLimiter bounding the
+        requests in flight, or None.
+    rate_limiter: The gcs_ratelimit.WriteRateLimiter pacing object writes,
+        or None.
   """
 
-  def __init__(self, auth_http, project_id, api_version=DEFAULT_VERSION):
+  def __init__(self, auth_http, project_id, api_version=DEFAULT_VERSION,
+               transport=None, body_cache=None, retry_policy=None,
+               metrics=None, hedge_policy=None, concurrency_limiter=None,
+               rate_limiter=None):
     """Inits Gcs with credentials, project id, and API version.
 
     Args:
       auth_http: An authorized instance of httplib2.Http.
       project_id: The string project id of the Cloud Storage project.
       api_version: The version of the API.
+      transport: An optional gcs_transport.Transport that sends the requests.
+          Defaults to a gcs_transport.HttpTransport on auth_http, which runs
+          one request at a time; use a gcs_transport.PooledHttpTransport to
+          share the client between threads.
+      body_cache: An optional gcs_body_cache.ObjectBodyCache used by
+          get_object to revalidate local copies instead of downloading them.
+      retry_policy: An optional gcs_retry.RetryPolicy shared by every request
+          of the client. Defaults to gcs_retry.RetryPolicy().
+      metrics: An optional gcs_metrics.Metrics to record requests in, for
+          example one shared by several clients. Defaults to a new
+          gcs_metrics.Metrics.
+      hedge_policy: An optional gcs_hedge.HedgePolicy. If given, HEAD and
+          GET requests are sent a second time when they run slower than
+          most recent ones; object downloads only when the body is at most
+          its max_hedge_bytes. Hedging is off by default.
+      concurrency_limiter: An optional gcs_concurrency.ConcurrencyLimiter
+          that adapts the number of requests in flight to latency and
+          throttling. Bulk operations then start max_limit workers by
+          default and the limiter decides how many of them send at once.
+      rate_limiter: An optional gcs_ratelimit.WriteRateLimiter. If given,
+          insert_object, insert_object_stream and copy_object wait for the
+          write rates of their object and bucket, and a write still waiting
+          when a newer write to the same object arrives is dropped.
     """
     super(GcsXml, self).__init__(auth_http, project_id)
     self.api_version = api_version
     self._base_url = 'storage.googleapis.com'
+    if not transport: transport = gcs_transport.HttpTransport(auth_http)
+    self.transport = transport
+    self.body_cache = body_cache
+    if not retry_policy: retry_policy = gcs_retry.RetryPolicy()
+    self.retry_policy = retry_policy
+    if not metrics: metrics = gcs_metrics.Metrics()
+    self.metrics = metrics
+    self.hedge_policy = hedge_policy
+    self.concurrency_limiter = concurrency_limiter
+    self.rate_limiter = rate_limiter
 
   def get_buckets(self):
     """Get a list of Cloud Storage buckets.
@@ -64,6 +158,17 @@ class GcsXml(gcs.Gcs):
       raise
     return content
 
+  def list_buckets(self):
+    """Get the Cloud Storage buckets as parsed records.
+
+    Returns:
+      A list of gcs_types.BucketEntry instances.
+
+    Raises:
+      gcs_error.GcsError if the API request did not succeed.
+    """
+    return list(gcs_parser.iter_buckets(self.get_buckets()))
+
   def get_bucket(self, bucket_name):
     """Get the info for a specific bucket.
 
@@ -83,6 +188,53 @@ class GcsXml(gcs.Gcs):
       raise
     return content
 
+  def list_objects(self, bucket_name, prefix=None, delimiter=None,
+                   marker=None, max_keys=None):
+    """Lists the objects in a bucket, following every page of the listing.
+
+    Pages are fetched lazily as the generator is consumed, and each page is
+    parsed incrementally as it is consumed, so memory use depends neither on
+    the number of objects in the bucket nor on the size of a page.
+
+    Args:
+      bucket_name: String name of the bucket.
+      prefix: Only list objects whose names start with this string.
+      delimiter: Roll up names containing this string after the prefix into
+          common prefixes, like directories.
+      marker: Only list objects whose names sort after this string.
+      max_keys: The maximum number of entries requested per page.
+
+    Yields:
+      gcs_types.ObjectEntry instances, in the order of the listing. Common
+      prefixes have is_prefix set.
+
+    Raises:
+      gcs_error.GcsError if the API request did not succeed.
+    """
+    while True:
+      params = []
+      if prefix: params.append(('prefix', prefix))
+      if delimiter: params.append(('delimiter', delimiter))
+      if marker: params.append(('marker', marker))
+      if max_keys: params.append(('max-keys', max_keys))
+      url = '%s.%s' % (bucket_name, self._base_url)
+      if params:
+        # urlencode calls str on each value, which fails on non-ASCII
+        # unicode such as a marker parsed from a previous page.
+        url += '/?' + urllib.urlencode([
+            (name, value.encode('utf-8') if isinstance(value, unicode)
+             else value) for name, value in params])
+      try:
+        response, content = self._api_request(url)
+      except gcs_error.GcsError:
+        raise
+      page = gcs_parser.ObjectListing(content)
+      for entry in page:
+        yield entry
+      if not page.is_truncated or not page.last_name:
+        return
+      marker = page.next_marker or page.last_name
+
   def get_bucket_cors(self, bucket_name):
     """Get CORS for the specified bucket.
 
@@ -102,6 +254,20 @@ class GcsXml(gcs.Gcs):
       raise
     return content
 
+  def get_bucket_cors_rules(self, bucket_name):
+    """Get CORS for the specified bucket as parsed records.
+
+    Args:
+      bucket_name: String name of the bucket.
+
+    Returns:
+      A list of gcs_types.CorsRule instances.
+
+    Raises:
+      gcs_error.GcsError if the API request did not succeed.
+    """
+    return gcs_parser.parse_cors(self.get_bucket_cors(bucket_name))
+
   def get_bucket_location(self, bucket_name):
     """Get location of the specified bucket.
 
@@ -195,18 +361,36 @@ class GcsXml(gcs.Gcs):
       raise
     return content
 
-  def delete_bucket(self, bucket_name):
+  def delete_bucket(self, bucket_name, recursive=False, concurrency=None):
     """Deletes the given bucket.
 
     Args:
       bucket_name: The string name of the bucket to delete.
+      recursive: If True, delete every object in the bucket first.
+      concurrency: The number of objects deleted at once when recursive.
+          Defaults to gcs_pool.DEFAULT_CONCURRENCY.
 
     Returns:
       The string response from the API call.
 
     Raises:
-      gcs_error.GcsError if the API request did not succeed.
+      gcs_error.GcsError if the API request did not succeed, or if any object
+          could not be deleted.
     """
+    if recursive:
+      failures = 0
+      first_error = None
+      object_names = (entry.name for entry in self.list_objects(bucket_name))
+      for object_name, error in self.delete_objects(
+          bucket_name, object_names, concurrency):
+        if error:
+          logging.error('Could not delete %s: %s', object_name, error)
+          failures += 1
+          first_error = first_error or error
+      if first_error:
+        raise gcs_error.GcsError(
+            getattr(first_error, 'status', None),
+            '%d objects in %s could not be deleted.' % (failures, bucket_name))
     try:
       response, content = self._api_request(
           '%s.%s' % (bucket_name, self._base_url), 'DELETE')
@@ -214,26 +398,242 @@ class GcsXml(gcs.Gcs):
       raise
     return content
 
-  def get_object(self, bucket_name, object_name):
+  def get_object(self, bucket_name, object_name, decompress=False):
     """Gets an object in a Cloud Storage bucket.
 
+    If the client has a body_cache and holds a copy of the object, the request
+    carries If-None-Match with the cached ETag and a 304 reply is served from
+    the local copy. Downloaded content is checked against the x-goog-hash
+    checksums of the response.
+
     Args:
       bucket_name: String name of the bucket to set the cors on.
       object_name: The name of the object.
+      decompress: If True, ask for gzip-encoded objects in their compressed
+          form and inflate them locally, rather than having Cloud Storage
+          send them uncompressed.
 
     Returns:
       The object content.
 
     Raises:
       gcs_error.GcsError if the API request did not succeed.
+      gcs_error.GcsIntegrityError if the content does not match its checksums.
     """
+    url = '%s.%s/%s' % (bucket_name, self._base_url, object_name)
+    headers = {}
+    if decompress: headers['Accept-Encoding'] = 'gzip'
+    if not self.body_cache:
+      try:
+        response, content = self._api_request(url, headers=headers)
+      except gcs_error.GcsError:
+        raise
+      self._verify_content(response, content, bucket_name, object_name)
+      return self._decode_content(response, content)
+
+    etag, cached_content = self.body_cache.get(bucket_name, object_name)
+    size = None
+    if etag:
+      headers['If-None-Match'] = '"%s"' % etag
+      size = len(cached_content)
     try:
       response, content = self._api_request(
-          '%s.%s/%s' % (bucket_name, self._base_url, object_name))
-    except gcs_error.GcsError:
+          url, headers=headers, allowed_statuses=(NOT_MODIFIED,),
+          size_hint=size)
+    except gcs_error.GcsError, ge:
+      if ge.status == NOT_FOUND and etag:
+        self.body_cache.invalidate(bucket_name, object_name)
       raise
+    if response.status == NOT_MODIFIED:
+      self.body_cache.record_hit()
+      return cached_content
+    self._verify_content(response, content, bucket_name, object_name)
+    content = self._decode_content(response, content)
+    if etag: self.body_cache.record_miss()
+    new_etag = response.get('etag')
+    if new_etag:
+      self.body_cache.put(bucket_name, object_name, new_etag.strip('"'),
+                          content)
     return content
 
+  def download_object(self, bucket_name, object_name, sink, buffer_size=None,
+                      decompress=False, range_size=None):
+    """Streams an object in a Cloud Storage bucket to a sink.
+
+    The object is fetched with a series of Range requests of at most
+    range_size bytes. Each response is written to the sink as it arrives, in
+    pieces of at most buffer_size bytes. The transport holds one response at
+    a time, so memory use is bounded by range_size rather than the object
+    size, while large ranges keep the number of round trips low. Later
+    ranges are
+    made conditional on the ETag of the first so that an object replaced
+    mid-download fails instead of producing a mix of both versions. The bytes
+    are hashed as they are written and checked against the x-goog-hash
+    checksums once the whole object has arrived.
+
+    With decompress, gzip-encoded objects are fetched compressed and inflated
+    as each range arrives. A transport that decodes content itself cannot
+    return a compressed range, so with one the object is fetched with a
+    single request instead, and held in memory whole.
+
+    Args:
+      bucket_name: String name of the bucket.
+      object_name: The name of the object.
+      sink: A string local file path, a file-like object with a write method,
+          or a callable that accepts each chunk as a string.
+      buffer_size: The maximum number of bytes written to the sink at once.
+          Defaults to gcs_stream.DEFAULT_CHUNK_SIZE.
+      decompress: If True, transfer gzip-encoded objects compressed and write
+          them to the sink uncompressed.
+      range_size: The maximum number of bytes fetched by each request.
+          Defaults to gcs_stream.DEFAULT_RANGE_SIZE.
+
+    Returns:
+      The number of bytes written to the sink.
+
+    Raises:
+      gcs_error.GcsError if the API request did not succeed.
+      gcs_error.GcsIntegrityError if the bytes do not match their checksums.
+    """
+    if not buffer_size: buffer_size = gcs_stream.DEFAULT_CHUNK_SIZE
+    if not range_size: range_size = gcs_stream.DEFAULT_RANGE_SIZE
+    url = '%s.%s/%s' % (bucket_name, self._base_url, object_name)
+    out = gcs_stream.Sink(sink)
+    if decompress and self.transport.decodes_content:
+      try:
+        out.write(self.get_object(bucket_name, object_name, decompress=True))
+      finally:
+        out.close()
+      return out.bytes_written
+
+    hasher = gcs_checksum.StreamHasher()
+    inflater = None
+    response = None
+    etag = None
+    try:
+      offset = 0
+      total = None
+      while total is None or offset < total:
+        headers = {'Range': 'bytes=%d-%d' % (offset, offset + range_size - 1)}
+        if decompress: headers['Accept-Encoding'] = 'gzip'
+        if etag: headers['If-Match'] = etag
+        try:
+          response, content = self._api_request(url, headers=headers)
+        except gcs_error.GcsError, ge:
+          if ge.status != REQUESTED_RANGE_NOT_SATISFIABLE:
+            raise
+          if offset == 0:
+            response = None
+            break
+          # The previous range ended exactly at an unreported total size.
+          if total is None:
+            break
+          raise
+        if (decompress and not offset and
+            response.get('content-encoding') == 'gzip'):
+          inflater = zlib.decompressobj(gcs_stream.GZIP_WBITS)
+        offset = self._write_body(out, content, offset, buffer_size, hasher,
+                                  inflater)
+        if response.status != PARTIAL_CONTENT or not content:
+          break
+        etag = response.get('etag')
+        first, last, total = gcs_stream.parse_content_range(
+            response['content-range'])
+        # Without a total size, a range shorter than requested is the last.
+        if total is None and len(content) < range_size:
+          break
+      if inflater: out.write(inflater.flush())
+    finally:
+      out.close()
+    if response:
+      hasher.verify(response, '%s/%s' % (bucket_name, object_name))
+    return out.bytes_written
+
+  def download_object_sliced(self, bucket_name, object_name, file_path,
+                             slice_size=None, concurrency=None,
+                             buffer_size=None):
+    """Downloads an object to a local file with concurrent Range requests.
+
+    The object size is read with get_object_metadata and the local file is
+    preallocated. The object is then split into slices of slice_size bytes,
+    which are fetched concurrently and written at their offsets in the file,
+    each through its own file handle. Each range request is retried under
+    the client's retry policy and budget. If the server ignores Range the
+    object is written from the single response instead, in pieces of
+    buffer_size bytes, and checked against the object checksums. Slices
+    arrive out of order, so unlike download_object the bytes of a sliced
+    download are not checked.
+
+    For the slices to actually download in parallel the client needs a
+    thread-safe transport such as gcs_transport.PooledHttpTransport.
+
+    Args:
+      bucket_name: String name of the bucket.
+      object_name: The name of the object.
+      file_path: The local file path to write to.
+      slice_size: The number of bytes in each slice. Defaults to
+          DEFAULT_SLICE_SIZE.
+      concurrency: The number of slices downloaded at once. Defaults to
+          gcs_pool.DEFAULT_CONCURRENCY, or the max_limit of the
+          concurrency limiter.
+      buffer_size: The maximum number of bytes each slice holds in memory at
+          once. Defaults to gcs_stream.DEFAULT_CHUNK_SIZE.
+
+    Returns:
+      The number of bytes written to the file.
+
+    Raises:
+      gcs_error.GcsError if the API request did not succeed.
+    """
+    if not slice_size: slice_size = DEFAULT_SLICE_SIZE
+    concurrency = self._get_pool_size(concurrency)
+    if not buffer_size: buffer_size = gcs_stream.DEFAULT_CHUNK_SIZE
+    metadata = self.get_object_metadata(bucket_name, object_name)
+    size = int(metadata['content-length'])
+    etag = metadata.get('etag')
+    if size <= slice_size:
+      return self.download_object(
+          bucket_name, object_name, file_path, buffer_size)
+
+    url = '%s.%s/%s' % (bucket_name, self._base_url, object_name)
+    headers = {'Range': 'bytes=0-%d' % (min(buffer_size, size) - 1)}
+    if etag: headers['If-Match'] = etag
+    try:
+      response, content = self._api_request(url, headers=headers)
+    except gcs_error.GcsError:
+      raise
+    if response.status != PARTIAL_CONTENT:
+      logging.info('Range requests not supported, downloaded in one request.')
+      hasher = gcs_checksum.StreamHasher()
+      out = gcs_stream.Sink(file_path)
+      try:
+        self._write_body(out, content, 0, buffer_size, hasher)
+      finally:
+        out.close()
+      hasher.verify(response, '%s/%s' % (bucket_name, object_name))
+      return out.bytes_written
+
+    out_file = open(file_path, 'wb')
+    try:
+      out_file.write(content)
+      out_file.truncate(size)
+    finally:
+      out_file.close()
+    slices = []
+    for start in range(0, size, slice_size):
+      slices.append((max(start, len(content)), min(start + slice_size, size)))
+    slices = [(start, end) for start, end in slices if start < end]
+
+    def download_slice(byte_range):
+      self._download_slice(url, file_path, byte_range[0], byte_range[1], etag,
+                           buffer_size)
+
+    for byte_range, result, error in gcs_pool.imap_unordered(
+        download_slice, slices, concurrency):
+      if error:
+        raise error
+    return size
+
   def get_object_acls(self, bucket_name, object_name):
     """Gets an object's ACLs in a Cloud Storage bucket.
 
@@ -254,6 +654,21 @@ class GcsXml(gcs.Gcs):
       raise
     return content
 
+  def get_object_acl_entries(self, bucket_name, object_name):
+    """Gets an object's ACLs in a Cloud Storage bucket as parsed records.
+
+    Args:
+      bucket_name: String name of the bucket.
+      object_name: The name of the object.
+
+    Returns:
+      A list of gcs_types.AclEntry instances.
+
+    Raises:
+      gcs_error.GcsError if the API request did not succeed.
+    """
+    return gcs_parser.parse_acl(self.get_object_acls(bucket_name, object_name))
+
   def get_object_metadata(self, bucket_name, object_name):
     """Gets an object's ACLs in a Cloud Storage bucket.
 
@@ -275,7 +690,8 @@ class GcsXml(gcs.Gcs):
     return response
 
   def insert_object(self, bucket_name, file_path=None, object_name=None,
-                    content_type=None, content_encoding=None, acl=None):
+                    content_type=None, content_encoding=None, acl=None,
+                    content_md5=None, compress=False):
     """Insert an object into a Cloud Storage bucket.
 
     Args:
@@ -290,32 +706,335 @@ class GcsXml(gcs.Gcs):
       acl: A string predefined Google ACL, as defined here:
           developers.google.com/storage/docs/reference-headers#xgoogacl.
           Defaults to private.
+      content_md5: The hex MD5 digest of the data, if already known. It is
+          sent as Content-MD5 so that Cloud Storage rejects a corrupted
+          upload. Either way the data is hashed while it is sent and checked
+          against the checksums Cloud Storage reports.
+      compress: If True, gzip the file while it is sent and store it with
+          Content-Encoding: gzip. The compressed size is not known in
+          advance, so the file is sent over a resumable upload session and
+          content_md5, which describes the uncompressed file, is not sent.
+          Files that mimetypes already identifies as gzip are sent as they
+          are.
 
     Returns:
       The string response from the API call.
 
     Raises:
       gcs_error.GcsError if the API request did not succeed.
+      gcs_error.GcsIntegrityError if the upload does not match its checksums.
+          The corrupt object is deleted first.
+      gcs_error.GcsWriteSupersededError if a newer write to the object
+          arrived before this one was sent.
     """
-    upload_file = open(file_path, 'r')
-    upload_file_contents = upload_file.read()
     if not object_name: object_name = os.path.basename(file_path)
     if not content_type or not content_encoding:
       guess_type, guess_encoding = mimetypes.guess_type(file_path)
       if not content_type: content_type = guess_type
       if not content_encoding: content_encoding = guess_encoding
-    headers = {}
-    if content_type: headers['Content-Type'] = content_type
-    if content_encoding: headers['Content-Encoding'] = content_encoding
-    if acl: headers['x-goog-acl'] = acl
+    if compress and content_encoding == 'gzip':
+      compress = False
+    upload_file = open(file_path, 'rb')
     try:
-      response, content = self._api_request(
-          '%s.%s/%s' % (bucket_name, self._base_url, object_name), 'PUT',
-          headers=headers, body=upload_file_contents)
+      return self.insert_object_stream(
+          bucket_name, upload_file, object_name,
+          size=os.fstat(upload_file.fileno()).st_size,
+          content_type=content_type, content_encoding=content_encoding,
+          acl=acl, content_md5=content_md5, compress=compress)
+    finally:
+      upload_file.close()
+
+  def insert_object_stream(self, bucket_name, stream, object_name, size=None,
+                           content_type=None, content_encoding=None, acl=None,
+                           chunk_size=None, content_md5=None, compress=False):
+    """Insert an object into a Cloud Storage bucket from a stream.
+
+    The body is sent in chunks of at most chunk_size bytes, so memory use does
+    not grow with the size of the object.
+
+    Args:
+      bucket_name: The name of the bucket to insert.
+      stream: A file-like object with a read method, or an iterable of
+          strings.
+      object_name: The string name for the object.
+      size: The number of bytes to upload. Required unless the stream is a
+          seekable file-like object, in which case it defaults to the bytes
+          remaining in the stream, or compress is True, in which case the
+          whole stream is read.
+      content_type: An optional content type string value for the Content-Type
+          header. Defaults to using python mimetype.guess_type on the object
+          name.
+      content_encoding: An optional encoding string value for the
+          Content-Encoding header. Defaults to using python mimetype.guess_type
+          on the object name.
+      acl: A string predefined Google ACL, as defined here:
+          developers.google.com/storage/docs/reference-headers#xgoogacl.
+          Defaults to private.
+      chunk_size: The maximum number of bytes read from the stream at once.
+          Defaults to gcs_stream.DEFAULT_CHUNK_SIZE.
+      content_md5: The hex MD5 digest of the data, if already known. It is
+          sent as Content-MD5 so that Cloud Storage rejects a corrupted
+          upload. Either way the data is hashed while it is sent and checked
+          against the checksums Cloud Storage reports.
+      compress: If True, gzip the data while it is sent and store it with
+          Content-Encoding: gzip. The compressed size is not known in
+          advance, so the data is sent over a resumable upload session and
+          content_md5, which describes the uncompressed data, is not sent.
+
+    Returns:
+      The string response from the API call.
+
+    Raises:
+      gcs_error.GcsError if the API request did not succeed.
+      gcs_error.GcsIntegrityError if the upload does not match its checksums.
+          The corrupt object is deleted first.
+      gcs_error.GcsWriteSupersededError if a newer write to the object
+          arrived before this one was sent.
+      ValueError if the size of the stream cannot be determined, or if
+          compress is combined with another content_encoding.
+    """
+    if not chunk_size: chunk_size = gcs_stream.DEFAULT_CHUNK_SIZE
+    if compress:
+      if content_encoding not in (None, 'gzip'):
+        raise ValueError('Cannot gzip an upload with Content-Encoding %s.'
+                         % content_encoding)
+      headers = self._get_object_headers(
+          object_name, content_type, 'gzip', acl)
+      return self._write_object(
+          bucket_name, object_name, lambda: self._insert_object_unsized(
+              bucket_name, object_name,
+              gcs_stream.GzipReader(stream, size, chunk_size), headers))
+    if size is None and hasattr(stream, 'read'):
+      size = gcs_stream.get_stream_size(stream)
+    if size is None:
+      raise ValueError('The size of the upload stream must be provided.')
+    headers = self._get_object_headers(
+        object_name, content_type, content_encoding, acl)
+    if content_md5:
+      headers['Content-MD5'] = gcs_checksum.md5_hex_to_base64(content_md5)
+    hasher = gcs_checksum.StreamHasher()
+    body = gcs_stream.ChunkedReader(stream, size, chunk_size, hasher)
+    try:
+      response, content = self._write_object(
+          bucket_name, object_name, lambda: self._api_request(
+              '%s.%s/%s' % (bucket_name, self._base_url, object_name), 'PUT',
+              headers=headers, body=body))
     except gcs_error.GcsError:
       raise
+    self._verify_upload(hasher, response, bucket_name, object_name)
     return content
 
+  def insert_object_resumable(self, bucket_name, file_path, object_name=None,
+                              content_type=None, content_encoding=None,
+                              acl=None, chunk_size=None, state_path=None):
+    """Insert an object into a Cloud Storage bucket with a resumable upload.
+
+    The file is sent in chunks over a resumable upload session. After each
+    acknowledged chunk the session URI and committed offset are saved to
+    state_path, so calling this method again after a failure, even from a new
+    process, continues from the last committed byte. The state file is
+    removed once the upload completes. When the whole file is sent by one
+    call, it is hashed as it is sent and checked against the checksums of the
+    completed object.
+
+    Args:
+      bucket_name: The name of the bucket to insert.
+      file_path: The local file path to the file to upload.
+      object_name: An optional string name for the object. Defaults to the file
+          name.
+      content_type: An optional content type string value for the Content-Type
+          header. Defaults to using python mimetype.guess_type.
+      content_encoding: An optional encoding string value for the
+          Content-Encoding header. Defaults to using python mimetype.guess_type.
+      acl: A string predefined Google ACL, as defined here:
+          developers.google.com/storage/docs/reference-headers#xgoogacl.
+          Defaults to private.
+      chunk_size: The number of bytes sent per request, a multiple of 256 KiB.
+          Defaults to gcs_resumable.DEFAULT_CHUNK_SIZE.
+      state_path: The local path of the checkpoint file. Defaults to the file
+          path with gcs_resumable.STATE_FILE_SUFFIX appended.
+
+    Returns:
+      The string response from the API call.
+
+    Raises:
+      gcs_error.GcsError if the API request did not succeed.
+      gcs_error.GcsIntegrityError if the upload does not match its checksums.
+          The corrupt object is deleted first.
+      ValueError if chunk_size is not a multiple of 256 KiB.
+    """
+    if not chunk_size: chunk_size = gcs_resumable.DEFAULT_CHUNK_SIZE
+    if chunk_size % gcs_resumable.CHUNK_MULTIPLE:
+      raise ValueError('Resumable upload chunks must be a multiple of %d bytes.'
+                       % gcs_resumable.CHUNK_MULTIPLE)
+    if not object_name: object_name = os.path.basename(file_path)
+    if not state_path: state_path = file_path + gcs_resumable.STATE_FILE_SUFFIX
+    if not content_type or not content_encoding:
+      guess_type, guess_encoding = mimetypes.guess_type(file_path)
+      if not content_type: content_type = guess_type
+      if not content_encoding: content_encoding = guess_encoding
+    file_stat = os.stat(file_path)
+    size = file_stat.st_size
+
+    state = gcs_resumable.UploadState.load(state_path)
+    if state and not state.matches(
+        bucket_name, object_name, size, file_stat.st_mtime):
+      logging.info('Upload state %s is for another upload, restarting.',
+                   state_path)
+      state = None
+    if state:
+      try:
+        response, content = self._put_resumable_chunk(
+            state.session_uri, None, 0, 0, size)
+      except gcs_error.GcsError, ge:
+        if ge.status not in (NOT_FOUND, GONE):
+          raise
+        logging.info('Upload session in %s expired, restarting.', state_path)
+        state = None
+      else:
+        if response.status != RESUME_INCOMPLETE:
+          state.delete()
+          return content
+        state.offset = self._get_committed_offset(response)
+    if not state:
+      headers = self._get_object_headers(
+          object_name, content_type, content_encoding, acl)
+      headers['x-goog-resumable'] = 'start'
+      try:
+        response, content = self._api_request(
+            '%s.%s/%s' % (bucket_name, self._base_url, object_name), 'POST',
+            headers=headers)
+      except gcs_error.GcsError:
+        raise
+      state = gcs_resumable.UploadState(
+          state_path, re.sub(r'^https?://', '', response['location']),
+          bucket_name, object_name, size, file_stat.st_mtime)
+      state.save()
+
+    hasher = gcs_checksum.StreamHasher()
+    upload_file = open(file_path, 'rb')
+    try:
+      while True:
+        upload_file.seek(state.offset)
+        length = min(chunk_size, size - state.offset)
+        response, content = self._put_resumable_chunk(
+            state.session_uri, upload_file, state.offset, length, size, hasher)
+        if response.status != RESUME_INCOMPLETE:
+          break
+        state.offset = self._get_committed_offset(response)
+        state.save()
+    finally:
+      upload_file.close()
+    state.delete()
+    self._verify_upload(hasher, response, bucket_name, object_name)
+    return content
+
+  def insert_object_parallel(self, bucket_name, file_path, object_name=None,
+                             content_type=None, content_encoding=None,
+                             acl=None, part_size=None, concurrency=None):
+    """Insert an object into a Cloud Storage bucket with parallel uploads.
+
+    The file is split into byte ranges of part_size bytes, which are uploaded
+    concurrently as temporary component objects. The components are then
+    joined with server-side compose requests and deleted, also when the
+    upload fails. Files no larger than part_size are sent with a single
+    insert_object call.
+
+    For the uploads to actually run in parallel the client needs a
+    thread-safe transport such as gcs_transport.PooledHttpTransport.
+
+    Args:
+      bucket_name: The name of the bucket to insert.
+      file_path: The local file path to the file to upload.
+      object_name: An optional string name for the object. Defaults to the file
+          name.
+      content_type: An optional content type string value for the Content-Type
+          header. Defaults to using python mimetype.guess_type.
+      content_encoding: An optional encoding string value for the
+          Content-Encoding header. Defaults to using python mimetype.guess_type.
+      acl: A string predefined Google ACL, as defined here:
+          developers.google.com/storage/docs/reference-headers#xgoogacl.
+          Defaults to private.
+      part_size: The number of bytes in each component. Defaults to
+          DEFAULT_PART_SIZE.
+      concurrency: The number of components uploaded at once. Defaults to
+          gcs_pool.DEFAULT_CONCURRENCY, or the max_limit of the
+          concurrency limiter.
+
+    Returns:
+      The string response from the final compose request.
+
+    Raises:
+      gcs_error.GcsError if the API request did not succeed.
+    """
+    if not part_size: part_size = DEFAULT_PART_SIZE
+    concurrency = self._get_pool_size(concurrency)
+    if not object_name: object_name = os.path.basename(file_path)
+    if not content_type or not content_encoding:
+      guess_type, guess_encoding = mimetypes.guess_type(file_path)
+      if not content_type: content_type = guess_type
+      if not content_encoding: content_encoding = guess_encoding
+    size = os.path.getsize(file_path)
+    if size <= part_size:
+      return self.insert_object(bucket_name, file_path, object_name,
+                                content_type, content_encoding, acl)
+
+    upload_id = binascii.hexlify(os.urandom(8))
+    parts = []
+    for index, offset in enumerate(range(0, size, part_size)):
+      part_name = '%s/%s/%s/%05d' % (
+          PARALLEL_UPLOAD_PREFIX, upload_id, object_name, index)
+      parts.append((part_name, offset, min(part_size, size - offset)))
+
+    def upload_part(part):
+      part_name, offset, length = part
+      part_file = open(file_path, 'rb')
+      try:
+        part_file.seek(offset)
+        self.insert_object_stream(bucket_name, part_file, part_name, length,
+                                  'application/octet-stream')
+      finally:
+        part_file.close()
+
+    def delete_temporary(name):
+      try:
+        self.delete_object(bucket_name, name)
+      except gcs_error.GcsError, ge:
+        if ge.status != NOT_FOUND:
+          raise
+
+    # Every planned name is deleted afterwards, created or not, so that parts
+    # still in flight when another part fails are cleaned up too.
+    temporary_names = [part[0] for part in parts]
+    try:
+      gcs_pool.run_all(upload_part, parts, concurrency)
+      component_names = [part[0] for part in parts]
+      level = 0
+      while len(component_names) > MAX_COMPOSE_COMPONENTS:
+        groups = []
+        for start in range(0, len(component_names), MAX_COMPOSE_COMPONENTS):
+          groups.append((
+              '%s/%s/%s/compose-%d-%05d' % (
+                  PARALLEL_UPLOAD_PREFIX, upload_id, object_name, level,
+                  start // MAX_COMPOSE_COMPONENTS),
+              component_names[start:start + MAX_COMPOSE_COMPONENTS]))
+        temporary_names.extend(group[0] for group in groups)
+        gcs_pool.run_all(
+            lambda group: self._compose_object(bucket_name, *group),
+            groups, concurrency)
+        component_names = [group[0] for group in groups]
+        level += 1
+      headers = self._get_object_headers(
+          object_name, content_type, content_encoding, acl)
+      return self._compose_object(
+          bucket_name, object_name, component_names, headers)
+    finally:
+      for name, result, error in gcs_pool.imap_unordered(
+          delete_temporary, temporary_names, concurrency):
+        if error:
+          logging.warning('Could not delete temporary object %s: %s',
+                          name, error)
+
   def copy_object(self, original_bucket_name, original_object_name,
                   new_bucket_name, new_object_name=None, acl=None):
     """Copy an existing Cloud Storage object.
@@ -334,6 +1053,8 @@ class GcsXml(gcs.Gcs):
 
     Raises:
       gcs_error.GcsError if the API request did not succeed.
+      gcs_error.GcsWriteSupersededError if a newer write to the new object
+          arrived before this one was sent.
     """
     copy_source = '/%s/%s' % (original_bucket_name, original_object_name)
     headers = {
@@ -341,16 +1062,107 @@ class GcsXml(gcs.Gcs):
     }
     if acl: headers['x-goog-acl'] = acl
     if not new_object_name: new_object_name = original_object_name
-    print '%s.%s/%s' % (new_bucket_name, self._base_url, new_object_name)
     try:
-      response, content = self._api_request(
-          '%s.%s/%s' % (new_bucket_name, self._base_url, new_object_name),
-          'PUT',
-          headers=headers)
+      response, content = self._write_object(
+          new_bucket_name, new_object_name, lambda: self._api_request(
+              '%s.%s/%s' % (new_bucket_name, self._base_url, new_object_name),
+              'PUT',
+              headers=headers))
     except gcs_error.GcsError:
       raise
     return content
 
+  def delete_objects(self, bucket_name, object_names, concurrency=None):
+    """Delete many objects from a Cloud Storage bucket concurrently.
+
+    Names are consumed lazily, so object_names can be a generator over a very
+    large listing. An object that no longer exists counts as deleted.
+
+    Args:
+      bucket_name: The name of the bucket.
+      object_names: An iterable of string object names.
+      concurrency: The number of objects deleted at once. Defaults to
+          gcs_pool.DEFAULT_CONCURRENCY, or the max_limit of the
+          concurrency limiter.
+
+    Yields:
+      (object_name, error) tuples in completion order. error is None if the
+      object was deleted, otherwise the exception raised.
+    """
+    concurrency = self._get_pool_size(concurrency)
+    for object_name, result, error in gcs_pool.imap_unordered(
+        lambda object_name: self.delete_object(bucket_name, object_name),
+        object_names, concurrency):
+      if isinstance(error, gcs_error.GcsError) and error.status == NOT_FOUND:
+        error = None
+      yield object_name, error
+
+  def copy_prefix(self, bucket_name, prefix, new_bucket_name,
+                  new_prefix=None, marker=None, acl=None, concurrency=None):
+    """Copies every object under a prefix with server-side copies.
+
+    The source listing is streamed and the copies run concurrently, so
+    memory use does not depend on the number of objects. A failed copy is
+    reported and the others carry on.
+
+    Args:
+      bucket_name: The name of the source bucket.
+      prefix: The string prefix of the source object names, or '' for the
+          whole bucket.
+      new_bucket_name: The name of the destination bucket.
+      new_prefix: The string prefix that replaces prefix in the destination
+          object names. Defaults to prefix.
+      marker: Only copy objects whose names sort after this string, such as
+          a marker yielded by an earlier, interrupted call.
+      acl: A string predefined Google ACL for the copies.
+      concurrency: The number of objects copied at once. Defaults to
+          gcs_pool.DEFAULT_CONCURRENCY, or the max_limit of the
+          concurrency limiter.
+
+    Yields:
+      (object_name, error, marker) tuples in completion order. object_name
+      is the source name and error is None if the copy succeeded, otherwise
+      the exception raised. marker is the resume marker: every object up to
+      and including it has been processed.
+
+    Raises:
+      ValueError if the destination lies inside the source prefix.
+    """
+    return self._copy_prefix(bucket_name, prefix, new_bucket_name,
+                             new_prefix, marker, acl, concurrency, False)
+
+  def move_prefix(self, bucket_name, prefix, new_bucket_name,
+                  new_prefix=None, marker=None, acl=None, concurrency=None):
+    """Moves every object under a prefix with server-side copies.
+
+    Works like copy_prefix, except that each source object is deleted as
+    soon as its copy has succeeded. A source object that no longer exists
+    counts as deleted. Running the move again after a failure retries the
+    objects that are still under the prefix.
+
+    Args:
+      bucket_name: The name of the source bucket.
+      prefix: The string prefix of the source object names, or '' for the
+          whole bucket.
+      new_bucket_name: The name of the destination bucket.
+      new_prefix: The string prefix that replaces prefix in the destination
+          object names. Defaults to prefix.
+      marker: Only move objects whose names sort after this string.
+      acl: A string predefined Google ACL for the copies.
+      concurrency: The number of objects moved at once. Defaults to
+          gcs_pool.DEFAULT_CONCURRENCY, or the max_limit of the
+          concurrency limiter.
+
+    Yields:
+      (object_name, error, marker) tuples in completion order, as for
+      copy_prefix. error is set if either the copy or the delete failed.
+
+    Raises:
+      ValueError if the destination lies inside the source prefix.
+    """
+    return self._copy_prefix(bucket_name, prefix, new_bucket_name,
+                             new_prefix, marker, acl, concurrency, True)
+
   def delete_object(self, bucket_name, object_name):
     """Delete an existing Cloud Storage object.
 
@@ -371,6 +1183,468 @@ class GcsXml(gcs.Gcs):
       raise
     return content
 
+  def sync_directory(self, bucket_name, directory, prefix=None,
+                     download=False, delete=False, concurrency=None):
+    """Makes a bucket and a local directory hold the same files.
+
+    The bucket listing is streamed and compared with the local tree. Files
+    whose sizes differ are transferred; files of equal size are compared by
+    MD5, taken from the object ETag, or from x-goog-hash for objects whose
+    ETag is not a digest. Local digests are cached in a gcs_sync.SyncManifest
+    in the directory, so a rerun over an unchanged tree reads no file data
+    and moves no object data. An object without any MD5 digest, such as a
+    composite object, is considered unchanged when its size matches.
+
+    Args:
+      bucket_name: The name of the bucket.
+      directory: The string path of the local directory.
+      prefix: An optional object name prefix that maps to the directory, such
+          as 'backups/'.
+      download: If True, copy the bucket to the directory. Otherwise copy the
+          directory to the bucket.
+      delete: If True, also delete the objects, or when downloading the local
+          files, that do not exist on the source side.
+      concurrency: The number of files transferred at once. Defaults to
+          gcs_pool.DEFAULT_CONCURRENCY, or the max_limit of the
+          concurrency limiter.
+
+    Returns:
+      A dictionary with the uploaded, downloaded, deleted and unchanged
+      counts.
+
+    Raises:
+      gcs_error.GcsError if the listing failed, or if any file could not be
+          synced.
+    """
+    if not prefix: prefix = ''
+    concurrency = self._get_pool_size(concurrency)
+    if not os.path.isdir(directory): os.makedirs(directory)
+    manifest = gcs_sync.SyncManifest(
+        os.path.join(directory, gcs_sync.MANIFEST_FILE))
+    local_files = {}
+    for relative_path, size, mtime in gcs_sync.iter_local_files(directory):
+      local_files[relative_path] = (size, mtime)
+
+    def get_actions():
+      for entry in self.list_objects(bucket_name, prefix=prefix):
+        relative_path = entry.name[len(prefix):]
+        if not relative_path or relative_path.endswith('/'):
+          continue
+        local_file = local_files.pop(relative_path, None)
+        if local_file:
+          yield relative_path, local_file, entry
+        elif download or delete:
+          yield relative_path, None, entry
+      if not download or delete:
+        for relative_path, local_file in local_files.iteritems():
+          yield relative_path, local_file, None
+
+    def sync_file(action):
+      relative_path, local_file, entry = action
+      file_path = os.path.join(directory, *relative_path.split('/'))
+      object_name = prefix + relative_path
+      if not entry:
+        if download:
+          os.remove(file_path)
+          manifest.remove(relative_path)
+          return 'deleted'
+        size, mtime = local_file
+        self.insert_object(
+            bucket_name, file_path, object_name, content_md5=manifest.get_md5(
+                relative_path, file_path, size, mtime))
+        return 'uploaded'
+      if not local_file:
+        if not download:
+          self.delete_object(bucket_name, object_name)
+          return 'deleted'
+        self._download_sync_file(bucket_name, object_name, file_path,
+                                 relative_path, entry, manifest)
+        return 'downloaded'
+      size, mtime = local_file
+      if size == entry.size:
+        remote_md5 = gcs_sync.get_etag_md5(entry.etag)
+        if not remote_md5:
+          remote_md5 = gcs_sync.get_hash_header_md5(self.get_object_metadata(
+              bucket_name, object_name).get('x-goog-hash'))
+        if (not remote_md5 or remote_md5 ==
+            manifest.get_md5(relative_path, file_path, size, mtime)):
+          return 'unchanged'
+      if download:
+        self._download_sync_file(bucket_name, object_name, file_path,
+                                 relative_path, entry, manifest)
+        return 'downloaded'
+      self.insert_object(
+          bucket_name, file_path, object_name, content_md5=manifest.get_md5(
+              relative_path, file_path, size, mtime))
+      return 'uploaded'
+
+    counts = {'uploaded': 0, 'downloaded': 0, 'deleted': 0, 'unchanged': 0}
+    failures = 0
+    first_error = None
+    try:
+      for action, result, error in gcs_pool.imap_unordered(
+          sync_file, get_actions(), concurrency):
+        if error:
+          logging.error('Could not sync %s: %s', action[0], error)
+          failures += 1
+          first_error = first_error or error
+        else:
+          counts[result] += 1
+    finally:
+      manifest.save()
+    if first_error:
+      raise gcs_error.GcsError(
+          getattr(first_error, 'status', None),
+          '%d files in %s could not be synced.' % (failures, directory))
+    return counts
+
+  def _get_object_headers(self, object_name, content_type=None,
+                          content_encoding=None, acl=None):
+    """Create the headers for an object upload request.
+
+    Args:
+      object_name: The string name of the object.
+      content_type: An optional content type string. Defaults to using python
+          mimetype.guess_type on the object name.
+      content_encoding: An optional encoding string. Defaults to using python
+          mimetype.guess_type on the object name.
+      acl: An optional string predefined Google ACL.
+
+    Returns:
+      A dictionary of request headers.
+    """
+    if not content_type or not content_encoding:
+      guess_type, guess_encoding = mimetypes.guess_type(object_name)
+      if not content_type: content_type = guess_type
+      if not content_encoding: content_encoding = guess_encoding
+    headers = {}
+    if content_type: headers['Content-Type'] = content_type
+    if content_encoding: headers['Content-Encoding'] = content_encoding
+    if acl: headers['x-goog-acl'] = acl
+    return headers
+
+  def _insert_object_unsized(self, bucket_name, object_name, chunks, headers):
+    """Uploads data whose size is not known in advance.
+
+    The data is sent over a resumable upload session in chunks of
+    gcs_resumable.DEFAULT_CHUNK_SIZE bytes, the total size being given with
+    the final chunk. Only the chunk in flight is held in memory.
+
+    Args:
+      bucket_name: The name of the bucket to insert.
+      object_name: The string name for the object.
+      chunks: An iterable of strings.
+      headers: The object headers for the new object.
+
+    Returns:
+      The string response from the API call.
+
+    Raises:
+      gcs_error.GcsError if the API request did not succeed.
+      gcs_error.GcsIntegrityError if the upload does not match its checksums.
+          The corrupt object is deleted first.
+    """
+    headers = dict(headers)
+    headers['x-goog-resumable'] = 'start'
+    try:
+      response, content = self._api_request(
+          '%s.%s/%s' % (bucket_name, self._base_url, object_name), 'POST',
+          headers=headers)
+    except gcs_error.GcsError:
+      raise
+    session_uri = re.sub(r'^https?://', '', response['location'])
+    chunk_size = gcs_resumable.DEFAULT_CHUNK_SIZE
+    hasher = gcs_checksum.StreamHasher()
+    chunks = iter(chunks)
+    exhausted = False
+    offset = 0
+    pending = ''
+    while True:
+      parts = [pending]
+      buffered = len(pending)
+      while not exhausted and buffered < chunk_size:
+        try:
+          data = next(chunks)
+        except StopIteration:
+          exhausted = True
+          break
+        parts.append(data)
+        buffered += len(data)
+      pending = ''.join(parts)
+      size = None
+      length = chunk_size
+      if exhausted:
+        length = len(pending)
+        size = offset + length
+      response, content = self._put_resumable_chunk(
+          session_uri, cStringIO.StringIO(pending[:length]), offset, length,
+          size, hasher)
+      if response.status != RESUME_INCOMPLETE:
+        break
+      committed = self._get_committed_offset(response)
+      pending = pending[committed - offset:]
+      offset = committed
+    self._verify_upload(hasher, response, bucket_name, object_name)
+    return content
+
+  def _put_resumable_chunk(self, session_uri, stream, offset, length, size,
+                           hasher=None):
+    """Sends one chunk of a resumable upload session.
+
+    A zero length chunk asks the server how many bytes it has committed.
+
+    Args:
+      session_uri: The upload session URI, without the scheme.
+      stream: A file-like object positioned at offset, or None.
+      offset: The byte offset of the chunk within the object.
+      length: The number of bytes in the chunk.
+      size: The total size of the object, or None while it is not yet known.
+      hasher: An optional gcs_checksum.StreamHasher fed the chunk bytes.
+
+    Returns:
+      The response dictionary and string content. The response status is
+      RESUME_INCOMPLETE until the final chunk has been committed.
+
+    Raises:
+      gcs_error.GcsError if the API request did not succeed.
+    """
+    headers = {}
+    body = None
+    total = '*'
+    if size is not None: total = '%d' % size
+    if length:
+      headers['Content-Range'] = 'bytes %d-%d/%s' % (
+          offset, offset + length - 1, total)
+      body = gcs_stream.ChunkedReader(
+          stream, length, gcs_stream.DEFAULT_CHUNK_SIZE, hasher, offset)
+    else:
+      headers['Content-Range'] = 'bytes */%s' % total
+    return self._api_request(
+        session_uri, 'PUT', headers=headers, body=body,
+        allowed_statuses=(RESUME_INCOMPLETE,))
+
+  def _copy_prefix(self, bucket_name, prefix, new_bucket_name, new_prefix,
+                   marker, acl, concurrency, delete_source):
+    """Copies, and optionally deletes, every object under a prefix.
+
+    Args:
+      bucket_name: The name of the source bucket.
+      prefix: The string prefix of the source object names.
+      new_bucket_name: The name of the destination bucket.
+      new_prefix: The string destination prefix, or None for prefix.
+      marker: Only process objects whose names sort after this string.
+      acl: A string predefined Google ACL for the copies.
+      concurrency: The number of objects processed at once.
+      delete_source: If True, delete each source object after its copy.
+
+    Yields:
+      (object_name, error, marker) tuples. See copy_prefix.
+
+    Raises:
+      ValueError if the destination lies inside the source prefix.
+    """
+    if not prefix: prefix = ''
+    if new_prefix is None: new_prefix = prefix
+    concurrency = self._get_pool_size(concurrency)
+    if bucket_name == new_bucket_name and new_prefix.startswith(prefix):
+      raise ValueError('%s/%s cannot be copied into itself.' % (
+          bucket_name, prefix))
+
+    # Names in listing order that have been submitted, and the ones among
+    # them that have finished out of order.
+    submitted = collections.deque()
+    finished = set()
+
+    def iter_object_names():
+      for entry in self.list_objects(bucket_name, prefix=prefix,
+                                     marker=marker):
+        submitted.append(entry.name)
+        yield entry.name
+
+    def copy(object_name):
+      self.copy_object(bucket_name, object_name, new_bucket_name,
+                       new_prefix + object_name[len(prefix):], acl)
+      if not delete_source:
+        return
+      try:
+        self.delete_object(bucket_name, object_name)
+      except gcs_error.GcsError, ge:
+        if ge.status != NOT_FOUND:
+          raise
+
+    for object_name, result, error in gcs_pool.imap_unordered(
+        copy, iter_object_names(), concurrency):
+      finished.add(object_name)
+      while submitted and submitted[0] in finished:
+        marker = submitted.popleft()
+        finished.remove(marker)
+      yield object_name, error, marker
+
+  def _verify_content(self, response, content, bucket_name, object_name):
+    """Checks a downloaded object body against its x-goog-hash checksums.
+
+    Args:
+      response: The httplib2.Response of the download.
+      content: The string object body.
+      bucket_name: The name of the bucket.
+      object_name: The name of the object.
+
+    Raises:
+      gcs_error.GcsIntegrityError if the body does not match its checksums.
+    """
+    hasher = gcs_checksum.StreamHasher()
+    hasher.update(content)
+    hasher.verify(response, '%s/%s' % (bucket_name, object_name))
+
+  def _write_body(self, out, content, offset, buffer_size, hasher,
+                  inflater=None):
+    """Writes a response body to a sink in pieces, hashing them on the way.
+
+    Args:
+      out: The gcs_stream.Sink to write to.
+      content: The string response body.
+      offset: The offset of the body in the object.
+      buffer_size: The maximum number of bytes written at once.
+      hasher: The gcs_checksum.StreamHasher of the download.
+      inflater: An optional zlib decompressobj that inflates each piece
+          before it is written.
+
+    Returns:
+      The offset just past the body.
+    """
+    for start in xrange(0, len(content), buffer_size):
+      piece = content[start:start + buffer_size]
+      hasher.update(piece, offset + start)
+      if inflater:
+        out.write(inflater.decompress(piece))
+      else:
+        out.write(piece)
+    return offset + len(content)
+
+  def _decode_content(self, response, content):
+    """Inflates a response body that is still gzip-encoded.
+
+    Args:
+      response: The httplib2.Response of the download.
+      content: The string response body.
+
+    Returns:
+      The string content without its gzip encoding.
+    """
+    if response.get('content-encoding') != 'gzip':
+      return content
+    return zlib.decompress(content, gcs_stream.GZIP_WBITS)
+
+  def _get_committed_offset(self, response):
+    """Reads the number of committed bytes from a resumable upload response.
+
+    Args:
+      response: The httplib2.Response of a RESUME_INCOMPLETE reply.
+
+    Returns:
+      The offset of the first byte the server has not yet committed.
+    """
+    committed = response.get('range')
+    if not committed:
+      return 0
+    return int(committed.rsplit('-', 1)[1]) + 1
+
+  def _compose_object(self, bucket_name, object_name, component_names,
+                      headers=None):
+    """Joins objects in a bucket into a new object with a compose request.
+
+    Args:
+      bucket_name: The name of the bucket holding the components.
+      object_name: The name of the composed object.
+      component_names: A list of at most MAX_COMPOSE_COMPONENTS object names,
+          in order.
+      headers: Optional headers, such as Content-Type, for the new object.
+
+    Returns:
+      The string response from the API call.
+
+    Raises:
+      gcs_error.GcsError if the API request did not succeed.
+    """
+    try:
+      response, content = self._api_request(
+          '%s.%s/%s?compose' % (bucket_name, self._base_url, object_name),
+          'PUT', headers=headers, body=self._get_compose_body(component_names))
+    except gcs_error.GcsError:
+      raise
+    return content
+
+  def _download_slice(self, url, file_path, start, end, etag, buffer_size):
+    """Downloads bytes [start, end) of an object into a preallocated file.
+
+    Each range request is retried by _api_request under the client's retry
+    policy and budget, so the slice adds no retries of its own.
+
+    Args:
+      url: The API URL of the object.
+      file_path: The local file path, already at least end bytes long.
+      start: The offset of the first byte of the slice.
+      end: The offset just past the last byte of the slice.
+      etag: The ETag the object must still have, or None.
+      buffer_size: The maximum number of bytes to request at once.
+
+    Raises:
+      gcs_error.GcsError if the API request did not succeed.
+    """
+    out_file = open(file_path, 'r+b')
+    try:
+      offset = start
+      while offset < end:
+        headers = {'Range': 'bytes=%d-%d' % (
+            offset, min(offset + buffer_size, end) - 1)}
+        if etag: headers['If-Match'] = etag
+        try:
+          response, content = self._api_request(url, headers=headers)
+        except gcs_error.GcsError:
+          raise
+        if response.status != PARTIAL_CONTENT or not content:
+          raise gcs_error.GcsError(
+              response.status, 'Expected partial content for a slice.')
+        out_file.seek(offset)
+        out_file.write(content)
+        offset += len(content)
+    finally:
+      out_file.close()
+
+  def _download_sync_file(self, bucket_name, object_name, file_path,
+                          relative_path, entry, manifest):
+    """Downloads an object for sync_directory and records its digest.
+
+    The object is written to a temporary file that replaces file_path once
+    complete, so an interrupted sync never leaves a truncated file behind.
+
+    Args:
+      bucket_name: The name of the bucket.
+      object_name: The name of the object.
+      file_path: The string local path to write.
+      relative_path: The string path of the file within the synced directory.
+      entry: The gcs_types.ObjectEntry of the object.
+      manifest: The gcs_sync.SyncManifest of the synced directory.
+    """
+    file_dir = os.path.dirname(file_path)
+    if not os.path.isdir(file_dir):
+      try:
+        os.makedirs(file_dir)
+      except OSError:
+        if not os.path.isdir(file_dir):
+          raise
+    temp_path = file_path + gcs_sync.TEMP_SUFFIX
+    try:
+      self.download_object(bucket_name, object_name, temp_path)
+      os.rename(temp_path, file_path)
+    except:
+      if os.path.exists(temp_path): os.remove(temp_path)
+      raise
+    md5 = gcs_sync.get_etag_md5(entry.etag)
+    if md5:
+      stat = os.stat(file_path)
+      manifest.put(relative_path, stat.st_size, stat.st_mtime, md5)
+
   def _get_location_constraint_body(self, location_constraint):
     """Create the XML document for the location constraint object request.
 
@@ -388,6 +1662,22 @@ class GcsXml(gcs.Gcs):
     location_elem.text = location_constraint
     return self._xml_tostring(bucket_config_elem)
 
+  def _get_compose_body(self, component_names):
+    """Create the XML document for the compose request.
+
+    Args:
+      component_names: A list of string object names, in order.
+
+    Returns:
+      The string XML representation of the compose body.
+    """
+    compose_elem = xml.Element('ComposeRequest')
+    for component_name in component_names:
+      component_elem = xml.SubElement(compose_elem, 'Component')
+      name_elem = xml.SubElement(component_elem, 'Name')
+      name_elem.text = component_name
+    return self._xml_tostring(compose_elem)
+
   def _get_cors_body(self, origins, methods, response_headers, max_age_sec):
     """Create the XML document for the cors request.
 
@@ -449,20 +1739,193 @@ class GcsXml(gcs.Gcs):
     body = '<?xml version="1.0" encoding="UTF-8"?>' + body
     return body
 
-  def _api_request(self, url, method=None, headers=None, body=None):
+  def _send_request(self, operation, url, method, headers, body,
+                    cancellation=None):
+    """Sends one HTTP request on the transport and records it in metrics.
+
+    Args:
+      operation: The string operation name, for metrics.
+      url: The API URL endpoint, without the scheme.
+      method: The HTTP request method.
+      headers: The request headers.
+      body: The request body.
+      cancellation: An optional gcs_hedge.Cancellation, passed on to a
+          transport that can interrupt the request.
+
+    Returns:
+      The response dictionary and string content.
+    """
+    request_bytes = 0
+    if body: request_bytes = len(body)
+    limiter = self.concurrency_limiter
+    if limiter: ticket = limiter.acquire()
+    kwargs = {}
+    if cancellation and getattr(self.transport, 'cancels_requests', False):
+      kwargs['cancellation'] = cancellation
+    start = time.time()
+    try:
+      response, content = self.transport.request(
+          'http://' + url, method=method, headers=headers, body=body,
+          **kwargs)
+    except:
+      latency_sec = time.time() - start
+      if limiter:
+        limiter.release(ticket, operation, gcs_metrics.NO_RESPONSE,
+                        latency_sec, request_bytes)
+      self.metrics.record_request(operation, gcs_metrics.NO_RESPONSE,
+                                  latency_sec, request_bytes)
+      raise
+    latency_sec = time.time() - start
+    response_bytes = len(content or '')
+    if limiter:
+      limiter.release(ticket, operation, response.status, latency_sec,
+                      request_bytes + response_bytes)
+    self.metrics.record_request(operation, response.status, latency_sec,
+                                request_bytes, response_bytes)
+    return response, content
+
+  def _verify_upload(self, hasher, response, bucket_name, object_name):
+    """Checks an upload against its checksums, deleting it on a mismatch.
+
+    A corrupt upload is already committed under its name when the mismatch
+    is found, so it is deleted before the error is raised. The delete only
+    matches the generation the upload created, if the server reported one,
+    so a newer write to the same name is kept.
+
+    Args:
+      hasher: The gcs_checksum.StreamHasher fed the uploaded bytes.
+      response: The response that completed the upload.
+      bucket_name: The name of the bucket of the object.
+      object_name: The name of the object.
+
+    Raises:
+      gcs_error.GcsIntegrityError if the upload does not match its checksums.
+    """
+    try:
+      hasher.verify(response, '%s/%s' % (bucket_name, object_name))
+    except gcs_error.GcsIntegrityError:
+      exc_info = sys.exc_info()
+      headers = {}
+      generation = response.get('x-goog-generation')
+      if generation: headers['x-goog-if-generation-match'] = generation
+      try:
+        self._api_request(
+            '%s.%s/%s' % (bucket_name, self._base_url, object_name),
+            'DELETE', headers=headers)
+      except gcs_error.GcsError, ge:
+        logging.warning('Could not delete corrupt upload %s/%s: %s',
+                        bucket_name, object_name, ge)
+      raise exc_info[0], exc_info[1], exc_info[2]
+
+  def _write_object(self, bucket_name, object_name, func):
+    """Sends an object write through the rate limiter, if there is one.
+
+    Args:
+      bucket_name: The name of the bucket written to.
+      object_name: The name of the object written.
+      func: A callable taking no arguments that sends the write.
+
+    Returns:
+      The result of func.
+
+    Raises:
+      gcs_error.GcsWriteSupersededError if a newer write to the object
+          arrived before this one was sent.
+    """
+    if not self.rate_limiter:
+      return func()
+    return self.rate_limiter.call(bucket_name, object_name, func)
+
+  def _get_pool_size(self, concurrency):
+    """Picks the number of workers of a bulk operation.
+
+    Args:
+      concurrency: The number of workers the caller asked for, or None.
+
+    Returns:
+      concurrency if given, otherwise the max_limit of the concurrency
+      limiter if there is one, otherwise gcs_pool.DEFAULT_CONCURRENCY.
+    """
+    if concurrency:
+      return concurrency
+    if self.concurrency_limiter:
+      return self.concurrency_limiter.max_limit
+    return gcs_pool.DEFAULT_CONCURRENCY
+
+  def _get_operation_name(self, url, method, headers):
+    """Names the API operation a request performs, for metrics.
+
+    Args:
+      url: The API URL endpoint, without the scheme.
+      method: The HTTP request method.
+      headers: The request headers.
+
+    Returns:
+      The string operation name, such as get_object or insert_object.
+    """
+    host, _, path = url.partition('/')
+    path, _, query = path.partition('?')
+    if 'upload_id=' in query:
+      return 'upload_chunk'
+    if path:
+      resource = 'object'
+    elif host == self._base_url:
+      resource = 'service'
+    else:
+      resource = 'bucket'
+    subresource = query.partition('&')[0].partition('=')[0]
+    if subresource not in OPERATION_SUBRESOURCES: subresource = ''
+    if method == 'PUT' and 'x-goog-copy-source' in headers:
+      return 'copy_object'
+    if method == 'POST' and 'x-goog-resumable' in headers:
+      return 'start_upload'
+    return OPERATION_NAMES.get(
+        (method, resource, subresource),
+        '%s_%s' % (method.lower(), resource))
+
+  def _get_body_size(self, headers, size_hint):
+    """Works out how many bytes a download request asks for.
+
+    Args:
+      headers: The request headers.
+      size_hint: The expected size of the whole object, or None.
+
+    Returns:
+      The length of a bounded Range, else size_hint.
+    """
+    match = re.match(r'bytes=(\d+)-(\d+)$', headers.get('Range', ''))
+    if match:
+      return int(match.group(2)) - int(match.group(1)) + 1
+    return size_hint
+
+  def _api_request(self, url, method=None, headers=None, body=None,
+                   allowed_statuses=(), idempotent=None, size_hint=None):
     """Send an authorized HTTP request to the Cloud Storage API.
 
+    Failures that may be transient, such as 429 and 5xx statuses and
+    connection errors, are retried according to retry_policy when the request
+    is idempotent and its body can be sent again. Every attempt is recorded in
+    metrics.
+
     Args:
       url: The API URL endpoint.
       method: The HTTP request method (GET, POST, etc).
       headers: Any additional headers to send.
       body: The request body.
+      allowed_statuses: Statuses of 300 or above that should be returned to
+          the caller rather than raised.
+      idempotent: Whether the request may safely be sent more than once.
+          Defaults to True for the methods in gcs_retry.IDEMPOTENT_METHODS.
+      size_hint: The expected size of a downloaded object body, if known,
+          used to decide whether the request may be hedged.
 
     Returns:
       The response dictionary and string content.
 
     Raises:
-      gcs_error.GcsError if the API request did not succeed.
+      gcs_error.GcsError if the API request did not succeed. A request that
+      failed without a response, such as on a connection error, raises one
+      with a status of None.
     """
     if not method: method = self.default_method
     if not headers: headers = {}
@@ -475,13 +1938,51 @@ class GcsXml(gcs.Gcs):
       else:
         headers['Content-Length'] = '0'
 
-    try:
-      response, content = self.auth_http.request(
-          'http://' + url, method=method, headers=headers, body=body)
-    except httplib2.ServerNotFoundError, se:
-      raise gcs_error.GcsError(NOT_FOUND, 'Server not found.')
-
-    if response.status >= 300:
-      raise gcs_error.GcsError(response.status, response.reason)
-
-    return response, content
+    if idempotent is None: idempotent = method in gcs_retry.IDEMPOTENT_METHODS
+    if hasattr(body, 'read'):
+      idempotent = idempotent and body.seekable()
+    operation = self._get_operation_name(url, method, headers)
+    hedged = (self.hedge_policy and method in gcs_hedge.HEDGED_METHODS and
+              not body)
+    if hedged and operation in BODY_OPERATIONS:
+      hedged = self.hedge_policy.is_small(
+          operation, self._get_body_size(headers, size_hint))
+    self.retry_policy.record_request()
+    attempt = 0
+    while True:
+      attempt += 1
+      retry_after = None
+      try:
+        if hedged:
+          response, content = self.hedge_policy.call(
+              operation, lambda cancellation: self._send_request(
+                  operation, url, method, dict(headers), None, cancellation))
+        else:
+          response, content = self._send_request(
+              operation, url, method, headers, body)
+      except httplib2.ServerNotFoundError, se:
+        raise gcs_error.GcsError(NOT_FOUND, 'Server not found.')
+      except (httplib2.HttpLib2Error, httplib.HTTPException, IOError), e:
+        error = gcs_error.GcsError(
+            None, '%s: %s' % (e.__class__.__name__, e), retryable=True)
+      else:
+        if response.status < 300 or response.status in allowed_statuses:
+          if (self.hedge_policy and operation in BODY_OPERATIONS and
+              response.status < 300 and 'Range' not in headers):
+            self.hedge_policy.record_size(operation, len(content))
+          return response, content
+        error = gcs_error.GcsError(response.status, response.reason)
+        if not error.retryable:
+          raise error
+        retry_after = response.get('retry-after')
+
+      delay = None
+      if idempotent:
+        delay = self.retry_policy.get_delay(attempt, retry_after)
+      if delay is None:
+        raise error
+      self.metrics.record_retry(operation)
+      logging.warning('Retrying %s %s in %.2fs after attempt %d failed: %s',
+                      method, url, delay, attempt, error)
+      time.sleep(delay)
+      if hasattr(body, 'seek'): body.seek(0)
@@ -16,10 +16,12 @@
 
 Usage:
   python main.py [--logging_level=<log-level>]
+  python main.py --batch=<manifest.jsonl or -> [--batch_results=<path>]
 """
 
 __author__ = 'kbrisbin@google.com (Kathryn Hurley)'
 
+import json
 import logging
 import os
 import sys
@@ -30,7 +32,17 @@ import oauth2client.client as oauthclient
 import oauth2client.file as oauthfile
 import oauth2client.tools as oauthtools
 
+import gcs.gcs_auth as gcs_auth
+import gcs.gcs_batch as gcs_batch
+import gcs.gcs_body_cache as gcs_body_cache
 import gcs.gcs_commands as gcs_commands
+import gcs.gcs_concurrency as gcs_concurrency
+import gcs.gcs_hedge as gcs_hedge
+import gcs.gcs_http2 as gcs_http2
+import gcs.gcs_metrics as gcs_metrics
+import gcs.gcs_pool as gcs_pool
+import gcs.gcs_ratelimit as gcs_ratelimit
+import gcs.gcs_transport as gcs_transport
 from gcs.gcs_xml import GcsXml as Gcs
 
 FLAGS = gflags.FLAGS
@@ -41,6 +53,95 @@ FLAGS = gflags.FLAGS
 LOG_LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
 gflags.DEFINE_enum(
     'logging_level', 'INFO', LOG_LEVELS, 'Set the level of logging detail.')
+gflags.DEFINE_integer(
+    'max_connections', gcs_transport.DEFAULT_MAX_CONNECTIONS,
+    'Maximum number of pooled HTTP connections.')
+gflags.DEFINE_integer(
+    'max_connections_per_host', gcs_transport.DEFAULT_MAX_PER_HOST,
+    'Maximum number of pooled HTTP connections to a single host.')
+gflags.DEFINE_integer(
+    'connection_idle_timeout', gcs_transport.DEFAULT_IDLE_TIMEOUT_SEC,
+    'Seconds after which an idle pooled HTTP connection is closed.')
+gflags.DEFINE_boolean(
+    'http2', False,
+    'Multiplex requests over a few HTTP/2 connections instead of pooling '
+    'HTTP/1.1 connections. Requires the h2 package.')
+gflags.DEFINE_string(
+    'http2_endpoint', '',
+    'host:port that HTTP/2 connections are made to, such as localhost:8080 '
+    'for a local server. Defaults to Cloud Storage.')
+gflags.DEFINE_boolean(
+    'http2_plaintext', False,
+    'Speak HTTP/2 without TLS (h2c with prior knowledge), for local servers.')
+gflags.DEFINE_integer(
+    'http2_connections', gcs_http2.DEFAULT_MAX_CONNECTIONS,
+    'Maximum number of HTTP/2 connections.')
+gflags.DEFINE_integer(
+    'http2_max_streams', gcs_http2.DEFAULT_MAX_STREAMS,
+    'Maximum number of concurrent streams per HTTP/2 connection.')
+gflags.DEFINE_integer(
+    'http2_stream_window_kb', gcs_http2.DEFAULT_STREAM_WINDOW_SIZE / 1024,
+    'HTTP/2 receive window of each stream, in kilobytes.')
+gflags.DEFINE_integer(
+    'http2_connection_window_kb',
+    gcs_http2.DEFAULT_CONNECTION_WINDOW_SIZE / 1024,
+    'HTTP/2 receive window of each connection, in kilobytes.')
+gflags.DEFINE_boolean(
+    'adaptive_concurrency', False,
+    'Adapt the number of requests in flight to latency and throttling '
+    'responses instead of running a fixed number of workers per bulk '
+    'operation.')
+gflags.DEFINE_integer(
+    'max_concurrency', gcs_concurrency.DEFAULT_MAX_LIMIT,
+    'Highest number of requests in flight with --adaptive_concurrency.')
+gflags.DEFINE_float(
+    'object_write_rate', 0,
+    'Writes per second allowed to each object. A write queued behind a '
+    'newer write to the same object is dropped. Disabled if 0.')
+gflags.DEFINE_float(
+    'bucket_write_rate', gcs_ratelimit.DEFAULT_BUCKET_RATE,
+    'Starting writes per second allowed to each bucket with '
+    '--object_write_rate. The rate doubles every 20 minutes of use.')
+gflags.DEFINE_float(
+    'hedge_percentile', 0,
+    'Latency percentile, between 0 and 1, after which a second copy of a '
+    'slow read request is sent. Disabled if 0.')
+gflags.DEFINE_float(
+    'hedge_budget', gcs_hedge.DEFAULT_BUDGET_RATIO,
+    'Maximum fraction of extra requests that hedging may send.')
+gflags.DEFINE_integer(
+    'hedge_max_bytes', gcs_hedge.DEFAULT_MAX_HEDGE_BYTES,
+    'Largest object download, in bytes, that hedging may send twice.')
+gflags.DEFINE_string(
+    'object_cache_dir', '',
+    'Directory for caching downloaded object bodies. Disabled if empty.')
+gflags.DEFINE_integer(
+    'object_cache_max_mb', gcs_body_cache.DEFAULT_MAX_BYTES / (1024 * 1024),
+    'Maximum size of the object body cache in megabytes.')
+gflags.DEFINE_integer(
+    'token_refresh_margin', gcs_auth.DEFAULT_REFRESH_MARGIN_SEC,
+    'Seconds before expiry at which the access token is refreshed in the '
+    'background.')
+gflags.DEFINE_string(
+    'batch', '',
+    'Run the operations in this JSON lines manifest, or - for stdin, instead '
+    'of the interactive menu.')
+gflags.DEFINE_string(
+    'batch_results', '-',
+    'File that receives one JSON line of results per batch operation and a '
+    'summary line, or - for stdout.')
+gflags.DEFINE_integer(
+    'batch_concurrency', gcs_pool.DEFAULT_CONCURRENCY,
+    'Number of batch operations run at once.')
+gflags.DEFINE_string(
+    'metrics_json', '',
+    'File that receives the request metrics as JSON on exit. Disabled if '
+    'empty.')
+gflags.DEFINE_string(
+    'metrics_prometheus', '',
+    'File that receives the request metrics in the Prometheus text format on '
+    'exit, for example for the node exporter textfile collector. Disabled if '
+    'empty.')
 
 CLIENT_SECRETS = 'client_secrets.json'
 CREDENTIALS_FILE = 'gcs_credentials.dat'
@@ -48,7 +149,9 @@ PROJECT_FILE = 'project_info'
 SCOPE = 'https://www.googleapis.com/auth/devstorage.full_control'
 
 
-def init_client(auth_http, project_id):
+def init_client(auth_http, project_id, transport=None, body_cache=None,
+                metrics=None, hedge_policy=None, concurrency_limiter=None,
+                rate_limiter=None):
   """Initializes the gcs.Gcs client.
 
   Clients are available per module. To switch the client, update the import
@@ -57,11 +160,21 @@ def init_client(auth_http, project_id):
   Args:
     auth_http: An authorized httplib2.Http instance.
     project_id: A string Cloud Storage project id, ex: '123456'.
+    transport: An optional gcs_transport.Transport that sends the requests.
+    body_cache: An optional gcs_body_cache.ObjectBodyCache for get_object.
+    metrics: An optional gcs_metrics.Metrics that records every request.
+    hedge_policy: An optional gcs_hedge.HedgePolicy for slow reads.
+    concurrency_limiter: An optional gcs_concurrency.ConcurrencyLimiter.
+    rate_limiter: An optional gcs_ratelimit.WriteRateLimiter.
 
   Returns:
     An instance of gcs.Gcs.
   """
-  gcs_client = Gcs(auth_http, project_id)
+  gcs_client = Gcs(auth_http, project_id, transport=transport,
+                   body_cache=body_cache, metrics=metrics,
+                   hedge_policy=hedge_policy,
+                   concurrency_limiter=concurrency_limiter,
+                   rate_limiter=rate_limiter)
   return gcs_client
 
 
@@ -85,11 +198,11 @@ def get_project_id():
   return project_id
 
 
-def get_auth_http():
+def get_credentials():
   """Runs the OAuth 2.0 installed application flow.
 
   Returns:
-    An authorized httplib2.Http instance.
+    An oauth2client.client.Credentials instance.
   """
 
   message = ('Please configure OAuth 2.0 by populating the client_secrets.json '
@@ -101,11 +214,97 @@ def get_auth_http():
   credentials = storage.get()
   if credentials is None or credentials.invalid:
     credentials = oauthtools.run(flow, storage)
-  http = httplib2.Http()
+  return credentials
+
+
+def get_auth_http(credentials=None):
+  """Authorizes a new gcs_transport.EncodedContentHttp instance.
+
+  Args:
+    credentials: Optional credentials, or a gcs_auth.CredentialManager, to
+        authorize with. Defaults to running the OAuth 2.0 installed
+        application flow.
+
+  Returns:
+    An authorized httplib2.Http instance that can return gzip-encoded bodies.
+  """
+  if credentials is None: credentials = get_credentials()
+  http = gcs_transport.EncodedContentHttp()
   auth_http = credentials.authorize(http)
   return auth_http
 
 
+def run_batch(gcs_client):
+  """Runs the --batch manifest and logs a throughput summary.
+
+  Args:
+    gcs_client: An instance of gcs.Gcs.
+
+  Returns:
+    The process exit status: 0 if every operation succeeded, otherwise 1.
+  """
+  manifest = sys.stdin
+  if FLAGS.batch != '-': manifest = open(FLAGS.batch, 'r')
+  results = sys.stdout
+  if FLAGS.batch_results != '-': results = open(FLAGS.batch_results, 'w')
+  try:
+    summary = gcs_batch.run_batch(
+        gcs_client, manifest, results, FLAGS.batch_concurrency)
+  finally:
+    if manifest is not sys.stdin: manifest.close()
+    if results is not sys.stdout: results.close()
+  logging.info(
+      '%(operations)d operations, %(succeeded)d succeeded, %(failed)d failed '
+      'in %(elapsed_sec).1fs (%(operations_per_sec).1f/s)', summary)
+  if summary['failed']:
+    return 1
+  return 0
+
+
+def get_http2_transport(credentials):
+  """Builds the --http2 transport, authorized with the managed token.
+
+  Args:
+    credentials: The gcs_auth.CredentialManager.
+
+  Returns:
+    An authorized gcs_http2.Http2Transport.
+  """
+  host = gcs_http2.GCS_HOST
+  port = None
+  if FLAGS.http2_endpoint:
+    host, _, port = FLAGS.http2_endpoint.partition(':')
+    port = int(port) if port else None
+  transport = gcs_http2.Http2Transport(
+      host, port, secure=not FLAGS.http2_plaintext,
+      max_connections=FLAGS.http2_connections,
+      max_streams=FLAGS.http2_max_streams,
+      stream_window_size=FLAGS.http2_stream_window_kb * 1024,
+      connection_window_size=FLAGS.http2_connection_window_kb * 1024)
+  return credentials.authorize(transport)
+
+
+def write_metrics(metrics):
+  """Writes the request metrics to the --metrics_* files.
+
+  Args:
+    metrics: The gcs_metrics.Metrics recorded by the client.
+  """
+  if FLAGS.metrics_json:
+    metrics_file = open(FLAGS.metrics_json, 'w')
+    try:
+      json.dump(metrics.get_snapshot(), metrics_file, indent=2,
+                sort_keys=True)
+    finally:
+      metrics_file.close()
+  if FLAGS.metrics_prometheus:
+    metrics_file = open(FLAGS.metrics_prometheus, 'w')
+    try:
+      metrics_file.write(metrics.to_prometheus())
+    finally:
+      metrics_file.close()
+
+
 def main(argv):
   """Main application control."""
   try:
@@ -121,9 +320,47 @@ def main(argv):
   logging.basicConfig(level=numeric_level)
   if FLAGS.logging_level == 'DEBUG': httplib2.debuglevel = 1
 
-  auth_http = get_auth_http()
+  credentials = gcs_auth.CredentialManager(
+      get_credentials(), refresh_margin_sec=FLAGS.token_refresh_margin)
+  credentials.start()
+  auth_http = get_auth_http(credentials)
   project_id = get_project_id()
-  gcs_client = init_client(auth_http, project_id)
+  if FLAGS.http2:
+    transport = get_http2_transport(credentials)
+  else:
+    transport = gcs_transport.PooledHttpTransport(
+        lambda: get_auth_http(credentials),
+        max_connections=FLAGS.max_connections,
+        max_per_host=FLAGS.max_connections_per_host,
+        idle_timeout_sec=FLAGS.connection_idle_timeout,
+        decodes_content=False)
+  body_cache = None
+  if FLAGS.object_cache_dir:
+    body_cache = gcs_body_cache.ObjectBodyCache(
+        FLAGS.object_cache_dir, FLAGS.object_cache_max_mb * 1024 * 1024)
+  metrics = gcs_metrics.Metrics()
+  hedge_policy = None
+  if FLAGS.hedge_percentile:
+    hedge_policy = gcs_hedge.HedgePolicy(
+        FLAGS.hedge_percentile, FLAGS.hedge_budget,
+        max_hedge_bytes=FLAGS.hedge_max_bytes)
+  concurrency_limiter = None
+  if FLAGS.adaptive_concurrency:
+    concurrency_limiter = gcs_concurrency.ConcurrencyLimiter(
+        max_limit=FLAGS.max_concurrency, metrics=metrics)
+  rate_limiter = None
+  if FLAGS.object_write_rate:
+    rate_limiter = gcs_ratelimit.WriteRateLimiter(
+        object_rate=FLAGS.object_write_rate,
+        bucket_rate=FLAGS.bucket_write_rate)
+  gcs_client = init_client(auth_http, project_id, transport, body_cache,
+                           metrics, hedge_policy, concurrency_limiter,
+                           rate_limiter)
+
+  if FLAGS.batch:
+    status = run_batch(gcs_client)
+    write_metrics(metrics)
+    sys.exit(status)
 
   commands = [
       gcs_commands.GetBucketsCommand('Get all buckets', gcs_client),
@@ -138,7 +375,10 @@ def main(argv):
       gcs_commands.GetObjectMetadataCommand('Get object metadata', gcs_client),
       gcs_commands.InsertObjectCommand('Upload an object', gcs_client),
       gcs_commands.CopyObjectCommand('Copy an object', gcs_client),
+      gcs_commands.CopyPrefixCommand('Copy objects by prefix', gcs_client),
+      gcs_commands.MovePrefixCommand('Move objects by prefix', gcs_client),
       gcs_commands.DeleteObjectCommand('Delete an object', gcs_client),
+      gcs_commands.SyncDirectoryCommand('Sync a directory', gcs_client),
   ]
 
   while True:
@@ -166,5 +406,7 @@ def main(argv):
       logging.error('Error running command. Please try again.')
       logging.error(e)
 
+  write_metrics(metrics)
+
 if __name__ == '__main__':
   main(sys.argv)